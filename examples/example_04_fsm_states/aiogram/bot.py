@@ -2,27 +2,29 @@ import asyncio
 import logging
 import sys
 from os import getenv
+from typing import Optional
 
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import Message, ReplyKeyboardRemove
 
+from storage import SQLiteStorage, transition
+from wizard import REGISTRATION, InvalidInput
+
 logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 
 TOKEN = getenv("BOT_TOKEN")
 router = Router()
 
 
-# Определяем состояния
-class RegistrationForm(StatesGroup):
-    name = State()      # Ожидание имени
-    age = State()       # Ожидание возраста
-    city = State()      # Ожидание города
+def in_registration(message: Message, raw_state: Optional[str]) -> bool:
+    """
+    Фильтр: пользователь заполняет анкету регистрации
+    """
+    return raw_state in REGISTRATION
 
 
 @router.message(CommandStart())
@@ -30,10 +32,10 @@ async def command_start(message: Message, state: FSMContext) -> None:
     """
     Начало регистрации
     """
-    await state.set_state(RegistrationForm.name)
+    await state.set_state(REGISTRATION.first_state)
     await message.answer(
         "Привет! Давайте познакомимся.\n"
-        "Как вас зовут?\n\n"
+        f"{REGISTRATION.prompt(REGISTRATION.first_state, {})}\n\n"
         "Для отмены используйте /cancel"
     )
 
@@ -55,60 +57,29 @@ async def cancel_handler(message: Message, state: FSMContext) -> None:
     )
 
 
-@router.message(RegistrationForm.name)
-async def process_name(message: Message, state: FSMContext) -> None:
+@router.message(F.text, in_registration)
+async def registration_step(message: Message, state: FSMContext, raw_state: str) -> None:
     """
-    Обработка имени и переход к возрасту
-    """
-    # Сохраняем имя в контексте
-    await state.update_data(name=message.text)
-
-    # Переходим к следующему состоянию
-    await state.set_state(RegistrationForm.age)
-
-    await message.answer(f"Приятно познакомиться, {message.text}!\nСколько вам лет?")
+    Обработка ответа на любой шаг анкеты
 
-
-@router.message(RegistrationForm.age)
-async def process_age(message: Message, state: FSMContext) -> None:
-    """
-    Обработка возраста и переход к городу
+    Шаг определяется по состоянию через таблицу REGISTRATION (wizard.py),
+    поэтому на все шаги хватает одного обработчика.
     """
-    # Проверяем, что введено число
-    if not message.text.isdigit():
-        await message.answer("Пожалуйста, введите возраст числом.")
+    try:
+        step = REGISTRATION.advance(raw_state, message.text)
+    except InvalidInput as error:
+        # Ответ не подошел - остаемся на том же шаге
+        await message.answer(str(error))
         return
 
-    age = int(message.text)
+    # Сохраняем ответ и переходим к следующему шагу одной операцией хранилища
+    data = await transition(state, step.state, **step.data)
 
-    if age < 0 or age > 120:
-        await message.answer("Введите корректный возраст (от 0 до 120).")
+    if not step.done:
+        await message.answer(REGISTRATION.prompt(step.state, data))
         return
 
-    # Сохраняем возраст
-    await state.update_data(age=age)
-
-    # Переходим к следующему состоянию
-    await state.set_state(RegistrationForm.city)
-
-    await message.answer("В каком городе вы живете?")
-
-
-@router.message(RegistrationForm.city)
-async def process_city(message: Message, state: FSMContext) -> None:
-    """
-    Обработка города и завершение регистрации
-    """
-    # Сохраняем город
-    await state.update_data(city=message.text)
-
-    # Получаем все данные
-    data = await state.get_data()
-
-    # Очищаем состояние
-    await state.clear()
-
-    # Выводим результат
+    # Анкета заполнена: выводим результат
     await message.answer(
         f"Регистрация завершена!\n\n"
         f"📝 Ваши данные:\n"
@@ -118,12 +89,32 @@ async def process_city(message: Message, state: FSMContext) -> None:
     )
 
 
+def create_dispatcher() -> Dispatcher:
+    """
+    Выбор FSM-хранилища: Redis, если задан REDIS_URL (бот запущен
+    несколькими worker'ами), иначе файл SQLite
+    """
+    redis_url = getenv("REDIS_URL")
+    if redis_url:
+        # redis нужен только для общего хранилища, поэтому импортируем здесь
+        from redis.asyncio import Redis
+        from shared_storage import SharedEventIsolation, SharedStorage
+
+        redis = Redis.from_url(redis_url, decode_responses=True)
+        return Dispatcher(
+            storage=SharedStorage(redis),
+            events_isolation=SharedEventIsolation(redis)
+        )
+
+    # Состояния хранятся в SQLite и переживают перезапуск бота
+    return Dispatcher(storage=SQLiteStorage("fsm.db"))
+
+
 async def main() -> None:
     bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 
-    # Используем MemoryStorage для хранения состояний
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
+    # Dispatcher сам закроет хранилище при остановке
+    dp = create_dispatcher()
 
     dp.include_router(router)
     await dp.start_polling(bot)
@@ -0,0 +1,192 @@
+"""
+Redis внутри процесса - замена сервера Redis для тестов
+
+LocalRedis понимает те же вызовы redis.asyncio.Redis (с
+decode_responses=True), которыми пользуется SharedStorage: GET, SET,
+DEL, HSET, HGETALL, EXPIRE, pipeline и register_script. Несколько
+Dispatcher'ов с одним LocalRedis ведут себя как несколько worker'ов с
+общим Redis.
+
+    redis = LocalRedis(latency=0.002)  # имитация сетевой задержки 2 мс
+    dp = Dispatcher(storage=SharedStorage(redis))
+"""
+
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from shared_storage import RELEASE_LOCK_SCRIPT
+
+
+class LocalRedis:
+    """
+    Подмножество команд Redis над словарем в памяти
+
+    Каждый вызов команды или pipeline.execute() ждет latency секунд,
+    как один сетевой запрос. Команды pipeline выполняются подряд без
+    переключения задач, то есть атомарно, как MULTI/EXEC.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        """
+        Args:
+            latency: Задержка одного запроса к "серверу" (сек)
+        """
+        self.latency = latency
+        self.requests = 0
+        # Ключ -> (значение, момент истечения по time.monotonic() или None)
+        self._values: Dict[str, Tuple[Any, Optional[float]]] = {}
+
+    async def _request(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _get(self, name: str) -> Any:
+        item = self._values.get(name)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[name]
+            return None
+        return value
+
+    def _execute(self, command: str, *args, **kwargs) -> Any:
+        return getattr(self, f"_cmd_{command}")(*args, **kwargs)
+
+    def _cmd_get(self, name: str) -> Optional[str]:
+        return self._get(name)
+
+    def _cmd_set(
+        self,
+        name: str,
+        value: str,
+        ex: Optional[float] = None,
+        px: Optional[int] = None,
+        nx: bool = False
+    ) -> Optional[bool]:
+        if nx and self._get(name) is not None:
+            return None
+        if px is not None:
+            ex = px / 1000
+        expires_at = time.monotonic() + ex if ex is not None else None
+        self._values[name] = (str(value), expires_at)
+        return True
+
+    def _cmd_delete(self, *names: str) -> int:
+        deleted = 0
+        for name in names:
+            if self._get(name) is not None:
+                del self._values[name]
+                deleted += 1
+        return deleted
+
+    def _cmd_hset(self, name: str, mapping: Dict[str, str]) -> int:
+        current = self._get(name)
+        if current is None:
+            current = {}
+            self._values[name] = (current, None)
+        added = len(mapping.keys() - current.keys())
+        current.update({field: str(value) for field, value in mapping.items()})
+        return added
+
+    def _cmd_hgetall(self, name: str) -> Dict[str, str]:
+        return dict(self._get(name) or {})
+
+    def _cmd_expire(self, name: str, seconds: float) -> bool:
+        value = self._get(name)
+        if value is None:
+            return False
+        self._values[name] = (value, time.monotonic() + seconds)
+        return True
+
+    async def get(self, name: str) -> Optional[str]:
+        await self._request()
+        return self._cmd_get(name)
+
+    async def set(self, name: str, value: str, **kwargs) -> Optional[bool]:
+        await self._request()
+        return self._cmd_set(name, value, **kwargs)
+
+    async def delete(self, *names: str) -> int:
+        await self._request()
+        return self._cmd_delete(*names)
+
+    async def hset(self, name: str, mapping: Dict[str, str]) -> int:
+        await self._request()
+        return self._cmd_hset(name, mapping)
+
+    async def hgetall(self, name: str) -> Dict[str, str]:
+        await self._request()
+        return self._cmd_hgetall(name)
+
+    async def expire(self, name: str, seconds: float) -> bool:
+        await self._request()
+        return self._cmd_expire(name, seconds)
+
+    def pipeline(self, transaction: bool = True) -> "LocalPipeline":
+        return LocalPipeline(self)
+
+    def register_script(self, script: str) -> "LocalScript":
+        return LocalScript(self, SCRIPTS[script])
+
+    def _release_lock(self, keys: Sequence[str], args: Sequence[str]) -> int:
+        if self._get(keys[0]) == args[0]:
+            return self._cmd_delete(keys[0])
+        return 0
+
+    async def aclose(self) -> None:
+        pass
+
+
+class LocalPipeline:
+    """
+    Pipeline LocalRedis: команды копятся и выполняются одним запросом
+    """
+
+    def __init__(self, redis: LocalRedis):
+        self._redis = redis
+        self._commands: List[Tuple[str, tuple, dict]] = []
+
+    async def __aenter__(self) -> "LocalPipeline":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._commands = []
+
+    def __getattr__(self, command: str):
+        if not hasattr(self._redis, f"_cmd_{command}"):
+            raise AttributeError(command)
+
+        def queue(*args, **kwargs) -> "LocalPipeline":
+            self._commands.append((command, args, kwargs))
+            return self
+
+        return queue
+
+    async def execute(self) -> List[Any]:
+        commands, self._commands = self._commands, []
+        await self._redis._request()
+        return [self._redis._execute(command, *args, **kwargs) for command, args, kwargs in commands]
+
+
+# Lua здесь не выполняется: вместо каждого известного скрипта
+# вызывается его аналог на Python (атомарный - без переключения задач)
+SCRIPTS: Dict[str, Callable[[LocalRedis, Sequence[str], Sequence[str]], Any]] = {
+    RELEASE_LOCK_SCRIPT: LocalRedis._release_lock,
+}
+
+
+class LocalScript:
+    """
+    Скрипт LocalRedis: вызов, как у redis.commands.core.AsyncScript
+    """
+
+    def __init__(self, redis: LocalRedis, func: Callable[..., Any]):
+        self._redis = redis
+        self._func = func
+
+    async def __call__(self, keys: Sequence[str] = (), args: Sequence[str] = ()) -> Any:
+        await self._redis._request()
+        return self._func(self._redis, keys, args)
@@ -0,0 +1,203 @@
+"""
+Общее FSM-хранилище для нескольких процессов бота (Redis)
+
+SQLiteStorage и MemoryStorage принадлежат одному процессу: если бот
+запущен несколькими worker'ами, каждый видит только свои диалоги.
+SharedStorage хранит состояния в Redis, поэтому пользователь продолжает
+регистрацию, на какой бы worker ни пришло его следующее сообщение.
+
+- Каждая операция хранилища - одна команда или один pipeline
+  (MULTI/EXEC), то есть один сетевой запрос. transition() сохраняет
+  данные шага, меняет состояние и читает все данные анкеты за один
+  запрос вместо трех-четырех.
+- SharedEventIsolation не дает двум worker'ам одновременно обрабатывать
+  сообщения одного пользователя.
+
+Используются только команды GET, SET, DEL, HSET, HGETALL, EXPIRE и
+скрипт снятия блокировки, поэтому вместо Redis в тестах подходит
+LocalRedis (local_redis.py).
+
+    redis = Redis.from_url("redis://localhost:6379/0", decode_responses=True)
+    dp = Dispatcher(
+        storage=SharedStorage(redis),
+        events_isolation=SharedEventIsolation(redis)
+    )
+"""
+
+import asyncio
+import json
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import (
+    BaseEventIsolation,
+    DefaultKeyBuilder,
+    KeyBuilder,
+    StateType,
+    StorageKey,
+)
+
+from storage import TransitionStorage
+
+# Снятие блокировки: ключ удаляется, только если в нем все еще наш токен.
+# Проверка и удаление выполняются атомарно на сервере - между отдельными
+# GET и DEL блокировка могла истечь и достаться другому worker'у
+RELEASE_LOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class SharedStorage(TransitionStorage):
+    """
+    FSM-хранилище в Redis для нескольких процессов бота
+
+    Состояние ключа хранится строкой <key>:state, данные - хешем
+    <key>:data, в котором каждое поле записано в JSON. Благодаря хешу
+    новые поля добавляются командой HSET без чтения старых данных.
+    Каждая запись продлевает жизнь обоих ключей на ttl секунд, поэтому
+    брошенные диалоги Redis удаляет сам.
+
+    Клиент должен быть создан с decode_responses=True.
+    Данные FSM должны сериализоваться в JSON.
+    """
+
+    def __init__(
+        self,
+        redis: Any,
+        ttl: int = 24 * 3600,
+        key_builder: Optional[KeyBuilder] = None
+    ):
+        """
+        Args:
+            redis: Клиент redis.asyncio.Redis или LocalRedis
+            ttl: Через сколько секунд без изменений диалог удаляется
+            key_builder: Построитель ключей (по умолчанию учитывает bot_id и destiny)
+        """
+        self.redis = redis
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(
+            prefix="fsm", with_bot_id=True, with_destiny=True
+        )
+
+    def _keys(self, key: StorageKey):
+        return self.key_builder.build(key, "state"), self.key_builder.build(key, "data")
+
+    @staticmethod
+    def _decode(raw: Mapping[str, str]) -> Dict[str, Any]:
+        return {field: json.loads(value) for field, value in raw.items()}
+
+    @staticmethod
+    def _encode(data: Mapping[str, Any]) -> Dict[str, str]:
+        return {field: json.dumps(value, ensure_ascii=False) for field, value in data.items()}
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state_key = self.key_builder.build(key, "state")
+        state = _state_name(state)
+        if state is None:
+            await self.redis.delete(state_key)
+        else:
+            await self.redis.set(state_key, state, ex=self.ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self.redis.get(self.key_builder.build(key, "state"))
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+
+        data_key = self.key_builder.build(key, "data")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(data_key)
+            if data:
+                pipe.hset(data_key, mapping=self._encode(data))
+                pipe.expire(data_key, self.ttl)
+            await pipe.execute()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._decode(await self.redis.hgetall(self.key_builder.build(key, "data")))
+
+    async def transition(
+        self,
+        key: StorageKey,
+        state: StateType = None,
+        data: Optional[Mapping[str, Any]] = None
+    ) -> Dict[str, Any]:
+        state_key, data_key = self._keys(key)
+        state = _state_name(state)
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if state is None:
+                # Конец диалога: читаем данные и удаляем ключ целиком
+                pipe.hgetall(data_key)
+                pipe.delete(state_key, data_key)
+                stored, _ = await pipe.execute()
+                return {**self._decode(stored), **(data or {})}
+
+            if data:
+                pipe.hset(data_key, mapping=self._encode(data))
+            pipe.expire(data_key, self.ttl)
+            pipe.set(state_key, state, ex=self.ttl)
+            pipe.hgetall(data_key)
+            results = await pipe.execute()
+        return self._decode(results[-1])
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+class SharedEventIsolation(BaseEventIsolation):
+    """
+    Блокировка пользователя в Redis на время обработки update
+
+    Если два сообщения одного пользователя попали на разные worker'ы,
+    второе ждет, пока первое не будет обработано, и видит уже новое
+    состояние. Блокировка снимается сама через timeout секунд, если
+    worker упал, не успев ее снять.
+    """
+
+    def __init__(
+        self,
+        redis: Any,
+        timeout: float = 60.0,
+        poll_interval: float = 0.01,
+        key_builder: Optional[KeyBuilder] = None
+    ):
+        """
+        Args:
+            redis: Тот же клиент, что и у SharedStorage
+            timeout: Максимальное время владения блокировкой (сек)
+            poll_interval: Пауза между попытками взять занятую блокировку (сек)
+            key_builder: Построитель ключей (по умолчанию как у SharedStorage)
+        """
+        self.redis = redis
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(
+            prefix="fsm", with_bot_id=True, with_destiny=True
+        )
+        self._release = redis.register_script(RELEASE_LOCK_SCRIPT)
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        lock_key = self.key_builder.build(key, "lock")
+        token = uuid.uuid4().hex
+        timeout_ms = int(self.timeout * 1000)
+        while not await self.redis.set(lock_key, token, nx=True, px=timeout_ms):
+            await asyncio.sleep(self.poll_interval)
+        try:
+            yield
+        finally:
+            # Не снимаем чужую блокировку, если наша уже истекла
+            await self._release(keys=[lock_key], args=[token])
+
+    async def close(self) -> None:
+        pass
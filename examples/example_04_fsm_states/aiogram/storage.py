@@ -0,0 +1,372 @@
+"""
+FSM-хранилище aiogram в файле SQLite
+
+В отличие от MemoryStorage:
+- незавершенные регистрации переживают перезапуск бота
+- брошенные диалоги удаляются через ttl секунд бездействия,
+  поэтому файл и память не растут бесконечно
+
+Подключается так же, как любое хранилище aiogram:
+
+    dp = Dispatcher(storage=SQLiteStorage("fsm.db"))
+
+Переход к следующему шагу диалога делается функцией transition():
+новое состояние и данные шага записываются одной операцией хранилища
+вместо update_data() + set_state().
+"""
+
+import asyncio
+import json
+import logging
+import time
+from contextlib import suppress
+from typing import Any, Dict, Mapping, Optional
+
+import aiosqlite
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+# Настройки SQLite, применяются при каждом открытии соединения
+PRAGMAS = (
+    # WAL: чтение состояний не ждет записи накопленных изменений
+    "PRAGMA journal_mode = WAL",
+    # В режиме WAL не теряет данные при падении процесса, но не делает
+    # fsync на каждый commit
+    "PRAGMA synchronous = NORMAL",
+)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS fsm_states_updated_at ON fsm_states (updated_at);
+"""
+
+UPSERT_SQL = """
+    INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+    ON CONFLICT (key) DO UPDATE SET
+        state = excluded.state,
+        data = excluded.data,
+        updated_at = excluded.updated_at
+"""
+
+
+async def _transition_by_steps(
+    storage: BaseStorage,
+    key: StorageKey,
+    state: StateType,
+    data: Mapping[str, Any]
+) -> Dict[str, Any]:
+    """
+    Переход через отдельные операции хранилища (по одному запросу на каждую)
+    """
+    merged = await storage.get_data(key)
+    merged.update(data)
+    if state is None:
+        await storage.set_state(key, None)
+        await storage.set_data(key, {})
+    else:
+        await storage.set_data(key, merged)
+        await storage.set_state(key, state)
+    return merged
+
+
+class TransitionStorage(BaseStorage):
+    """
+    FSM-хранилище, которое умеет переход к следующему шагу диалога
+
+    Хранилище переопределяет transition(), если может сменить
+    состояние и данные за один запрос.
+    """
+
+    async def transition(
+        self,
+        key: StorageKey,
+        state: StateType = None,
+        data: Optional[Mapping[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Смена состояния с добавлением данных
+
+        Args:
+            key: Ключ диалога
+            state: Новое состояние; None завершает диалог и удаляет его данные
+            data: Данные, которые добавляются к сохраненным (как update_data)
+
+        Returns:
+            Все данные диалога после добавления data
+        """
+        return await _transition_by_steps(self, key, state, data or {})
+
+
+async def transition(context: FSMContext, state: StateType = None, **data: Any) -> Dict[str, Any]:
+    """
+    Переход диалога в новое состояние с сохранением данных шага
+
+    Заменяет пару update_data() + set_state() (а при state=None -
+    update_data() + get_data() + clear()). Для TransitionStorage это
+    один запрос к хранилищу, для остальных хранилищ - те же отдельные
+    операции, что и раньше.
+
+    Args:
+        context: FSMContext обработчика
+        state: Новое состояние; None завершает диалог и удаляет его данные
+        **data: Данные шага
+
+    Returns:
+        Все данные диалога после добавления data
+    """
+    storage = context.storage
+    if isinstance(storage, TransitionStorage):
+        return await storage.transition(context.key, state, data)
+    return await _transition_by_steps(storage, context.key, state, data)
+
+
+class StateRecord:
+    """
+    Состояние и данные одного ключа FSM, еще не записанные в БД
+    """
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], updated_at: float):
+        self.state = state
+        self.data = data
+        self.updated_at = updated_at
+
+    @property
+    def is_empty(self) -> bool:
+        """
+        Состояние очищено (state.clear()) - строку можно удалить
+        """
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(TransitionStorage):
+    """
+    FSM-хранилище в SQLite с отложенной записью
+
+    set_state() и update_data() меняют запись в памяти, а в БД все
+    изменения попадают раз в flush_interval одним executemany и одним
+    commit. Пара update_data() + set_state() в обработчике превращается
+    в одну запись строки вместо двух commit'ов. При падении процесса
+    теряются изменения только за последние flush_interval секунд.
+
+    Данные FSM должны сериализоваться в JSON.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "fsm.db",
+        ttl: float = 24 * 3600,
+        flush_interval: float = 0.5,
+        cleanup_interval: float = 600.0,
+        key_builder: Optional[KeyBuilder] = None
+    ):
+        """
+        Args:
+            db_path: Путь к файлу БД
+            ttl: Через сколько секунд без изменений состояние удаляется
+            flush_interval: Максимальная задержка записи изменений в БД (сек)
+            cleanup_interval: Как часто удалять устаревшие состояния (сек)
+            key_builder: Построитель ключей (по умолчанию учитывает bot_id и destiny)
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.cleanup_interval = cleanup_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._open_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        # Измененные записи, которые еще не записаны в БД
+        self._pending: Dict[str, StateRecord] = {}
+        # Записи, которые сейчас пишет flush() (читаются как pending)
+        self._flushing: Dict[str, StateRecord] = {}
+
+    async def open(self):
+        """
+        Открытие соединения с БД и создание схемы
+
+        Вызывать необязательно: соединение открывается при первом
+        обращении к хранилищу.
+        """
+        async with self._open_lock:
+            if self._conn is not None:
+                return
+
+            conn = await aiosqlite.connect(self.db_path)
+            for pragma in PRAGMAS:
+                async with conn.execute(pragma):
+                    pass
+            await conn.executescript(SCHEMA)
+            self._conn = conn
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def close(self) -> None:
+        """
+        Запись накопленных изменений и закрытие соединения с БД
+
+        Dispatcher вызывает этот метод при остановке бота.
+        """
+        if self._conn is None:
+            return
+
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._flush_task
+            self._flush_task = None
+
+        await self.flush()
+        await self._conn.close()
+        self._conn = None
+
+    async def _connection(self) -> aiosqlite.Connection:
+        """
+        Текущее соединение (открывается при первом обращении)
+        """
+        if self._conn is None:
+            await self.open()
+        return self._conn
+
+    async def _load(self, key: str) -> StateRecord:
+        """
+        Запись ключа: из очереди на запись, иначе из БД
+        """
+        record = self._pending.get(key) or self._flushing.get(key)
+        if record is not None:
+            return record
+
+        conn = await self._connection()
+        async with conn.execute(
+            "SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,)
+        ) as cursor:
+            row = await cursor.fetchone()
+
+        # Устаревшая строка могла еще не попасть под очистку
+        if row is None or row[2] < time.time() - self.ttl:
+            return StateRecord(None, {}, 0.0)
+        return StateRecord(row[0], json.loads(row[1]), row[2])
+
+    async def _modify(self, key: StorageKey) -> StateRecord:
+        """
+        Запись ключа в очереди на запись (создается при первом изменении)
+        """
+        storage_key = self.key_builder.build(key)
+        record = self._pending.get(storage_key)
+        if record is None:
+            loaded = await self._load(storage_key)
+            # Пока шло чтение, запись могла появиться в очереди
+            record = self._pending.setdefault(
+                storage_key, StateRecord(loaded.state, dict(loaded.data), loaded.updated_at)
+            )
+        record.updated_at = time.time()
+        return record
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._modify(key)
+        record.state = state.state if isinstance(state, State) else state
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._load(self.key_builder.build(key))
+        return record.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        record = await self._modify(key)
+        record.data = data.copy()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._load(self.key_builder.build(key))
+        return record.data.copy()
+
+    async def transition(
+        self,
+        key: StorageKey,
+        state: StateType = None,
+        data: Optional[Mapping[str, Any]] = None
+    ) -> Dict[str, Any]:
+        record = await self._modify(key)
+        merged = {**record.data, **data} if data else record.data.copy()
+        if state is None:
+            record.state = None
+            record.data = {}
+        else:
+            record.state = state.state if isinstance(state, State) else state
+            record.data = merged.copy()
+        return merged
+
+    async def flush(self):
+        """
+        Запись всех накопленных изменений одной транзакцией
+        """
+        if not self._pending or self._conn is None:
+            return
+
+        self._flushing, self._pending = self._pending, {}
+        try:
+            upserts = []
+            deletes = []
+            for key, record in self._flushing.items():
+                if record.is_empty:
+                    deletes.append((key,))
+                else:
+                    upserts.append((
+                        key, record.state,
+                        json.dumps(record.data, ensure_ascii=False),
+                        record.updated_at
+                    ))
+
+            if upserts:
+                async with self._conn.executemany(UPSERT_SQL, upserts):
+                    pass
+            if deletes:
+                async with self._conn.executemany("DELETE FROM fsm_states WHERE key = ?", deletes):
+                    pass
+            await self._conn.commit()
+        except BaseException:
+            # Не теряем изменения: более новые записи из pending важнее
+            for key, record in self._flushing.items():
+                self._pending.setdefault(key, record)
+            raise
+        finally:
+            self._flushing = {}
+
+    async def delete_expired(self) -> int:
+        """
+        Удаление состояний, которые не менялись дольше ttl
+
+        Returns:
+            Количество удаленных строк
+        """
+        conn = await self._connection()
+        async with conn.execute(
+            "DELETE FROM fsm_states WHERE updated_at < ?", (time.time() - self.ttl,)
+        ) as cursor:
+            deleted = cursor.rowcount
+        await conn.commit()
+        return deleted
+
+    async def _flush_periodically(self):
+        """
+        Фоновая запись изменений и очистка устаревших состояний
+        """
+        last_cleanup = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - last_cleanup >= self.cleanup_interval:
+                    last_cleanup = time.monotonic()
+                    deleted = await self.delete_expired()
+                    if deleted:
+                        logger.info("Удалено устаревших FSM-состояний: %d", deleted)
+            except Exception:
+                logger.exception("Не удалось записать FSM-состояния в БД")
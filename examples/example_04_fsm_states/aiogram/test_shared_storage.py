@@ -0,0 +1,124 @@
+"""
+Тесты SharedStorage и SharedEventIsolation на LocalRedis
+
+Каждый worker загружает bot.py отдельно, как отдельный процесс, и
+получает свой Dispatcher; общий у них только LocalRedis. Запуск из
+этой папки:
+
+    python -m pytest
+"""
+
+import asyncio
+import importlib.util
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Chat, Message, Update, User
+
+from local_redis import LocalRedis
+from shared_storage import SharedEventIsolation, SharedStorage
+
+BOT_PATH = Path(__file__).with_name("bot.py")
+
+
+def load_worker(name: str, redis: LocalRedis) -> Dispatcher:
+    """
+    Worker бота: свой экземпляр модуля bot.py со своим router
+    """
+    spec = importlib.util.spec_from_file_location(name, BOT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    dp = Dispatcher(storage=SharedStorage(redis), events_isolation=SharedEventIsolation(redis))
+    dp.include_router(module.router)
+    return dp
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name="Test"),
+            text=text
+        )
+    )
+
+
+def key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=42, chat_id=user_id, user_id=user_id)
+
+
+def test_registration_continues_on_another_worker(monkeypatch):
+    replies: List[str] = []
+
+    async def answer(message: Message, text: str, **kwargs):
+        replies.append(text)
+
+    monkeypatch.setattr(Message, "answer", answer)
+
+    async def main():
+        redis = LocalRedis()
+        workers = [load_worker("worker_a", redis), load_worker("worker_b", redis)]
+        bot = Bot(token="42:TEST")
+        try:
+            # Сообщения пользователя попадают на worker'ы по очереди
+            for update_id, text in enumerate(["/start", "Иван", "30", "Москва"]):
+                dp = workers[update_id % 2]
+                await dp.feed_update(bot, make_update(update_id, 1, text))
+        finally:
+            await bot.session.close()
+        return await workers[0].storage.get_state(key(1)), redis
+
+    state, redis = asyncio.run(main())
+    assert "Имя: Иван\nВозраст: 30\nГород: Москва" in replies[-1]
+    # Диалог завершен - в Redis не осталось ни состояния, ни данных, ни блокировок
+    assert state is None
+    assert redis._values == {}
+
+
+def test_transition_is_one_request():
+    async def main():
+        redis = LocalRedis()
+        storage = SharedStorage(redis)
+        requests = []
+        for state, data in [("form:age", {"name": "Иван"}), (None, {"city": "Москва"})]:
+            before = redis.requests
+            result = await storage.transition(key(1), state, data)
+            requests.append(redis.requests - before)
+        return requests, result
+
+    requests, data = asyncio.run(main())
+    assert requests == [1, 1]
+    assert data == {"name": "Иван", "city": "Москва"}
+
+
+def test_expired_lock_holder_does_not_release_new_lock():
+    async def main():
+        redis = LocalRedis()
+        slow = SharedEventIsolation(redis, timeout=0.05)
+        other = SharedEventIsolation(redis, timeout=60)
+        lock_key = slow.key_builder.build(key(1), "lock")
+
+        async with slow.lock(key(1)):
+            # Обработчик работает дольше timeout: блокировка истекает
+            # и достается другому worker'у
+            await asyncio.sleep(0.1)
+            other_lock = other.lock(key(1))
+            await other_lock.__aenter__()
+            token = await redis.get(lock_key)
+
+        # Старый владелец вышел, но чужую блокировку не снял
+        still_held = await redis.get(lock_key)
+        await other_lock.__aexit__(None, None, None)
+        return token, still_held, await redis.get(lock_key)
+
+    token, still_held, released = asyncio.run(main())
+    assert token is not None
+    assert still_held == token
+    assert released is None
@@ -7,9 +7,13 @@ from telegram.ext import (
     MessageHandler,
     ContextTypes,
     ConversationHandler,
+    TypeHandler,
     filters
 )
 
+from registrations import ActiveRegistrations, drop_registration
+from wizard import REGISTRATION, InvalidInput
+
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
@@ -17,68 +21,62 @@ logging.basicConfig(
 
 TOKEN = os.getenv("BOT_TOKEN")
 
-# Определяем состояния
-NAME, AGE, CITY = range(3)
+# Через сколько секунд без ответа незавершенная регистрация сбрасывается
+CONVERSATION_TIMEOUT = 15 * 60
+
+# Сколько незавершенных регистраций держать в памяти одновременно:
+# сверх этого самые давние сбрасываются
+MAX_REGISTRATIONS = 100_000
+registrations = ActiveRegistrations(max_entries=MAX_REGISTRATIONS)
 
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     """
     Начало регистрации
     """
+    conversation = context.application.bot_data["registration"]
+    for user_id in registrations.start(update.effective_user.id):
+        drop_registration(context.application, conversation, user_id)
+
     await update.message.reply_text(
         "Привет! Давайте познакомимся.\n"
-        "Как вас зовут?\n\n"
+        f"{REGISTRATION.prompt(REGISTRATION.first_state, {})}\n\n"
         "Для отмены используйте /cancel"
     )
-    return NAME
+    return REGISTRATION.first_state
 
 
-async def process_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+def registration_step(state: str):
     """
-    Обработка имени и переход к возрасту
-    """
-    # Сохраняем имя в контексте пользователя
-    context.user_data['name'] = update.message.text
-
-    await update.message.reply_text(
-        f"Приятно познакомиться, {update.message.text}!\nСколько вам лет?"
-    )
-
-    return AGE
-
+    Обработчик ответа на шаг анкеты state
 
-async def process_age(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    Шаги описаны таблицей REGISTRATION (wizard.py), поэтому обработчики
+    всех шагов создаются одной функцией.
     """
-    Обработка возраста и переход к городу
-    """
-    text = update.message.text
-
-    # Проверяем, что введено число
-    if not text.isdigit():
-        await update.message.reply_text("Пожалуйста, введите возраст числом.")
-        return AGE
-
-    age = int(text)
+    async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+        try:
+            step = REGISTRATION.advance(state, update.message.text)
+        except InvalidInput as error:
+            # Ответ не подошел - остаемся на том же шаге
+            await update.message.reply_text(str(error))
+            return state
 
-    if age < 0 or age > 120:
-        await update.message.reply_text("Введите корректный возраст (от 0 до 120).")
-        return AGE
+        # Сохраняем ответ в контексте пользователя
+        context.user_data.update(step.data)
 
-    # Сохраняем возраст
-    context.user_data['age'] = age
+        if step.done:
+            return await finish_registration(update, context)
 
-    await update.message.reply_text("В каком городе вы живете?")
+        await update.message.reply_text(REGISTRATION.prompt(step.state, context.user_data))
+        return step.state
 
-    return CITY
+    return callback
 
 
-async def process_city(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def finish_registration(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """
-    Обработка города и завершение регистрации
+    Завершение регистрации
     """
-    # Сохраняем город
-    context.user_data['city'] = update.message.text
-
     # Получаем все данные
     name = context.user_data['name']
     age = context.user_data['age']
@@ -94,6 +92,18 @@ async def process_city(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         reply_markup=ReplyKeyboardRemove()
     )
 
+    return end_conversation(update, context)
+
+
+def end_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Завершение диалога с удалением данных пользователя из памяти
+
+    context.user_data.clear() оставил бы пустой словарь на каждого
+    пользователя, поэтому запись удаляется целиком.
+    """
+    registrations.finish(update.effective_user.id)
+    context.application.drop_user_data(update.effective_user.id)
     return ConversationHandler.END
 
 
@@ -105,7 +115,18 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         "Регистрация отменена.",
         reply_markup=ReplyKeyboardRemove()
     )
-    return ConversationHandler.END
+    return end_conversation(update, context)
+
+
+async def conversation_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Сброс регистрации, на которую пользователь не ответил вовремя
+    """
+    await context.bot.send_message(
+        update.effective_chat.id,
+        "Время на регистрацию истекло. Используйте /start, чтобы начать заново."
+    )
+    return end_conversation(update, context)
 
 
 def main() -> None:
@@ -115,12 +136,23 @@ def main() -> None:
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
-            NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_name)],
-            AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_age)],
-            CITY: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_city)],
+            # Шаги анкеты: состояние -> обработчик ответа на этот шаг
+            **{
+                state: [MessageHandler(filters.TEXT & ~filters.COMMAND, registration_step(state))]
+                for state in REGISTRATION.states
+            },
+            # Вызывается по истечении conversation_timeout
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        # Брошенные регистрации не остаются в памяти навсегда
+        # (нужен JobQueue: pip install "python-telegram-bot[job-queue]")
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        # Диалог ведется по пользователю: вытесненную регистрацию можно
+        # сбросить по user_id (см. drop_registration)
+        per_chat=False,
     )
+    application.bot_data["registration"] = conv_handler
 
     application.add_handler(conv_handler)
     application.run_polling()
@@ -0,0 +1,160 @@
+"""
+Декларативный мастер анкеты (регистрации)
+
+Шаги анкеты описываются один раз таблицей: поле, вопрос, проверка
+ответа и следующий шаг. Wizard заранее компилирует таблицу в словарь
+переходов {состояние: шаг}, поэтому обработка сообщения - один поиск
+в словаре, сколько бы шагов ни было, и один обработчик на всю анкету
+вместо отдельного обработчика с фильтром на каждое состояние.
+
+Модуль не зависит от фреймворка и одинаков для aiogram и
+python-telegram-bot: бот хранит состояние (строку) и данные анкеты
+так, как принято в его фреймворке.
+
+    transition = REGISTRATION.advance(state, message.text)  # InvalidInput
+    if transition.done:
+        ...  # анкета заполнена
+    else:
+        reply = REGISTRATION.prompt(transition.state, data)
+"""
+
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Mapping, NamedTuple, Optional
+
+
+class InvalidInput(ValueError):
+    """
+    Ответ не прошел проверку; текст ошибки отправляется пользователю
+    """
+
+
+class Step(NamedTuple):
+    """
+    Шаг анкеты
+
+    prompt форматируется данными анкеты, собранными к этому шагу
+    (например, "Приятно познакомиться, {name}!"). validator получает
+    текст сообщения и возвращает значение поля или бросает InvalidInput.
+    next - поле следующего шага; по умолчанию шаг, следующий в таблице.
+    """
+    field: str
+    prompt: str
+    validator: Optional[Callable[[str], Any]] = None
+    next: Optional[str] = None
+
+
+class Transition(NamedTuple):
+    """
+    Результат ответа на шаг: новое состояние и данные для сохранения
+
+    state равно None, когда анкета заполнена.
+    """
+    state: Optional[str]
+    data: Dict[str, Any]
+
+    @property
+    def done(self) -> bool:
+        return self.state is None
+
+
+class _CompiledStep(NamedTuple):
+    field: str
+    prompt: str
+    validator: Optional[Callable[[str], Any]]
+    next_state: Optional[str]
+
+
+class Wizard:
+    """
+    Анкета, скомпилированная в таблицу переходов
+
+    Состояние шага - строка "<name>:<field>", ее можно напрямую
+    передавать в state.set_state() aiogram и использовать как ключ
+    states в ConversationHandler.
+    """
+
+    def __init__(self, name: str, steps: Iterable[Step]):
+        """
+        Args:
+            name: Имя анкеты (префикс состояний)
+            steps: Шаги по порядку; первый шаг - начало анкеты
+
+        Raises:
+            ValueError: Пустая анкета, повтор поля или переход на неизвестное поле
+        """
+        steps = list(steps)
+        if not steps:
+            raise ValueError(f"Wizard {name!r} has no steps")
+
+        self.name = name
+        states = {step.field: self._state(step.field) for step in steps}
+        if len(states) != len(steps):
+            raise ValueError(f"Wizard {name!r} has duplicate fields")
+
+        self._table: Dict[str, _CompiledStep] = {}
+        for index, step in enumerate(steps):
+            if step.next is not None:
+                if step.next not in states:
+                    raise ValueError(f"Step {step.field!r} goes to unknown field {step.next!r}")
+                next_state = states[step.next]
+            elif index + 1 < len(steps):
+                next_state = states[steps[index + 1].field]
+            else:
+                next_state = None
+            self._table[states[step.field]] = _CompiledStep(
+                step.field, step.prompt, step.validator, next_state
+            )
+
+        self.first_state = states[steps[0].field]
+        self.states: FrozenSet[str] = frozenset(self._table)
+
+    def _state(self, field: str) -> str:
+        return f"{self.name}:{field}"
+
+    def __contains__(self, state: Optional[str]) -> bool:
+        return state in self._table
+
+    def advance(self, state: str, text: str) -> Transition:
+        """
+        Проверка ответа на шаг state и переход к следующему шагу
+
+        Args:
+            state: Текущее состояние (одно из states)
+            text: Текст сообщения пользователя
+
+        Returns:
+            Следующее состояние и {поле: значение} для сохранения
+
+        Raises:
+            InvalidInput: Ответ не прошел проверку, состояние не меняется
+            KeyError: state не относится к анкете
+        """
+        step = self._table[state]
+        value = step.validator(text) if step.validator is not None else text
+        return Transition(step.next_state, {step.field: value})
+
+    def prompt(self, state: str, data: Mapping[str, Any]) -> str:
+        """
+        Вопрос шага state с подставленными данными анкеты
+        """
+        return self._table[state].prompt.format_map(data)
+
+
+def validate_age(text: str) -> int:
+    """
+    Возраст - целое число от 0 до 120
+    """
+    if not text.isdigit():
+        raise InvalidInput("Пожалуйста, введите возраст числом.")
+
+    age = int(text)
+    if age < 0 or age > 120:
+        raise InvalidInput("Введите корректный возраст (от 0 до 120).")
+    return age
+
+
+# Анкета регистрации: имя -> возраст -> город
+REGISTRATION = Wizard("RegistrationForm", [
+    Step("name", "Как вас зовут?"),
+    Step("age", "Приятно познакомиться, {name}!\nСколько вам лет?", validate_age),
+    Step("city", "В каком городе вы живете?"),
+])
@@ -2,18 +2,19 @@ import asyncio
 import logging
 import sys
 from os import getenv
-from typing import Any, Awaitable, Callable, Dict
+from typing import Any, Awaitable, Callable, Dict, Optional
 
 from aiogram import BaseMiddleware, Bot, Dispatcher, Router, F
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import Message, TelegramObject
 
 from database import Database
+from repository import UserRepository
+from storage import BoundedMemoryStorage
+from wizard import REGISTRATION, InvalidInput
 
 logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 
@@ -21,9 +22,25 @@ TOKEN = getenv("BOT_TOKEN")
 router = Router()
 
 
+def create_repository() -> UserRepository:
+    """
+    Выбор хранилища пользователей: PostgreSQL, если задан DATABASE_URL,
+    иначе файл SQLite
+    """
+    database_url = getenv("DATABASE_URL")
+    if database_url:
+        # asyncpg нужен только для PostgreSQL, поэтому импортируем здесь
+        from postgres_database import PostgresDatabase
+        return PostgresDatabase(database_url)
+    return Database()
+
+
 # Middleware для передачи БД в обработчики
+# Каждое изменение фиксируется сразу (commit одновременных update
+# объединяется), поэтому на время ответа обработчика в Telegram
+# транзакция и соединение не удерживаются
 class DatabaseMiddleware(BaseMiddleware):
-    def __init__(self, database: Database):
+    def __init__(self, database: UserRepository):
         self.database = database
 
     async def __call__(
@@ -37,15 +54,15 @@ class DatabaseMiddleware(BaseMiddleware):
         return await handler(event, data)
 
 
-# Состояния для регистрации
-class RegistrationForm(StatesGroup):
-    name = State()
-    age = State()
-    city = State()
+def in_registration(message: Message, raw_state: Optional[str]) -> bool:
+    """
+    Фильтр: пользователь заполняет анкету регистрации
+    """
+    return raw_state in REGISTRATION
 
 
 @router.message(CommandStart())
-async def command_start(message: Message, state: FSMContext, db: Database) -> None:
+async def command_start(message: Message, state: FSMContext, db: UserRepository) -> None:
     """
     Начало регистрации + добавление в БД
     """
@@ -56,10 +73,10 @@ async def command_start(message: Message, state: FSMContext, db: Database) -> No
         full_name=message.from_user.full_name
     )
 
-    await state.set_state(RegistrationForm.name)
+    await state.set_state(REGISTRATION.first_state)
     await message.answer(
         "Привет! Давайте заполним ваш профиль.\n"
-        "Как вас зовут?\n\n"
+        f"{REGISTRATION.prompt(REGISTRATION.first_state, {})}\n\n"
         "Команды:\n"
         "/cancel - отменить\n"
         "/profile - посмотреть профиль\n"
@@ -82,77 +99,79 @@ async def cancel_handler(message: Message, state: FSMContext) -> None:
 
 
 @router.message(Command("profile"))
-async def show_profile(message: Message, db: Database) -> None:
+async def show_profile(message: Message, db: UserRepository) -> None:
     """
     Показать профиль пользователя
     """
     user = await db.get_user(message.from_user.id)
 
-    if not user or not user['name']:
+    if not user or not user.name:
         await message.answer("У вас еще нет профиля. Используйте /start для регистрации.")
         return
 
     await message.answer(
         f"👤 Ваш профиль:\n\n"
-        f"Имя: {user['name']}\n"
-        f"Возраст: {user['age']}\n"
-        f"Город: {user['city']}\n"
-        f"Зарегистрирован: {user['created_at']}"
+        f"Имя: {user.name}\n"
+        f"Возраст: {user.age}\n"
+        f"Город: {user.city}\n"
+        f"Зарегистрирован: {user.created_at}"
     )
 
 
 @router.message(Command("stats"))
-async def show_stats(message: Message, db: Database) -> None:
+async def show_stats(
+    message: Message,
+    db: UserRepository,
+    fsm_storage: BoundedMemoryStorage
+) -> None:
     """
     Показать статистику бота
     """
     count = await db.get_all_users_count()
-    await message.answer(f"📊 Статистика:\n\nВсего пользователей: {count}")
+    await message.answer(
+        f"📊 Статистика:\n\n"
+        f"Всего пользователей: {count}\n"
+        f"Незавершенных регистраций: {fsm_storage.stats()['size']}"
+    )
 
 
-@router.message(RegistrationForm.name)
-async def process_name(message: Message, state: FSMContext) -> None:
-    """
-    Обработка имени
+@router.message(F.text, in_registration)
+async def registration_step(
+    message: Message,
+    state: FSMContext,
+    raw_state: str,
+    db: UserRepository
+) -> None:
     """
-    await state.update_data(name=message.text)
-    await state.set_state(RegistrationForm.age)
-    await message.answer(f"Приятно познакомиться, {message.text}!\nСколько вам лет?")
+    Обработка ответа на любой шаг анкеты
 
-
-@router.message(RegistrationForm.age)
-async def process_age(message: Message, state: FSMContext) -> None:
-    """
-    Обработка возраста
+    Шаг определяется по состоянию через таблицу REGISTRATION (wizard.py),
+    поэтому на все шаги хватает одного обработчика.
     """
-    if not message.text.isdigit():
-        await message.answer("Пожалуйста, введите возраст числом.")
+    try:
+        step = REGISTRATION.advance(raw_state, message.text)
+    except InvalidInput as error:
+        # Ответ не подошел - остаемся на том же шаге
+        await message.answer(str(error))
         return
 
-    age = int(message.text)
-    if age < 0 or age > 120:
-        await message.answer("Введите корректный возраст (от 0 до 120).")
+    if not step.done:
+        data = await state.update_data(step.data)
+        await state.set_state(step.state)
+        await message.answer(REGISTRATION.prompt(step.state, data))
         return
 
-    await state.update_data(age=age)
-    await state.set_state(RegistrationForm.city)
-    await message.answer("В каком городе вы живете?")
-
-
-@router.message(RegistrationForm.city)
-async def process_city(message: Message, state: FSMContext, db: Database) -> None:
-    """
-    Обработка города и сохранение в БД
-    """
-    await state.update_data(city=message.text)
+    # Последний ответ не нужно сохранять в FSM: анкета сразу уходит в БД
     data = await state.get_data()
+    profile = {"name": data['name'], "age": data['age'], **step.data}
 
-    # Сохраняем профиль в БД
-    await db.update_user_profile(
+    # Сохраняем профиль в БД одним запросом (пользователь создается,
+    # даже если запись из /start еще не попала в БД)
+    await db.complete_registration(
         user_id=message.from_user.id,
-        name=data['name'],
-        age=data['age'],
-        city=data['city']
+        profile=profile,
+        username=message.from_user.username,
+        full_name=message.from_user.full_name
     )
 
     await state.clear()
@@ -160,27 +179,37 @@ async def process_city(message: Message, state: FSMContext, db: Database) -> Non
     await message.answer(
         f"✅ Регистрация завершена!\n\n"
         f"📝 Ваши данные сохранены в базе данных:\n"
-        f"Имя: {data['name']}\n"
-        f"Возраст: {data['age']}\n"
-        f"Город: {data['city']}\n\n"
+        f"Имя: {profile['name']}\n"
+        f"Возраст: {profile['age']}\n"
+        f"Город: {profile['city']}\n\n"
         f"Используйте /profile для просмотра профиля"
     )
 
 
 async def main() -> None:
-    # Инициализируем БД
-    db = Database()
-    await db.create_tables()
+    # Подключаемся к БД один раз на всё время работы бота
+    db = create_repository()
+    await db.open()
 
     bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    storage = MemoryStorage()
+    # Незавершенные регистрации хранятся в памяти не дольше часа
+    # и не больше 100 000 одновременно
+    storage = BoundedMemoryStorage(max_entries=100_000, idle_timeout=3600)
     dp = Dispatcher(storage=storage)
 
-    # Регистрируем middleware
-    dp.message.middleware(DatabaseMiddleware(db))
+    # Регистрируем middleware для сообщений и нажатий inline-кнопок
+    database_middleware = DatabaseMiddleware(db)
+    dp.message.middleware(database_middleware)
+    dp.callback_query.middleware(database_middleware)
 
     dp.include_router(router)
-    await dp.start_polling(bot)
+
+    try:
+        await dp.start_polling(bot)
+    finally:
+        # Закрываем соединение при остановке бота
+        await db.close()
+        logging.info("FSM-хранилище: %s", storage.stats())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+"""
+Интерфейс хранилища пользователей
+
+Бот работает с пользователями только через UserRepository, поэтому
+хранилище можно заменить, не трогая обработчики:
+- Database (database.py) - SQLite, используется по умолчанию
+- PostgresDatabase (postgres_database.py) - PostgreSQL с пулом соединений,
+  общий для нескольких процессов бота
+- MemoryDatabase - в памяти процесса, для тестов
+"""
+
+from abc import ABC, abstractmethod
+from datetime import datetime
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional
+
+
+class User(NamedTuple):
+    """
+    Запись о пользователе из таблицы users
+
+    Кортеж без __dict__: дешевле sqlite3.Row по памяти, поэтому
+    кешировать можно очень много профилей. Поля читаются как атрибуты:
+    user.name, user.age
+    """
+    user_id: int
+    username: Optional[str]
+    full_name: Optional[str]
+    name: Optional[str]
+    age: Optional[int]
+    city: Optional[str]
+    created_at: Optional[str]
+
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """
+    Разбиение итерируемого объекта на списки по size элементов
+    """
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class UserRepository(ABC):
+    """
+    Хранилище пользователей бота
+    """
+
+    @abstractmethod
+    async def open(self):
+        """
+        Подключение к хранилищу (вызывается при запуске бота)
+        """
+
+    @abstractmethod
+    async def close(self):
+        """
+        Отключение от хранилища (вызывается при остановке бота)
+        """
+
+    @abstractmethod
+    async def add_user(self, user_id: int, username: Optional[str], full_name: str):
+        """
+        Добавление пользователя, если его еще нет
+        """
+
+    @abstractmethod
+    async def update_user_profile(self, user_id: int, name: str, age: int, city: str):
+        """
+        Обновление профиля пользователя
+        """
+
+    @abstractmethod
+    async def complete_registration(
+        self,
+        user_id: int,
+        profile: Mapping[str, Any],
+        username: Optional[str] = None,
+        full_name: Optional[str] = None
+    ):
+        """
+        Сохранение анкеты (name, age, city) одним атомарным запросом,
+        с созданием пользователя, если его еще нет
+        """
+
+    @abstractmethod
+    async def get_user(self, user_id: int) -> Optional[User]:
+        """
+        Получение данных пользователя
+        """
+
+    @abstractmethod
+    async def get_all_users_count(self) -> int:
+        """
+        Получение количества пользователей
+        """
+
+    @abstractmethod
+    async def bulk_upsert_users(self, users: Iterable[Iterable], batch_size: int = 10_000) -> int:
+        """
+        Массовая загрузка пользователей (вставка или обновление)
+        """
+
+    @abstractmethod
+    def iter_users(self, batch_size: int = 10_000) -> AsyncIterator[User]:
+        """
+        Потоковое чтение всех пользователей в порядке user_id
+        """
+
+
+class MemoryDatabase(UserRepository):
+    """
+    Хранилище пользователей в памяти процесса
+
+    Данные теряются при перезапуске, поэтому подходит только для тестов
+    и локальной отладки обработчиков без файла БД.
+    """
+
+    def __init__(self):
+        self._users: Dict[int, User] = {}
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def add_user(self, user_id: int, username: Optional[str], full_name: str):
+        if user_id not in self._users:
+            self._users[user_id] = User(
+                user_id=user_id,
+                username=username,
+                full_name=full_name,
+                name=None,
+                age=None,
+                city=None,
+                created_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            )
+
+    async def update_user_profile(self, user_id: int, name: str, age: int, city: str):
+        user = self._users.get(user_id)
+        if user is not None:
+            self._users[user_id] = user._replace(name=name, age=age, city=city)
+
+    async def complete_registration(
+        self,
+        user_id: int,
+        profile: Mapping[str, Any],
+        username: Optional[str] = None,
+        full_name: Optional[str] = None
+    ):
+        await self.add_user(user_id, username, full_name)
+        await self.update_user_profile(
+            user_id, profile["name"], profile["age"], profile["city"]
+        )
+
+    async def get_user(self, user_id: int) -> Optional[User]:
+        return self._users.get(user_id)
+
+    async def get_all_users_count(self) -> int:
+        return len(self._users)
+
+    async def bulk_upsert_users(self, users: Iterable[Iterable], batch_size: int = 10_000) -> int:
+        count = 0
+        for values in users:
+            user = User._make(values)
+            if user.created_at is None:
+                user = user._replace(created_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            self._users[user.user_id] = user
+            count += 1
+        return count
+
+    async def iter_users(self, batch_size: int = 10_000) -> AsyncIterator[User]:
+        for user_id in sorted(self._users):
+            yield self._users[user_id]
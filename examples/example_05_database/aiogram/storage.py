@@ -0,0 +1,141 @@
+"""
+FSM-хранилище aiogram в памяти с ограничением размера
+
+MemoryStorage хранит состояние каждого пользователя, который хоть раз
+написал боту, пока процесс жив: даже get_state() создает запись.
+Пользователи, которые отправили /start и не закончили регистрацию,
+остаются в памяти навсегда. BoundedMemoryStorage держит только активные
+диалоги:
+- очищенные состояния (state.clear()) сразу удаляются
+- диалоги без активности дольше idle_timeout удаляются
+- при превышении max_entries удаляются самые давние диалоги (LRU)
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+
+class StorageRecord:
+    """
+    Состояние и данные одного диалога
+    """
+    __slots__ = ("state", "data", "touched_at")
+
+    def __init__(self, touched_at: float):
+        self.state: Optional[str] = None
+        self.data: Dict[str, Any] = {}
+        self.touched_at = touched_at
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """
+    FSM-хранилище в памяти процесса с вытеснением простаивающих диалогов
+
+    Записи лежат в OrderedDict в порядке последнего обращения, поэтому
+    устаревшие и вытесняемые записи всегда в начале словаря и удаляются
+    за O(1) при каждой записи - без фонового таймера и полного обхода.
+    """
+
+    def __init__(self, max_entries: int = 100_000, idle_timeout: float = 3600.0):
+        """
+        Args:
+            max_entries: Максимальное количество хранимых диалогов
+            idle_timeout: Через сколько секунд без активности диалог удаляется
+        """
+        self.max_entries = max_entries
+        self.idle_timeout = idle_timeout
+        self._records: "OrderedDict[StorageKey, StorageRecord]" = OrderedDict()
+        # Счетчики удаленных диалогов (для stats())
+        self.expired = 0
+        self.evicted = 0
+
+    def _get(self, key: StorageKey) -> Optional[StorageRecord]:
+        """
+        Запись диалога, если он есть и не простаивает дольше idle_timeout
+        """
+        record = self._records.get(key)
+        if record is None:
+            return None
+
+        now = time.monotonic()
+        if now - record.touched_at > self.idle_timeout:
+            del self._records[key]
+            self.expired += 1
+            return None
+
+        record.touched_at = now
+        self._records.move_to_end(key)
+        return record
+
+    def _get_or_create(self, key: StorageKey) -> StorageRecord:
+        """
+        Запись диалога для изменения (создается при необходимости)
+        """
+        record = self._get(key)
+        if record is None:
+            record = self._records[key] = StorageRecord(time.monotonic())
+            self._evict()
+        return record
+
+    def _release(self, key: StorageKey, record: StorageRecord):
+        """
+        Удаление записи, если в ней больше ничего нет
+        """
+        if record.state is None and not record.data:
+            self._records.pop(key, None)
+
+    def _evict(self):
+        """
+        Удаление простаивающих диалогов и самых давних сверх max_entries
+        """
+        deadline = time.monotonic() - self.idle_timeout
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record.touched_at < deadline:
+                self.expired += 1
+            elif len(self._records) > self.max_entries:
+                self.evicted += 1
+            else:
+                break
+            del self._records[key]
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._get_or_create(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._release(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get(key)
+        return record.state if record is not None else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        record = self._get_or_create(key)
+        record.data = data.copy()
+        self._release(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get(key)
+        return record.data.copy() if record is not None else {}
+
+    async def close(self) -> None:
+        self._records.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Текущий размер хранилища и счетчики удаленных диалогов
+
+        Returns:
+            Словарь с ключами size, max_entries, expired, evicted
+        """
+        return {
+            "size": len(self._records),
+            "max_entries": self.max_entries,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
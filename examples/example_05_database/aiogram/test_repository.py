@@ -0,0 +1,204 @@
+"""
+Тесты хранилищ пользователей (UserRepository)
+
+Одни и те же проверки выполняются для Database (SQLite во временном
+файле) и MemoryDatabase. Запуск из этой папки:
+
+    python -m pytest
+"""
+
+import asyncio
+import sqlite3
+from contextlib import closing
+
+import aiosqlite
+import pytest
+
+from database import Database
+from repository import MemoryDatabase, User
+
+PROFILE = {"name": "Иван", "age": 30, "city": "Москва"}
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def make_repository(request, tmp_path):
+    if request.param == "sqlite":
+        return lambda: Database(str(tmp_path / "users.db"), flush_interval=0.05)
+    return MemoryDatabase
+
+
+def run(make_repository, scenario):
+    """
+    Выполнение сценария с открытым хранилищем
+    """
+    async def main():
+        db = make_repository()
+        await db.open()
+        try:
+            return await scenario(db)
+        finally:
+            await db.close()
+
+    return asyncio.run(main())
+
+
+def test_add_and_get_user(make_repository):
+    async def scenario(db):
+        await db.add_user(1, "ivan", "Иван Петров")
+        await db.add_user(1, "other", "Повторный /start")
+        return await db.get_user(1), await db.get_user(2), await db.get_all_users_count()
+
+    user, missing, count = run(make_repository, scenario)
+    assert isinstance(user, User)
+    assert (user.user_id, user.username, user.full_name) == (1, "ivan", "Иван Петров")
+    assert user.name is None
+    assert missing is None
+    assert count == 1
+
+
+def test_update_user_profile(make_repository):
+    async def scenario(db):
+        await db.add_user(1, "ivan", "Иван Петров")
+        # Профиль уже в кеше - обновление должно его сбросить
+        await db.get_user(1)
+        await db.update_user_profile(1, "Иван", 30, "Москва")
+        return await db.get_user(1)
+
+    user = run(make_repository, scenario)
+    assert (user.name, user.age, user.city) == ("Иван", 30, "Москва")
+
+
+def test_complete_registration_creates_user(make_repository):
+    async def scenario(db):
+        # /start пропущен: строка создается при сохранении анкеты
+        await db.complete_registration(1, PROFILE, "ivan", "Иван Петров")
+        return await db.get_user(1), await db.get_all_users_count()
+
+    user, count = run(make_repository, scenario)
+    assert (user.username, user.name, user.age, user.city) == ("ivan", "Иван", 30, "Москва")
+    assert count == 1
+
+
+def test_complete_registration_keeps_start_data(make_repository):
+    async def scenario(db):
+        await db.add_user(1, "ivan", "Иван Петров")
+        await db.complete_registration(1, PROFILE)
+        return await db.get_user(1)
+
+    user = run(make_repository, scenario)
+    assert (user.username, user.full_name, user.city) == ("ivan", "Иван Петров", "Москва")
+
+
+def test_concurrent_registrations(make_repository):
+    async def scenario(db):
+        await asyncio.gather(*(
+            db.complete_registration(user_id, PROFILE, f"user{user_id}", "Имя")
+            for user_id in range(50)
+        ))
+        return await db.get_all_users_count()
+
+    assert run(make_repository, scenario) == 50
+
+
+def test_sqlite_commits_before_returning(tmp_path):
+    path = str(tmp_path / "users.db")
+
+    async def main():
+        db = Database(path)
+        await db.open()
+        try:
+            await asyncio.gather(*(
+                db.complete_registration(user_id, PROFILE, None, None)
+                for user_id in range(20)
+            ))
+            # Пока бот еще работает, изменения уже видны другому соединению
+            async with aiosqlite.connect(path) as other:
+                async with other.execute("SELECT COUNT(*) FROM users") as cursor:
+                    return (await cursor.fetchone())[0]
+        finally:
+            await db.close()
+
+    assert asyncio.run(main()) == 20
+
+
+def test_bulk_upsert_and_iter_users(make_repository):
+    users = [
+        User(user_id, f"user{user_id}", None, None, None, None, "2024-01-01 00:00:00")
+        for user_id in (3, 1, 2)
+    ]
+
+    async def scenario(db):
+        await db.add_user(1, "old", "Старое имя")
+        loaded = await db.bulk_upsert_users(users, batch_size=2)
+        exported = [user async for user in db.iter_users(batch_size=2)]
+        return loaded, exported, await db.get_all_users_count()
+
+    loaded, exported, count = run(make_repository, scenario)
+    assert loaded == 3
+    assert [user.user_id for user in exported] == [1, 2, 3]
+    assert exported[0].username == "user1"
+    assert count == 3
+
+
+def test_sqlite_data_survives_reopen(tmp_path):
+    path = str(tmp_path / "users.db")
+
+    async def main():
+        db = Database(path)
+        await db.open()
+        await db.complete_registration(1, PROFILE, "ivan", "Иван Петров")
+        await db.add_user(2, "anna", "Анна")
+        await db.close()
+
+        db = Database(path)
+        await db.open()
+        try:
+            return await db.get_user(1), await db.get_all_users_count()
+        finally:
+            await db.close()
+
+    user, count = asyncio.run(main())
+    assert user.city == "Москва"
+    assert count == 2
+
+
+def test_sqlite_users_count_matches_table(tmp_path):
+    path = str(tmp_path / "users.db")
+    users = [
+        User(user_id, f"user{user_id}", None, None, None, None, None)
+        for user_id in range(1, 1001)
+    ]
+
+    def count_rows() -> int:
+        with closing(sqlite3.connect(path)) as conn:
+            (count,) = conn.execute("SELECT COUNT(*) FROM users").fetchone()
+        return count
+
+    def delete_users(condition: str):
+        with closing(sqlite3.connect(path)) as conn, conn:
+            conn.execute(f"DELETE FROM users WHERE {condition}")
+
+    async def main():
+        db = Database(path)
+        await db.open()
+        try:
+            counts = []
+            await db.add_user(1, "old", "Старое имя")
+            await db.flush()
+            # Повторная загрузка тех же пользователей обновляет строки,
+            # а не добавляет новые
+            for _ in range(2):
+                await db.bulk_upsert_users(users, batch_size=300)
+                counts.append((await db.get_all_users_count(), count_rows()))
+            delete_users("user_id % 3 = 0")
+            counts.append((await db.get_all_users_count(), count_rows()))
+            await db.complete_registration(5000, PROFILE, "new", "Новый")
+            delete_users("user_id > 900")
+            counts.append((await db.get_all_users_count(), count_rows()))
+            return counts
+        finally:
+            await db.close()
+
+    counts = asyncio.run(main())
+    assert [counter for counter, _ in counts] == [rows for _, rows in counts]
+    assert counts[0][0] == 1000
@@ -0,0 +1,97 @@
+"""
+Тесты BoundedMemoryStorage
+
+Запуск из этой папки:
+
+    python -m pytest
+"""
+
+import asyncio
+import time
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher
+from aiogram.filters import CommandStart
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Chat, Message, Update, User
+
+from storage import BoundedMemoryStorage
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name="Test"),
+            text=text
+        )
+    )
+
+
+def key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def test_dispatcher_uses_empty_storage():
+    storage = BoundedMemoryStorage()
+    dp = Dispatcher(storage=storage)
+    sizes = []
+
+    @dp.message(CommandStart())
+    async def start(message: Message, state: FSMContext, fsm_storage: BoundedMemoryStorage):
+        await state.set_state("registration:name")
+        sizes.append(fsm_storage.stats()["size"])
+
+    async def main():
+        bot = Bot(token="42:TEST")
+        try:
+            for user_id in (1, 2):
+                await dp.feed_update(bot, make_update(user_id, user_id, "/start"))
+        finally:
+            await bot.session.close()
+
+    asyncio.run(main())
+    # Пустое хранилище не подменяется на MemoryStorage
+    assert dp.storage is storage
+    assert sizes == [1, 2]
+
+
+def test_cleared_state_is_removed():
+    async def main():
+        storage = BoundedMemoryStorage()
+        await storage.set_state(key(1), "registration:name")
+        await storage.set_data(key(1), {"name": "Иван"})
+        await storage.set_state(key(1), None)
+        await storage.set_data(key(1), {})
+        return storage.stats()["size"], await storage.get_state(key(1))
+
+    assert asyncio.run(main()) == (0, None)
+
+
+def test_lru_eviction():
+    async def main():
+        storage = BoundedMemoryStorage(max_entries=2)
+        for user_id in (1, 2, 3):
+            await storage.set_state(key(user_id), "registration:name")
+        return storage, [await storage.get_state(key(user_id)) for user_id in (1, 2, 3)]
+
+    storage, states = asyncio.run(main())
+    assert states == [None, "registration:name", "registration:name"]
+    assert storage.stats()["evicted"] == 1
+
+
+def test_idle_dialog_expires(monkeypatch):
+    async def main():
+        storage = BoundedMemoryStorage(idle_timeout=60)
+        await storage.set_state(key(1), "registration:name")
+        now = time.monotonic()
+        monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+        return storage, await storage.get_state(key(1))
+
+    storage, state = asyncio.run(main())
+    assert state is None
+    assert storage.stats() == {"size": 0, "max_entries": 100_000, "expired": 1, "evicted": 0}
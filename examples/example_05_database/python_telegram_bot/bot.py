@@ -1,5 +1,7 @@
 import logging
 import os
+from typing import Any, Dict
+
 from telegram import Update
 from telegram.ext import (
     Application,
@@ -7,10 +9,14 @@ from telegram.ext import (
     MessageHandler,
     ContextTypes,
     ConversationHandler,
+    TypeHandler,
     filters
 )
 
 from database import Database
+from registrations import ActiveRegistrations, drop_registration
+from repository import UserRepository
+from wizard import REGISTRATION, InvalidInput
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -19,21 +25,43 @@ logging.basicConfig(
 
 TOKEN = os.getenv("BOT_TOKEN")
 
-# Инициализируем БД
-db = Database()
 
-# Состояния
-NAME, AGE, CITY = range(3)
+def create_repository() -> UserRepository:
+    """
+    Выбор хранилища пользователей: PostgreSQL, если задан DATABASE_URL,
+    иначе файл SQLite
+    """
+    database_url = os.getenv("DATABASE_URL")
+    if database_url:
+        # asyncpg нужен только для PostgreSQL, поэтому импортируем здесь
+        from postgres_database import PostgresDatabase
+        return PostgresDatabase(database_url)
+    return Database()
+
+
+# Инициализируем БД (соединение открывается в post_init)
+db = create_repository()
 
+# Через сколько секунд без ответа незавершенная регистрация сбрасывается
+CONVERSATION_TIMEOUT = 15 * 60
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+# Сколько незавершенных регистраций держать в памяти одновременно:
+# сверх этого самые давние сбрасываются
+MAX_REGISTRATIONS = 100_000
+registrations = ActiveRegistrations(max_entries=MAX_REGISTRATIONS)
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     """
     Начало регистрации + добавление в БД
     """
     user = update.effective_user
+    conversation = context.application.bot_data["registration"]
+    for user_id in registrations.start(user.id):
+        drop_registration(context.application, conversation, user_id)
 
-    # Добавляем пользователя в БД
-    db.add_user(
+    # Добавляем пользователя в БД (запрос выполняется в потоке БД)
+    await db.add_user(
         user_id=user.id,
         username=user.username,
         full_name=user.full_name
@@ -41,23 +69,23 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
     await update.message.reply_text(
         "Привет! Давайте заполним ваш профиль.\n"
-        "Как вас зовут?\n\n"
+        f"{REGISTRATION.prompt(REGISTRATION.first_state, {})}\n\n"
         "Команды:\n"
         "/cancel - отменить\n"
         "/profile - посмотреть профиль\n"
         "/stats - статистика бота"
     )
 
-    return NAME
+    return REGISTRATION.first_state
 
 
 async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Показать профиль пользователя
     """
-    user_data = db.get_user(update.effective_user.id)
+    user_data = await db.get_user(update.effective_user.id)
 
-    if not user_data or not user_data['name']:
+    if not user_data or not user_data.name:
         await update.message.reply_text(
             "У вас еще нет профиля. Используйте /start для регистрации."
         )
@@ -65,10 +93,10 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     await update.message.reply_text(
         f"👤 Ваш профиль:\n\n"
-        f"Имя: {user_data['name']}\n"
-        f"Возраст: {user_data['age']}\n"
-        f"Город: {user_data['city']}\n"
-        f"Зарегистрирован: {user_data['created_at']}"
+        f"Имя: {user_data.name}\n"
+        f"Возраст: {user_data.age}\n"
+        f"Город: {user_data.city}\n"
+        f"Зарегистрирован: {user_data.created_at}"
     )
 
 
@@ -76,67 +104,85 @@ async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     """
     Показать статистику бота
     """
-    count = db.get_all_users_count()
-    await update.message.reply_text(f"📊 Статистика:\n\nВсего пользователей: {count}")
-
-
-async def process_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """
-    Обработка имени
-    """
-    context.user_data['name'] = update.message.text
-
+    count = await db.get_all_users_count()
     await update.message.reply_text(
-        f"Приятно познакомиться, {update.message.text}!\nСколько вам лет?"
+        f"📊 Статистика:\n\n"
+        f"Всего пользователей: {count}\n"
+        f"Незавершенных регистраций: {registrations.stats()['size']}"
     )
 
-    return AGE
-
 
-async def process_age(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+def registration_step(state: str):
     """
-    Обработка возраста
-    """
-    text = update.message.text
+    Обработчик ответа на шаг анкеты state
 
-    if not text.isdigit():
-        await update.message.reply_text("Пожалуйста, введите возраст числом.")
-        return AGE
+    Шаги описаны таблицей REGISTRATION (wizard.py), поэтому обработчики
+    всех шагов создаются одной функцией.
+    """
+    async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+        try:
+            step = REGISTRATION.advance(state, update.message.text)
+        except InvalidInput as error:
+            # Ответ не подошел - остаемся на том же шаге
+            await update.message.reply_text(str(error))
+            return state
 
-    age = int(text)
-    if age < 0 or age > 120:
-        await update.message.reply_text("Введите корректный возраст (от 0 до 120).")
-        return AGE
+        if step.done:
+            return await finish_registration(update, context, step.data)
 
-    context.user_data['age'] = age
-    await update.message.reply_text("В каком городе вы живете?")
+        context.user_data.update(step.data)
+        await update.message.reply_text(REGISTRATION.prompt(step.state, context.user_data))
+        return step.state
 
-    return CITY
+    return callback
 
 
-async def process_city(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def finish_registration(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    last_answer: Dict[str, Any]
+) -> int:
     """
-    Обработка города и сохранение в БД
+    Сохранение заполненной анкеты в БД
     """
-    context.user_data['city'] = update.message.text
-
-    # Сохраняем профиль в БД
-    db.update_user_profile(
-        user_id=update.effective_user.id,
-        name=context.user_data['name'],
-        age=context.user_data['age'],
-        city=context.user_data['city']
+    # Последний ответ не нужно сохранять в user_data: анкета сразу уходит в БД
+    user = update.effective_user
+    profile = {
+        "name": context.user_data['name'],
+        "age": context.user_data['age'],
+        **last_answer
+    }
+
+    # Сохраняем профиль в БД одним запросом (пользователь создается,
+    # даже если запись из /start еще не попала в БД)
+    await db.complete_registration(
+        user_id=user.id,
+        profile=profile,
+        username=user.username,
+        full_name=user.full_name
     )
 
     await update.message.reply_text(
         f"✅ Регистрация завершена!\n\n"
         f"📝 Ваши данные сохранены в базе данных:\n"
-        f"Имя: {context.user_data['name']}\n"
-        f"Возраст: {context.user_data['age']}\n"
-        f"Город: {context.user_data['city']}\n\n"
+        f"Имя: {profile['name']}\n"
+        f"Возраст: {profile['age']}\n"
+        f"Город: {profile['city']}\n\n"
         f"Используйте /profile для просмотра профиля"
     )
 
+    return end_conversation(update, context)
+
+
+def end_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Завершение диалога с удалением данных пользователя из памяти
+
+    context.user_data.clear() оставил бы пустой словарь на каждого
+    пользователя, поэтому запись удаляется целиком.
+    """
+    registrations.finish(update.effective_user.id)
+    context.application.drop_user_data(update.effective_user.id)
     return ConversationHandler.END
 
 
@@ -145,22 +191,65 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     Отмена регистрации
     """
     await update.message.reply_text("Регистрация отменена.")
-    return ConversationHandler.END
+    return end_conversation(update, context)
+
+
+async def conversation_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """
+    Сброс регистрации, на которую пользователь не ответил вовремя
+    """
+    await context.bot.send_message(
+        update.effective_chat.id,
+        "Время на регистрацию истекло. Используйте /start, чтобы начать заново."
+    )
+    return end_conversation(update, context)
+
+
+async def on_startup(application: Application) -> None:
+    """
+    Открытие БД при запуске бота
+    """
+    await db.open()
+
+
+async def on_shutdown(application: Application) -> None:
+    """
+    Закрытие БД при остановке бота
+    """
+    await db.close()
+    logging.info("Регистрации: %s", registrations.stats())
 
 
 def main() -> None:
-    application = Application.builder().token(TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # ConversationHandler
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
-            NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_name)],
-            AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_age)],
-            CITY: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_city)],
+            # Шаги анкеты: состояние -> обработчик ответа на этот шаг
+            **{
+                state: [MessageHandler(filters.TEXT & ~filters.COMMAND, registration_step(state))]
+                for state in REGISTRATION.states
+            },
+            # Вызывается по истечении conversation_timeout
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        # Брошенные регистрации не остаются в памяти навсегда
+        # (нужен JobQueue: pip install "python-telegram-bot[job-queue]")
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        # Диалог ведется по пользователю: вытесненную регистрацию можно
+        # сбросить по user_id (см. drop_registration)
+        per_chat=False,
     )
+    application.bot_data["registration"] = conv_handler
 
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("profile", show_profile))
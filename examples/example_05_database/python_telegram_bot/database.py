@@ -1,67 +1,537 @@
+import argparse
+import asyncio
+import csv
+import logging
 import sqlite3
-from typing import Optional
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
 
+from repository import User, UserRepository, chunked
 
-class Database:
-    def __init__(self, db_path: str = "users.db"):
+logger = logging.getLogger(__name__)
+
+# Настройки SQLite, применяются при каждом открытии соединения
+PRAGMAS = (
+    # WAL: читатели (/profile, /stats) не ждут писателей и наоборот
+    "PRAGMA journal_mode = WAL",
+    # В режиме WAL не теряет данные при падении процесса, но не делает
+    # fsync на каждый commit
+    "PRAGMA synchronous = NORMAL",
+    # Читаем файл БД через mmap (до 256 МБ) без лишнего копирования
+    "PRAGMA mmap_size = 268435456",
+    # Кеш страниц 64 МБ (отрицательное значение - размер в КБ)
+    "PRAGMA cache_size = -65536",
+)
+
+# Миграции схемы: миграция с индексом i переводит БД на версию i + 1.
+# Текущая версия хранится в PRAGMA user_version.
+# Новые миграции добавляются только в конец списка!
+MIGRATIONS = (
+    # 1: таблица пользователей
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        full_name TEXT,
+        name TEXT,
+        age INTEGER,
+        city TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    # 2: счетчик пользователей, который поддерживают триггеры,
+    # чтобы /stats не сканировал всю таблицу через COUNT(*)
+    """
+    CREATE TABLE IF NOT EXISTS users_count (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        count INTEGER NOT NULL
+    );
+    INSERT OR REPLACE INTO users_count (id, count) SELECT 1, COUNT(*) FROM users;
+    CREATE TRIGGER IF NOT EXISTS users_count_insert AFTER INSERT ON users
+    BEGIN
+        UPDATE users_count SET count = count + 1 WHERE id = 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_count_delete AFTER DELETE ON users
+    BEGIN
+        UPDATE users_count SET count = count - 1 WHERE id = 1;
+    END;
+    """,
+)
+
+# Признак отсутствия записи в кеше (None - допустимое значение профиля)
+MISSING = object()
+
+# Колонки в порядке полей User (SELECT * сломался бы при добавлении колонок)
+USER_COLUMNS = ", ".join(User._fields)
+
+# Завершение регистрации одним запросом: создает пользователя, если
+# /start еще не записан, иначе обновляет только поля анкеты
+COMPLETE_REGISTRATION_SQL = """
+    INSERT INTO users (user_id, username, full_name, name, age, city)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        name = excluded.name,
+        age = excluded.age,
+        city = excluded.city
+"""
+
+# Вставка или обновление пользователя целиком (для импорта)
+UPSERT_USER_SQL = f"""
+    INSERT INTO users ({USER_COLUMNS})
+    VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+    ON CONFLICT(user_id) DO UPDATE SET
+        username = excluded.username,
+        full_name = excluded.full_name,
+        name = excluded.name,
+        age = excluded.age,
+        city = excluded.city,
+        created_at = excluded.created_at
+"""
+
+# Очередная пачка пользователей после user_id (keyset-пагинация)
+SELECT_USERS_AFTER_SQL = f"""
+    SELECT {USER_COLUMNS} FROM users
+    WHERE user_id > ?
+    ORDER BY user_id
+    LIMIT ?
+"""
+
+# Меньше любого user_id - начальное значение для SELECT_USERS_AFTER_SQL
+MIN_USER_ID = -(2 ** 63)
+
+
+def user_factory(cursor, row: tuple) -> User:
+    """
+    Row factory: строит User прямо из кортежа строки
+    """
+    return User._make(row)
+
+
+def user_from_csv(row: List[str]) -> User:
+    """
+    Разбор строки CSV-выгрузки (пустая ячейка = None)
+    """
+    user_id, username, full_name, name, age, city, created_at = row
+    return User(
+        user_id=int(user_id),
+        username=username or None,
+        full_name=full_name or None,
+        name=name or None,
+        age=int(age) if age else None,
+        city=city or None,
+        created_at=created_at or None
+    )
+
+
+class UserCache:
+    """
+    LRU-кеш профилей пользователей с ограничением размера и TTL
+
+    Хранит результаты get_user (в том числе None для неизвестных
+    пользователей), чтобы /profile не ходил в SQLite на каждый запрос.
+    Счетчики hits/misses помогают подобрать размер кеша.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 300.0):
+        """
+        Args:
+            maxsize: Максимальное количество профилей в кеше
+            ttl: Время жизни записи (сек)
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Номер поколения растет при каждой инвалидации: так get_user
+        # не положит в кеш значение, прочитанное до изменения профиля
+        self.generation = 0
+        self._data: "OrderedDict[int, Tuple[float, Optional[User]]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, user_id: int) -> Any:
+        """
+        Профиль из кеша или MISSING, если его нет или он устарел
+        """
+        entry = self._data.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[user_id]
+            self.misses += 1
+            return MISSING
+
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user_id: int, user: Optional[User], generation: int):
+        """
+        Сохранение профиля, прочитанного в поколении generation
+        """
+        if generation != self.generation:
+            return
+
+        self._data[user_id] = (time.monotonic() + self.ttl, user)
+        self._data.move_to_end(user_id)
+        if len(self._data) > self.maxsize:
+            # Вытесняем давно не использованный профиль
+            self._data.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """
+        Удаление профиля из кеша после его изменения
+        """
+        self.generation += 1
+        self._data.pop(user_id, None)
+
+    def clear(self):
+        """
+        Очистка кеша (после массовой загрузки)
+        """
+        self.generation += 1
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Статистика кеша: попадания, промахи и текущий размер
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+class Database(UserRepository):
+    """
+    Асинхронная обертка над sqlite3
+
+    sqlite3 - синхронная библиотека: commit ждет записи на диск и блокирует
+    event loop, а вместе с ним и всех остальных пользователей бота.
+    Поэтому все запросы выполняются в одном выделенном потоке,
+    а обработчики только ждут результат через await.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "users.db",
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        cache_size: int = 10_000,
+        cache_ttl: float = 300.0
+    ):
+        """
+        Args:
+            db_path: Путь к файлу БД
+            batch_size: Сколько новых пользователей копить до записи
+            flush_interval: Максимальная задержка (сек) записи новых пользователей
+            cache_size: Максимальное количество профилей в кеше get_user
+            cache_ttl: Время жизни профиля в кеше (сек)
+        """
         self.db_path = db_path
-        self.create_tables()
-
-    def create_tables(self):
-        """
-        Создание таблиц в БД
-        """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    full_name TEXT,
-                    name TEXT,
-                    age INTEGER,
-                    city TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Поток БД создается в open(): один поток = одно соединение,
+        # запросы выполняются по очереди
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        # Очередь отложенной записи add_user: {user_id: (user_id, username, full_name)}
+        self._pending_users: Dict[int, Tuple[int, Optional[str], str]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.cache = UserCache(maxsize=cache_size, ttl=cache_ttl)
 
-    def add_user(self, user_id: int, username: Optional[str], full_name: str):
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
         """
-        Добавление пользователя в БД
+        Выполнение функции в потоке БД
+        """
+        if self._executor is None:
+            raise RuntimeError("База данных не открыта: вызовите await db.open()")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def open(self):
+        """
+        Открытие соединения с БД, настройка и миграция схемы
+        """
+        if self._executor is not None:
+            return
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+        await self._run(self._open)
+        self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        """
+        Запись накопленных данных, закрытие соединения и остановка потока
+        """
+        if self._executor is None:
+            return
+
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._flush_task
+            self._flush_task = None
+
+        await self.flush()
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def _open(self):
+        if self._conn is None:
+            # Соединение создается в потоке БД и используется только в нем
+            self._conn = sqlite3.connect(self.db_path)
+            for pragma in PRAGMAS:
+                self._conn.execute(pragma)
+            self._migrate()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _migrate(self):
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                "INSERT OR IGNORE INTO users (user_id, username, full_name) VALUES (?, ?, ?)",
-                (user_id, username, full_name)
+        Применение новых миграций схемы
+        """
+        (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            # Миграция и новая версия схемы применяются одной транзакцией
+            self._conn.executescript(
+                f"BEGIN; {script} PRAGMA user_version = {number}; COMMIT;"
             )
-            conn.commit()
+            logger.info(f"БД {self.db_path} обновлена до версии {number}")
+
+    async def add_user(self, user_id: int, username: Optional[str], full_name: str):
+        """
+        Добавление пользователя в БД
+
+        Запись отложенная: пользователи копятся в очереди и сохраняются
+        одной транзакцией (один fsync на пачку, а не на каждого)
+        """
+        # Как и INSERT OR IGNORE, сохраняем первую запись о пользователе
+        self._pending_users.setdefault(user_id, (user_id, username, full_name))
+        self.cache.invalidate(user_id)
+
+        if len(self._pending_users) >= self.batch_size:
+            await self.flush()
 
-    def update_user_profile(self, user_id: int, name: str, age: int, city: str):
+    async def flush(self):
+        """
+        Запись накопленных пользователей одной транзакцией
+        """
+        if not self._pending_users:
+            return
+
+        # Забираем очередь до первого await, чтобы новые add_user
+        # попали уже в следующую пачку
+        users = list(self._pending_users.values())
+        self._pending_users = {}
+
+        await self._run(self._add_users, users)
+
+    def _add_users(self, users: List[Tuple[int, Optional[str], str]]):
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, username, full_name) VALUES (?, ?, ?)",
+            users
+        )
+        self._conn.commit()
+
+    async def _flush_periodically(self):
+        """
+        Фоновая запись очереди не реже, чем раз в flush_interval
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Не удалось записать новых пользователей в БД")
+
+    async def update_user_profile(self, user_id: int, name: str, age: int, city: str):
         """
         Обновление профиля пользователя
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                "UPDATE users SET name = ?, age = ?, city = ? WHERE user_id = ?",
-                (name, age, city, user_id)
-            )
-            conn.commit()
+        # Пользователь может быть еще в очереди - UPDATE его бы не нашел
+        if user_id in self._pending_users:
+            await self.flush()
+
+        await self._run(self._update_user_profile, user_id, name, age, city)
+        self.cache.invalidate(user_id)
+
+    def _update_user_profile(self, user_id: int, name: str, age: int, city: str):
+        self._conn.execute(
+            "UPDATE users SET name = ?, age = ?, city = ? WHERE user_id = ?",
+            (name, age, city, user_id)
+        )
+        self._conn.commit()
+
+    async def complete_registration(
+        self,
+        user_id: int,
+        profile: Mapping[str, Any],
+        username: Optional[str] = None,
+        full_name: Optional[str] = None
+    ):
+        """
+        Сохранение анкеты одним атомарным запросом (upsert)
 
-    def get_user(self, user_id: int):
+        Если add_user для пользователя еще в очереди или /start был
+        пропущен, строка создается этим же запросом.
+
+        Args:
+            user_id: ID пользователя
+            profile: Анкета с ключами name, age, city
+            username: @username (нужен, только если пользователя еще нет)
+            full_name: Полное имя (нужно, только если пользователя еще нет)
+        """
+        # Запись из очереди add_user больше не нужна - вставим ее здесь
+        pending = self._pending_users.pop(user_id, None)
+        if pending is not None:
+            _, username, full_name = pending
+
+        params = (
+            user_id, username, full_name,
+            profile["name"], profile["age"], profile["city"]
+        )
+        await self._run(self._complete_registration, params)
+        self.cache.invalidate(user_id)
+
+    def _complete_registration(self, params: tuple):
+        self._conn.execute(COMPLETE_REGISTRATION_SQL, params)
+        self._conn.commit()
+
+    async def get_user(self, user_id: int) -> Optional[User]:
         """
         Получение данных пользователя
+
+        Сначала ищем профиль в кеше, в БД идем только при промахе
         """
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.execute(
-                "SELECT * FROM users WHERE user_id = ?", (user_id,)
-            )
-            return cursor.fetchone()
+        user = self.cache.get(user_id)
+        if user is not MISSING:
+            return user
 
-    def get_all_users_count(self) -> int:
+        if user_id in self._pending_users:
+            await self.flush()
+
+        generation = self.cache.generation
+        user = await self._run(self._get_user, user_id)
+        self.cache.put(user_id, user, generation)
+        return user
+
+    def _get_user(self, user_id: int) -> Optional[User]:
+        cursor = self._conn.execute(
+            f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ?", (user_id,)
+        )
+        cursor.row_factory = user_factory
+        return cursor.fetchone()
+
+    async def get_all_users_count(self) -> int:
         """
         Получение количества пользователей
+
+        Значение берется из счетчика users_count за O(1),
+        независимо от размера таблицы
+        """
+        await self.flush()
+
+        return await self._run(self._get_all_users_count)
+
+    def _get_all_users_count(self) -> int:
+        cursor = self._conn.execute("SELECT count FROM users_count WHERE id = 1")
+        return cursor.fetchone()[0]
+
+    async def bulk_upsert_users(self, users: Iterable[Iterable], batch_size: int = 10_000) -> int:
+        """
+        Массовая загрузка пользователей (вставка или обновление)
+
+        Записи пишутся через executemany пачками по batch_size,
+        по одной транзакции на пачку - память не зависит от объема данных
+
+        Args:
+            users: Записи User или кортежи в порядке полей User
+            batch_size: Размер пачки
+
+        Returns:
+            Количество загруженных записей
+        """
+        await self.flush()
+
+        count = 0
+        for chunk in chunked(users, batch_size):
+            await self._run(self._upsert_users, chunk)
+            count += len(chunk)
+
+        self.cache.clear()
+        return count
+
+    def _upsert_users(self, users: List[Iterable]):
+        self._conn.executemany(UPSERT_USER_SQL, users)
+        self._conn.commit()
+
+    async def iter_users(self, batch_size: int = 10_000) -> AsyncIterator[User]:
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute("SELECT COUNT(*) FROM users")
-            return cursor.fetchone()[0]
+        Потоковое чтение всех пользователей в порядке user_id
+
+        Пачки читаются по batch_size записей через keyset-пагинацию
+        (WHERE user_id > последний), поэтому память не растет с размером
+        таблицы, а поток БД между пачками свободен для обработчиков бота
+        """
+        await self.flush()
+
+        last_user_id = MIN_USER_ID
+        while True:
+            users = await self._run(self._get_users_after, last_user_id, batch_size)
+
+            for user in users:
+                yield user
+
+            if len(users) < batch_size:
+                return
+            last_user_id = users[-1].user_id
+
+    def _get_users_after(self, user_id: int, limit: int) -> List[User]:
+        cursor = self._conn.execute(SELECT_USERS_AFTER_SQL, (user_id, limit))
+        cursor.row_factory = user_factory
+        return cursor.fetchall()
+
+
+async def run_cli(args: argparse.Namespace):
+    """
+    Импорт/экспорт пользователей в CSV
+    """
+    db = Database(args.db)
+    await db.open()
+    try:
+        if args.command == "export":
+            count = 0
+            with open(args.file, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(User._fields)
+                async for user in db.iter_users(args.batch_size):
+                    writer.writerow(user)
+                    count += 1
+            print(f"Выгружено пользователей: {count}")
+        else:
+            with open(args.file, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                next(reader, None)  # Заголовок
+                count = await db.bulk_upsert_users(
+                    (user_from_csv(row) for row in reader), args.batch_size
+                )
+            print(f"Загружено пользователей: {count}")
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    # python database.py export users.csv
+    # python database.py import users.csv --db other.db
+    parser = argparse.ArgumentParser(description="Импорт и экспорт пользователей бота")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("file", help="CSV-файл")
+    parser.add_argument("--db", default="users.db", help="Путь к файлу БД")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="Размер пачки")
+    asyncio.run(run_cli(parser.parse_args()))
@@ -0,0 +1,104 @@
+"""
+Учет незавершенных регистраций с ограничением количества
+
+conversation_timeout у ConversationHandler сбрасывает брошенные
+регистрации по времени, но не ограничивает, сколько их накопится за
+это время: всплеск /start держит в памяти состояние диалога, задачу
+таймаута и user_data каждого пользователя. ActiveRegistrations помнит,
+кто сейчас заполняет анкету, и при превышении max_entries вытесняет
+самые давние регистрации (LRU):
+
+    for user_id in registrations.start(user.id):
+        drop_registration(context.application, conversation, user_id)
+"""
+
+from collections import OrderedDict
+from typing import Dict, List
+
+from telegram.ext import Application, ConversationHandler
+
+
+class ActiveRegistrations:
+    """
+    Пользователи, которые сейчас заполняют анкету, в порядке начала
+    """
+
+    def __init__(self, max_entries: int = 100_000):
+        """
+        Args:
+            max_entries: Максимальное количество незавершенных регистраций
+        """
+        self.max_entries = max_entries
+        # Упорядоченное множество ID: самый давний - первый
+        self._started: "OrderedDict[int, None]" = OrderedDict()
+        # Счетчик вытесненных регистраций (для stats())
+        self.evicted = 0
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._started
+
+    def start(self, user_id: int) -> List[int]:
+        """
+        Начало (или перезапуск) регистрации пользователя
+
+        Args:
+            user_id: ID пользователя
+
+        Returns:
+            ID пользователей, чьи регистрации вытеснены - их нужно
+            сбросить через drop_registration()
+        """
+        self._started.pop(user_id, None)
+        self._started[user_id] = None
+
+        evicted = []
+        while len(self._started) > self.max_entries:
+            old_user_id, _ = self._started.popitem(last=False)
+            evicted.append(old_user_id)
+        self.evicted += len(evicted)
+        return evicted
+
+    def finish(self, user_id: int):
+        """
+        Завершение, отмена или сброс регистрации по таймауту
+        """
+        self._started.pop(user_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Текущее количество регистраций и счетчик вытесненных
+
+        Returns:
+            Словарь с ключами size, max_entries, evicted
+        """
+        return {
+            "size": len(self._started),
+            "max_entries": self.max_entries,
+            "evicted": self.evicted,
+        }
+
+
+def drop_registration(application: Application, conversation: ConversationHandler, user_id: int):
+    """
+    Полный сброс регистрации пользователя: состояние диалога, задача
+    conversation_timeout и user_data
+
+    Диалог должен вестись по пользователю (per_chat=False,
+    per_message=False), чтобы его ключ определялся по user_id.
+
+    Args:
+        application: Приложение бота
+        conversation: ConversationHandler регистрации
+        user_id: ID пользователя
+    """
+    if conversation.per_chat or conversation.per_message:
+        raise ValueError("Регистрация должна вестись по пользователю (per_chat=False)")
+
+    key = (user_id,)
+    job = conversation.timeout_jobs.pop(key, None)
+    if job is not None:
+        job.schedule_removal()
+    # У ConversationHandler нет публичного метода, завершающего чужой
+    # диалог: используем тот же, которым он сам обрабатывает END
+    conversation._update_state(ConversationHandler.END, key)
+    application.drop_user_data(user_id)
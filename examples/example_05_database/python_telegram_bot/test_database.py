@@ -0,0 +1,84 @@
+"""
+Тесты Database: открытие/закрытие и задержки обработчиков под нагрузкой
+
+Запуск из этой папки:
+
+    python -m pytest
+"""
+
+import asyncio
+import time
+from typing import List
+
+from database import Database
+
+PROFILE = {"name": "Иван", "age": 30, "city": "Москва"}
+# Имитация медленного commit (fsync на загруженном диске)
+COMMIT_DELAY = 0.05
+WRITES = 40
+
+
+def test_open_and_close_are_idempotent(tmp_path):
+    async def main():
+        db = Database(str(tmp_path / "users.db"))
+        await db.open()
+        await db.open()
+        await db.add_user(1, "ivan", "Иван Петров")
+        await db.close()
+        await db.close()
+
+        # Повторное открытие после close() создает новый поток БД
+        await db.open()
+        try:
+            return await db.get_all_users_count()
+        finally:
+            await db.close()
+
+    assert asyncio.run(main()) == 1
+
+
+def test_slow_commits_do_not_block_other_chats(tmp_path, monkeypatch):
+    complete_registration = Database._complete_registration
+
+    def slow_complete_registration(self, params: tuple):
+        time.sleep(COMMIT_DELAY)
+        complete_registration(self, params)
+
+    monkeypatch.setattr(Database, "_complete_registration", slow_complete_registration)
+
+    async def main():
+        db = Database(str(tmp_path / "users.db"))
+        await db.open()
+        lags: List[float] = []
+        writing = True
+
+        async def other_chat():
+            # Обработчик другого чата: должен запускаться вовремя,
+            # пока идут записи
+            loop = asyncio.get_running_loop()
+            while writing:
+                started = loop.time()
+                await asyncio.sleep(0.001)
+                lags.append(loop.time() - started - 0.001)
+
+        probe = asyncio.create_task(other_chat())
+        try:
+            await asyncio.gather(*(
+                db.complete_registration(user_id, PROFILE, f"user{user_id}", "Test")
+                for user_id in range(WRITES)
+            ))
+            count = await db.get_all_users_count()
+        finally:
+            writing = False
+            await probe
+            await db.close()
+        return count, sorted(lags)
+
+    count, lags = asyncio.run(main())
+    assert count == WRITES
+    # Записи идут ~WRITES * COMMIT_DELAY = 2 сек, но event loop ни разу
+    # не стоит дольше одного commit (при вызове sqlite3 прямо в
+    # обработчике задержка была бы COMMIT_DELAY на каждую запись)
+    p99 = lags[int(len(lags) * 0.99)]
+    assert p99 < COMMIT_DELAY / 2
+    assert lags[-1] < COMMIT_DELAY
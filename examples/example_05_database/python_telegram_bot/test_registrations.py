@@ -0,0 +1,119 @@
+"""
+Тесты ActiveRegistrations
+
+Запуск из этой папки:
+
+    python -m pytest
+"""
+
+import asyncio
+from datetime import datetime
+
+import pytest
+from telegram import Chat, Message, Update, User
+from telegram.ext import (
+    Application,
+    CallbackContext,
+    ContextTypes,
+    ConversationHandler,
+    MessageHandler,
+    filters
+)
+
+from registrations import ActiveRegistrations, drop_registration
+
+
+def test_oldest_registrations_are_evicted():
+    registrations = ActiveRegistrations(max_entries=2)
+    assert registrations.start(1) == []
+    assert registrations.start(2) == []
+    # Повторный /start переносит регистрацию в конец очереди
+    assert registrations.start(1) == []
+    assert registrations.start(3) == [2]
+    assert 2 not in registrations
+    assert 1 in registrations and 3 in registrations
+    assert registrations.stats() == {"size": 2, "max_entries": 2, "evicted": 1}
+
+
+def test_finish_removes_registration():
+    registrations = ActiveRegistrations()
+    registrations.start(1)
+    registrations.finish(1)
+    registrations.finish(2)
+    assert 1 not in registrations
+    assert registrations.stats()["size"] == 0
+
+
+class FakeJob:
+    def __init__(self):
+        self.removed = False
+
+    def schedule_removal(self):
+        self.removed = True
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name="Test"),
+            text=text
+        )
+    )
+
+
+async def process_update(application: Application, conversation: ConversationHandler, update: Update):
+    """
+    Обработка update, как в Application.process_update (без запуска
+    Application, которому нужен доступ к Bot API)
+    """
+    check = conversation.check_update(update)
+    context = CallbackContext.from_update(update, application)
+    await conversation.handle_update(update, application, check, context)
+
+
+def test_evicted_registration_ends_conversation():
+    registrations = ActiveRegistrations(max_entries=2)
+    application = Application.builder().token("42:TEST").build()
+
+    async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+        conversation = context.application.bot_data["registration"]
+        for user_id in registrations.start(update.effective_user.id):
+            drop_registration(context.application, conversation, user_id)
+        context.user_data["started"] = True
+        return "name"
+
+    conversation = ConversationHandler(
+        # CommandHandler требует username бота, то есть запущенного Application
+        entry_points=[MessageHandler(filters.TEXT, start)],
+        states={"name": []},
+        fallbacks=[],
+        per_chat=False
+    )
+    application.add_handler(conversation)
+    application.bot_data["registration"] = conversation
+
+    async def main():
+        for user_id in (1, 2):
+            await process_update(application, conversation, make_update(user_id, user_id, "/start"))
+        # Задача conversation_timeout первого пользователя (JobQueue в
+        # тестах не запускается)
+        job = conversation.timeout_jobs[(1,)] = FakeJob()
+        await process_update(application, conversation, make_update(3, 3, "/start"))
+        return job
+
+    job = asyncio.run(main())
+    assert set(conversation._conversations) == {(2,), (3,)}
+    assert job.removed and (1,) not in conversation.timeout_jobs
+    assert set(application.user_data) == {2, 3}
+    assert registrations.stats()["evicted"] == 1
+
+
+def test_drop_registration_requires_per_user_conversation():
+    application = Application.builder().token("42:TEST").build()
+    conversation = ConversationHandler(entry_points=[], states={}, fallbacks=[])
+    with pytest.raises(ValueError):
+        drop_registration(application, conversation, 1)
@@ -20,7 +20,9 @@ from aiogram.types import (
     BufferedInputFile
 )
 from aiogram.enums import UpdateType
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+
+from renderer import FONT_BOLD, FONT_REGULAR, Renderer, load_font, preload_fonts, workers_from_env
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -38,6 +40,16 @@ if not BOT_TOKEN:
 # Роутер для обработчиков
 router = Router()
 
+# Шрифты функций отрисовки (загружаются заранее)
+FONTS = [(FONT_BOLD, 40), (FONT_REGULAR, 20)]
+
+# Пул процессов отрисовки (см. renderer.py)
+renderer = Renderer(
+    workers=workers_from_env(),
+    initializer=preload_fonts,
+    initargs=(FONTS,)
+)
+
 
 def generate_image_placeholder(settings: dict) -> BytesIO:
     """
@@ -58,13 +70,8 @@ def generate_image_placeholder(settings: dict) -> BytesIO:
     image = Image.new('RGB', (width, height), color=(100, 150, 255))
     draw = ImageDraw.Draw(image)
 
-    # Пытаемся загрузить шрифт
-    try:
-        font_large = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 40)
-        font_small = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 20)
-    except:
-        font_large = ImageFont.load_default()
-        font_small = ImageFont.load_default()
+    font_large = load_font(FONT_BOLD, 40)
+    font_small = load_font(FONT_REGULAR, 20)
 
     # Рисуем информацию о настройках
     y_offset = height // 4
@@ -251,7 +258,7 @@ async def handle_generation_settings(message: Message, settings: dict):
         await asyncio.sleep(0.5)
 
         # Генерируем placeholder
-        image_bytes = generate_image_placeholder(settings)
+        image_bytes = await renderer.render(generate_image_placeholder, settings)
 
         # Отправляем (aiogram 3.x требует BufferedInputFile)
         await message.answer_photo(
@@ -296,6 +303,10 @@ async def cmd_help(message: Message):
 
 async def main():
     """Главная функция запуска бота"""
+    # Пул отрисовки запускается до polling (см. Renderer.start)
+    renderer.start()
+    preload_fonts(FONTS)
+
     # Создаем бота и диспетчер
     bot = Bot(token=BOT_TOKEN)
     dp = Dispatcher()
@@ -316,6 +327,7 @@ async def main():
         )
     finally:
         await bot.session.close()
+        renderer.close()
 
 
 if __name__ == "__main__":
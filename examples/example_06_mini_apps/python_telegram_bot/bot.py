@@ -17,7 +17,9 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+
+from renderer import FONT_BOLD, FONT_REGULAR, Renderer, load_font, preload_fonts, workers_from_env
 
 # Настройка логирования
 logging.basicConfig(
@@ -34,6 +36,16 @@ WEBAPP_URL = os.getenv("WEBAPP_URL", "https://example.com/webapp.html")
 if not BOT_TOKEN:
     raise ValueError("Не указан BOT_TOKEN! Установите переменную окружения.")
 
+# Шрифты функций отрисовки (загружаются заранее)
+FONTS = [(FONT_BOLD, 40), (FONT_REGULAR, 20)]
+
+# Пул процессов отрисовки (см. renderer.py)
+renderer = Renderer(
+    workers=workers_from_env(),
+    initializer=preload_fonts,
+    initargs=(FONTS,)
+)
+
 
 def generate_image_placeholder(settings: dict) -> BytesIO:
     """
@@ -54,13 +66,8 @@ def generate_image_placeholder(settings: dict) -> BytesIO:
     image = Image.new('RGB', (width, height), color=(100, 150, 255))
     draw = ImageDraw.Draw(image)
 
-    # Пытаемся загрузить шрифт
-    try:
-        font_large = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 40)
-        font_small = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 20)
-    except:
-        font_large = ImageFont.load_default()
-        font_small = ImageFont.load_default()
+    font_large = load_font(FONT_BOLD, 40)
+    font_small = load_font(FONT_REGULAR, 20)
 
     # Рисуем информацию о настройках
     y_offset = height // 4
@@ -248,7 +255,7 @@ async def handle_generation_settings(
         await asyncio.sleep(0.5)
 
         # Генерируем placeholder
-        image = generate_image_placeholder(settings)
+        image = await renderer.render(generate_image_placeholder, settings)
 
         # Отправляем
         await update.message.reply_photo(
@@ -289,6 +296,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 def main() -> None:
     """Главная функция запуска бота"""
+    # Пул отрисовки запускается до polling (см. Renderer.start)
+    renderer.start()
+    preload_fonts(FONTS)
+
     # Создаем приложение
     application = Application.builder().token(BOT_TOKEN).build()
 
@@ -307,7 +318,10 @@ def main() -> None:
     logger.info(f"WebApp URL: {WEBAPP_URL}")
 
     # Запускаем бота
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    try:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        renderer.close()
 
 
 if __name__ == "__main__":
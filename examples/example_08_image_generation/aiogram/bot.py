@@ -12,9 +12,11 @@ from aiogram.filters import CommandStart, Command
 from aiogram.types import Message, FSInputFile, BufferedInputFile, URLInputFile
 
 # Для примера генерации изображений
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 import random
 
+from renderer import FONT_BOLD, FONT_REGULAR, Renderer, load_font, preload_fonts, workers_from_env
+
 logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 
 TOKEN = getenv("BOT_TOKEN")
@@ -24,6 +26,16 @@ router = Router()
 OUTPUT_DIR = Path("generated_images")
 OUTPUT_DIR.mkdir(exist_ok=True)
 
+# Шрифты функций отрисовки (загружаются заранее)
+FONTS = [(FONT_BOLD, 60), (FONT_BOLD, 30), (FONT_REGULAR, 20), (FONT_BOLD, 40)]
+
+# Пул процессов отрисовки (см. renderer.py)
+renderer = Renderer(
+    workers=workers_from_env(),
+    initializer=preload_fonts,
+    initargs=(FONTS,)
+)
+
 
 def generate_placeholder_image(width: int = 800, height: int = 600, text: str = "Generated") -> Path:
     """
@@ -43,10 +55,7 @@ def generate_placeholder_image(width: int = 800, height: int = 600, text: str =
     draw = ImageDraw.Draw(image)
 
     # Добавляем текст
-    try:
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 60)
-    except:
-        font = ImageFont.load_default()
+    font = load_font(FONT_BOLD, 60)
 
     # Центрируем текст
     bbox = draw.textbbox((0, 0), text, font=font)
@@ -73,11 +82,8 @@ def create_chart_image(data: list[int], title: str = "Chart") -> BytesIO:
     draw = ImageDraw.Draw(image)
 
     # Заголовок
-    try:
-        font_title = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 30)
-        font_label = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 20)
-    except:
-        font_title = font_label = ImageFont.load_default()
+    font_title = load_font(FONT_BOLD, 30)
+    font_label = load_font(FONT_REGULAR, 20)
 
     draw.text((20, 20), title, fill=(0, 0, 0), font=font_title)
 
@@ -133,7 +139,7 @@ async def generate_image(message: Message) -> None:
     await message.answer("🎨 Генерирую изображение...")
 
     # Генерируем изображение
-    image_path = generate_placeholder_image(text="AI Generated!")
+    image_path = await renderer.render(generate_placeholder_image, text="AI Generated!")
 
     # Отправляем как фото
     photo = FSInputFile(image_path)
@@ -159,7 +165,7 @@ async def generate_chart(message: Message) -> None:
     data = [random.randint(10, 100) for _ in range(7)]
 
     # Создаем график
-    chart_bytes = create_chart_image(data, title="Weekly Stats")
+    chart_bytes = await renderer.render(create_chart_image, data, title="Weekly Stats")
 
     # Отправляем из памяти (без сохранения на диск)
     photo = BufferedInputFile(chart_bytes.read(), filename="chart.png")
@@ -178,7 +184,7 @@ async def send_from_file(message: Message) -> None:
     Используется когда файл уже сохранен на диске
     """
     # Генерируем файл
-    image_path = generate_placeholder_image(text="From File")
+    image_path = await renderer.render(generate_placeholder_image, text="From File")
 
     # Отправляем через FSInputFile
     photo = FSInputFile(image_path, filename="from_file.png")
@@ -199,10 +205,7 @@ async def send_from_bytes(message: Message) -> None:
     image = Image.new('RGB', (400, 300), color=(255, 100, 100))
     draw = ImageDraw.Draw(image)
 
-    try:
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 40)
-    except:
-        font = ImageFont.load_default()
+    font = load_font(FONT_BOLD, 40)
 
     draw.text((50, 125), "From Memory", fill=(255, 255, 255), font=font)
 
@@ -255,7 +258,7 @@ async def text_on_image(message: Message) -> None:
     await message.answer(f"🎨 Создаю изображение с текстом: '{text}'...")
 
     # Генерируем изображение с текстом
-    image_path = generate_placeholder_image(text=text)
+    image_path = await renderer.render(generate_placeholder_image, text=text)
 
     # Отправляем
     photo = FSInputFile(image_path)
@@ -274,10 +277,13 @@ async def send_media_group(message: Message) -> None:
 
     from aiogram.types import InputMediaPhoto
 
-    # Генерируем несколько изображений
+    # Генерируем несколько изображений параллельно
+    image_paths = await asyncio.gather(*(
+        renderer.render(generate_placeholder_image, text=f"Image {i+1}")
+        for i in range(3)
+    ))
     images = []
-    for i in range(3):
-        image_path = generate_placeholder_image(text=f"Image {i+1}")
+    for i, image_path in enumerate(image_paths):
         images.append(InputMediaPhoto(
             media=FSInputFile(image_path),
             caption=f"Изображение {i+1}" if i == 0 else None  # Подпись только к первому
@@ -296,7 +302,9 @@ async def send_as_document(message: Message) -> None:
     await message.answer("📄 Отправляю как документ...")
 
     # Генерируем изображение
-    image_path = generate_placeholder_image(width=3000, height=2000, text="High Quality")
+    image_path = await renderer.render(
+        generate_placeholder_image, width=3000, height=2000, text="High Quality"
+    )
 
     # Отправляем как документ (без сжатия Telegram)
     document = FSInputFile(image_path)
@@ -337,10 +345,17 @@ async def help_command(message: Message) -> None:
 
 
 async def main() -> None:
+    # Пул отрисовки запускается до polling (см. Renderer.start)
+    renderer.start()
+    preload_fonts(FONTS)
+
     bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     dp = Dispatcher()
     dp.include_router(router)
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        renderer.close()
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 from pathlib import Path
@@ -8,7 +9,9 @@ from telegram import Update, InputMediaPhoto
 from telegram.ext import Application, CommandHandler, ContextTypes
 
 # Для примера генерации изображений
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+
+from renderer import FONT_BOLD, FONT_REGULAR, Renderer, load_font, preload_fonts, workers_from_env
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -21,6 +24,16 @@ TOKEN = os.getenv("BOT_TOKEN")
 OUTPUT_DIR = Path("generated_images")
 OUTPUT_DIR.mkdir(exist_ok=True)
 
+# Шрифты функций отрисовки (загружаются заранее)
+FONTS = [(FONT_BOLD, 60), (FONT_BOLD, 30), (FONT_REGULAR, 20), (FONT_BOLD, 40)]
+
+# Пул процессов отрисовки (см. renderer.py)
+renderer = Renderer(
+    workers=workers_from_env(),
+    initializer=preload_fonts,
+    initargs=(FONTS,)
+)
+
 
 def generate_placeholder_image(width: int = 800, height: int = 600, text: str = "Generated") -> Path:
     """
@@ -33,10 +46,7 @@ def generate_placeholder_image(width: int = 800, height: int = 600, text: str =
     ))
     draw = ImageDraw.Draw(image)
 
-    try:
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 60)
-    except:
-        font = ImageFont.load_default()
+    font = load_font(FONT_BOLD, 60)
 
     bbox = draw.textbbox((0, 0), text, font=font)
     text_width = bbox[2] - bbox[0]
@@ -59,11 +69,8 @@ def create_chart_image(data: list[int], title: str = "Chart") -> BytesIO:
     image = Image.new('RGB', (width, height), color=(255, 255, 255))
     draw = ImageDraw.Draw(image)
 
-    try:
-        font_title = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 30)
-        font_label = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 20)
-    except:
-        font_title = font_label = ImageFont.load_default()
+    font_title = load_font(FONT_BOLD, 30)
+    font_label = load_font(FONT_REGULAR, 20)
 
     draw.text((20, 20), title, fill=(0, 0, 0), font=font_title)
 
@@ -112,7 +119,7 @@ async def generate_image(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """
     await update.message.reply_text("🎨 Генерирую изображение...")
 
-    image_path = generate_placeholder_image(text="AI Generated!")
+    image_path = await renderer.render(generate_placeholder_image, text="AI Generated!")
 
     with open(image_path, 'rb') as photo:
         await update.message.reply_photo(
@@ -134,7 +141,7 @@ async def generate_chart(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await update.message.reply_text("📊 Создаю график...")
 
     data = [random.randint(10, 100) for _ in range(7)]
-    chart_bytes = create_chart_image(data, title="Weekly Stats")
+    chart_bytes = await renderer.render(create_chart_image, data, title="Weekly Stats")
 
     await update.message.reply_photo(
         chart_bytes,
@@ -149,7 +156,7 @@ async def send_from_file(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """
     Отправка изображения из файла
     """
-    image_path = generate_placeholder_image(text="From File")
+    image_path = await renderer.render(generate_placeholder_image, text="From File")
 
     with open(image_path, 'rb') as photo:
         await update.message.reply_photo(
@@ -167,10 +174,7 @@ async def send_from_bytes(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     image = Image.new('RGB', (400, 300), color=(255, 100, 100))
     draw = ImageDraw.Draw(image)
 
-    try:
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 40)
-    except:
-        font = ImageFont.load_default()
+    font = load_font(FONT_BOLD, 40)
 
     draw.text((50, 125), "From Memory", fill=(255, 255, 255), font=font)
 
@@ -214,7 +218,7 @@ async def text_on_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
     await update.message.reply_text(f"🎨 Создаю изображение с текстом: '{text}'...")
 
-    image_path = generate_placeholder_image(text=text)
+    image_path = await renderer.render(generate_placeholder_image, text=text)
 
     with open(image_path, 'rb') as photo:
         await update.message.reply_photo(
@@ -230,9 +234,13 @@ async def send_media_group(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     """
     await update.message.reply_text("📸 Создаю альбом из 3 изображений...")
 
+    # Генерируем несколько изображений параллельно
+    image_paths = await asyncio.gather(*(
+        renderer.render(generate_placeholder_image, text=f"Image {i+1}")
+        for i in range(3)
+    ))
     media = []
-    for i in range(3):
-        image_path = generate_placeholder_image(text=f"Image {i+1}")
+    for i, image_path in enumerate(image_paths):
         with open(image_path, 'rb') as photo:
             media.append(InputMediaPhoto(
                 media=photo.read(),
@@ -249,7 +257,9 @@ async def send_as_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     """
     await update.message.reply_text("📄 Отправляю как документ...")
 
-    image_path = generate_placeholder_image(width=3000, height=2000, text="High Quality")
+    image_path = await renderer.render(
+        generate_placeholder_image, width=3000, height=2000, text="High Quality"
+    )
 
     with open(image_path, 'rb') as document:
         await update.message.reply_document(
@@ -290,6 +300,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 
 def main() -> None:
+    # Пул отрисовки запускается до polling (см. Renderer.start)
+    renderer.start()
+    preload_fonts(FONTS)
+
     application = Application.builder().token(TOKEN).build()
 
     # Регистрируем обработчики
@@ -304,7 +318,10 @@ def main() -> None:
     application.add_handler(CommandHandler("document", send_as_document))
     application.add_handler(CommandHandler("help", help_command))
 
-    application.run_polling()
+    try:
+        application.run_polling()
+    finally:
+        renderer.close()
 
 
 if __name__ == '__main__':
@@ -5,14 +5,126 @@ Middleware для группировки Media Group сообщений (aiogram
 
 import asyncio
 import logging
-from typing import Any, Awaitable, Callable, Dict, List
+from typing import Any, AsyncIterator, Awaitable, Callable, Coroutine, Dict, List, Optional, Set
 
 from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
 from aiogram.types import Message
 
+from album_store import AlbumLost, AlbumStore, MemoryAlbumStore
+
 logger = logging.getLogger(__name__)
 
 
+# Telegram не собирает в один альбом больше 10 файлов
+MAX_ALBUM_SIZE = 10
+
+
+class AlbumStream:
+    """
+    Сообщения альбома по мере их получения
+
+    Обработчик с флагом album="stream" вызывается сразу после первого
+    сообщения альбома и получает AlbumStream в аргументе album_stream.
+    Итерация отдает сообщения в порядке получения и заканчивается, когда
+    альбом собран, поэтому работа с первыми фото (скачивание, анализ)
+    идет, пока остальные еще доставляются:
+
+        async for message in album_stream:
+            await bot.download(message.photo[-1], destination=...)
+    """
+    __slots__ = ("media_group_id", "messages", "complete", "_arrived")
+
+    def __init__(self, media_group_id: str):
+        self.media_group_id = media_group_id
+        # Все полученные сообщения альбома
+        self.messages: List[Message] = []
+        # Альбом собран, новых сообщений не будет
+        self.complete = False
+        self._arrived = asyncio.Event()
+
+    def _append(self, message: Message):
+        self.messages.append(message)
+        self._arrived.set()
+
+    def _close(self):
+        self.complete = True
+        self._arrived.set()
+
+    async def __aiter__(self) -> AsyncIterator[Message]:
+        index = 0
+        while True:
+            while index < len(self.messages):
+                yield self.messages[index]
+                index += 1
+            if self.complete:
+                return
+            self._arrived.clear()
+            await self._arrived.wait()
+
+    async def collect(self) -> List[Message]:
+        """
+        Ожидание конца альбома
+
+        Returns:
+            Все сообщения альбома
+        """
+        async for _ in self:
+            pass
+        return self.messages
+
+
+class GapEstimate:
+    """
+    Сглаженный интервал между сообщениями альбомов одного чата
+    и его отклонение (как RTT в RFC 6298)
+    """
+    __slots__ = ("gap", "deviation")
+
+    def __init__(self, gap: float):
+        self.gap = gap
+        self.deviation = gap / 2
+
+    def observe(self, gap: float):
+        self.deviation = 0.75 * self.deviation + 0.25 * abs(self.gap - gap)
+        self.gap = 0.875 * self.gap + 0.125 * gap
+
+    @property
+    def timeout(self) -> float:
+        """
+        Сколько ждать следующего сообщения: среднее + 4 отклонения
+        """
+        return self.gap + 4 * self.deviation
+
+
+class Album:
+    """
+    Альбом, который еще собирается
+    """
+    __slots__ = (
+        "chat_id", "version", "handler", "data", "deadline", "last_arrival", "timer", "stream"
+    )
+
+    def __init__(
+        self,
+        chat_id: int,
+        handler: Callable,
+        data: Dict[str, Any],
+        now: float,
+        deadline: float
+    ):
+        self.chat_id = chat_id
+        # Версия последней части, полученной этим процессом (см. AlbumStore)
+        self.version = 0
+        self.handler = handler
+        self.data = data
+        self.deadline = deadline
+        self.last_arrival = now
+        self.timer: Optional[asyncio.TimerHandle] = None
+        # Альбом в потоковом режиме (см. AlbumStream)
+        self.stream: Optional[AlbumStream] = None
+
+
 class AlbumMiddleware(BaseMiddleware):
     """
     Middleware для группировки сообщений Media Group
@@ -24,17 +136,144 @@ class AlbumMiddleware(BaseMiddleware):
     - Группирует сообщения с одинаковым media_group_id
     - Передает в обработчик список всех сообщений альбома
     - Для одиночных сообщений работает как обычно
+
+    Альбом считается полученным, если после его последнего сообщения
+    новых не было в течение времени ожидания. На каждый альбом заводится
+    один таймер loop.call_later(), который переносится при получении
+    следующего сообщения, а задача для обработчика создается один раз,
+    когда альбом собран.
+
+    Время ожидания подстраивается под интервалы между сообщениями
+    альбомов отдельно для каждого чата (у пользователей разные сети) так
+    же, как таймаут повторной передачи в TCP (RFC 6298): среднее +
+    4 отклонения, но не меньше min_latency и не больше latency. Чат без
+    истории ждет initial_latency, а чат, в котором части альбомов
+    приходят подряд, - всего min_latency. Если
+    сообщение приходит уже после обработки своего альбома, его интервал
+    тоже учитывается: иначе оценка видела бы только интервалы, которые
+    уложились в ожидание, и со временем только уменьшалась бы. Альбом
+    из 10 файлов обрабатывается сразу.
+
+    Память под недособранные альбомы ограничена: одновременно собирается
+    не больше max_albums альбомов (при переполнении самый давний
+    отбрасывается), и любой альбом обрабатывается не позже чем через
+    max_age секунд после первого сообщения, даже если сообщения
+    продолжают приходить.
+
+    Части альбомов хранятся в store. По умолчанию это память процесса;
+    если бот запущен несколькими worker'ами, передайте общий
+    RedisAlbumStore - тогда части собираются со всех worker'ов, а
+    обработчик запускает только тот, к кому пришла последняя часть.
+
+    Обработчику с флагом album="stream" сообщения альбома передаются
+    потоком (AlbumStream) сразу по мере получения, а не списком после
+    сбора. Потоковый режим работает в памяти процесса и не использует
+    store: в каждом worker'е поток содержит только его сообщения.
+
+        @router.message(F.media_group_id, F.photo, flags={"album": "stream"})
+        async def handle_album(message: Message, album_stream: AlbumStream): ...
     """
 
-    def __init__(self, latency: float = 0.3):
+    def __init__(
+        self,
+        latency: float = 1.0,
+        min_latency: float = 0.05,
+        initial_latency: float = 0.3,
+        max_albums: int = 1000,
+        max_age: float = 5.0,
+        store: Optional[AlbumStore] = None,
+        max_chats: int = 10_000
+    ):
         """
         Args:
-            latency: Время ожидания (сек) для сбора всех сообщений альбома
+            latency: Максимальное время ожидания (сек) следующего сообщения альбома
+            min_latency: Минимальное время ожидания (сек)
+            initial_latency: Время ожидания (сек) в чате, интервалы
+                которого еще неизвестны
+            max_albums: Сколько альбомов может собираться одновременно
+            max_age: Максимальное время сбора одного альбома (сек)
+            store: Хранилище частей альбомов (по умолчанию в памяти
+                процесса с ограничениями max_albums и max_age)
+            max_chats: Для скольких чатов помнить интервалы между сообщениями
         """
         self.latency = latency
-        self.album_data: Dict[str, List[Message]] = {}
-        # Словарь для отслеживания задач ожидания
-        self.tasks: Dict[str, asyncio.Task] = {}
+        self.min_latency = min_latency
+        self.initial_latency = initial_latency
+        self.max_albums = max_albums
+        self.max_age = max_age
+        self.max_chats = max_chats
+        if store is None:
+            # Части хранятся с запасом: альбом выдается не позже max_age
+            # после первой части
+            store = MemoryAlbumStore(ttl=2 * max_age, max_albums=max_albums)
+        self.store = store
+        # Альбомы в порядке первого сообщения: самый давний - первый
+        self.albums: Dict[str, Album] = {}
+        # Счетчики (для stats())
+        self.processed = 0
+        self.evicted = 0
+        self.expired = 0
+        self.failed = 0
+        # Альбомы, которые обработал другой worker
+        self.handed_off = 0
+        # Альбомы, части которых удалило хранилище (ttl, max_albums)
+        self.lost = 0
+        # Сообщения, пришедшие после обработки своего альбома
+        self.late = 0
+        # Оценки интервала по чатам; давно не присылавший альбомы чат - первый
+        self._gaps: Dict[int, GapEstimate] = {}
+        # Недавно обработанные альбомы: media_group_id -> время последнего
+        # сообщения (чтобы узнать опоздавшие сообщения)
+        self._flushed: Dict[str, float] = {}
+        # Задачи обработчиков (ссылки, чтобы задачи не удалил сборщик мусора)
+        self._tasks: Set[asyncio.Task] = set()
+
+    def wait_time(self, chat_id: int) -> float:
+        """
+        Текущее время ожидания следующего сообщения альбома в чате (сек)
+        """
+        estimate = self._gaps.get(chat_id)
+        if estimate is None:
+            return self.initial_latency
+        return min(self.latency, max(self.min_latency, estimate.timeout))
+
+    def _observe_gap(self, chat_id: int, gap: float):
+        """
+        Учет интервала между двумя сообщениями одного альбома
+        """
+        estimate = self._gaps.pop(chat_id, None)
+        if estimate is None:
+            estimate = GapEstimate(gap)
+        else:
+            estimate.observe(gap)
+        self._gaps[chat_id] = estimate
+        if len(self._gaps) > self.max_chats:
+            del self._gaps[next(iter(self._gaps))]
+
+    def _new_album(
+        self,
+        media_group_id: str,
+        chat_id: int,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        data: Dict[str, Any],
+        now: float
+    ) -> Album:
+        """
+        Начало сбора альбома по его первому (для этого процесса) сообщению
+        """
+        last_arrival = self._flushed.pop(media_group_id, None)
+        if last_arrival is not None:
+            # Альбом уже обработан без этого сообщения: ожидание было
+            # короче интервала, учитываем его
+            self.late += 1
+            self._observe_gap(chat_id, now - last_arrival)
+            logger.debug(f"Сообщение альбома {media_group_id} пришло после его обработки")
+
+        self._evict()
+        album = self.albums[media_group_id] = Album(
+            chat_id, handler, data, now, now + self.max_age
+        )
+        return album
 
     async def __call__(
         self,
@@ -56,69 +295,245 @@ class AlbumMiddleware(BaseMiddleware):
 
         media_group_id = event.media_group_id
 
-        # Если это первое сообщение альбома
-        if media_group_id not in self.album_data:
-            self.album_data[media_group_id] = []
+        if get_flag(data, "album") == "stream":
+            return self._stream_part(handler, event, data)
 
         # Добавляем сообщение в группу
-        self.album_data[media_group_id].append(event)
+        version = await self.store.add_part(media_group_id, event)
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+
+        album = self.albums.get(media_group_id)
+        if album is None:
+            # Первое сообщение альбома
+            album = self._new_album(media_group_id, event.chat.id, handler, data, now)
+        else:
+            self._observe_gap(album.chat_id, now - album.last_arrival)
+            album.last_arrival = now
+            # Обработчик вызывается с данными последнего сообщения
+            album.handler = handler
+            album.data = data
+            album.timer.cancel()
+        album.version = max(album.version, version)
 
         logger.debug(
-            f"Получено сообщение {len(self.album_data[media_group_id])} "
+            f"Получено сообщение {version} "
             f"для альбома {media_group_id}"
         )
 
-        # Отменяем предыдущую задачу ожидания (если была)
-        if media_group_id in self.tasks:
-            self.tasks[media_group_id].cancel()
-
-        # Создаем новую задачу ожидания
-        self.tasks[media_group_id] = asyncio.create_task(
-            self._process_album(media_group_id, handler, data)
-        )
+        self._schedule(media_group_id, album, version, now)
 
         # Возвращаем None, чтобы предотвратить дальнейшую обработку этого сообщения
         return None
 
-    async def _process_album(
+    def _stream_part(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any]
+    ) -> None:
+        """
+        Сообщение альбома в потоковом режиме: первое сообщение запускает
+        обработчик, остальные передаются ему через AlbumStream
+        """
+        media_group_id = event.media_group_id
+        now = asyncio.get_running_loop().time()
+
+        album = self.albums.get(media_group_id)
+        if album is None:
+            album = self._new_album(media_group_id, event.chat.id, handler, data, now)
+            album.stream = AlbumStream(media_group_id)
+            data["album_stream"] = album.stream
+            self._start(self._process_stream(media_group_id, handler, event, data))
+        else:
+            self._observe_gap(album.chat_id, now - album.last_arrival)
+            album.last_arrival = now
+            album.timer.cancel()
+
+        album.stream._append(event)
+        album.version = len(album.stream.messages)
+        self._schedule(media_group_id, album, album.version, now)
+
+    def _schedule(self, media_group_id: str, album: Album, version: int, now: float):
+        """
+        Таймер конца альбома после получения его сообщения
+
+        Args:
+            media_group_id: ID медиа-группы
+            album: Собираемый альбом
+            version: Сколько сообщений альбома получено
+            now: Время получения сообщения (loop.time())
+        """
+        loop = asyncio.get_running_loop()
+        wait_time = self.wait_time(album.chat_id)
+        if version >= MAX_ALBUM_SIZE:
+            # Больше сообщений в этом альбоме не будет
+            self._flush(media_group_id)
+        elif now + wait_time >= album.deadline:
+            # Ждать дольше max_age нельзя: обработаем то, что успело прийти
+            album.timer = loop.call_at(album.deadline, self._expire, media_group_id)
+        else:
+            album.timer = loop.call_later(wait_time, self._flush, media_group_id)
+
+    def _evict(self):
+        """
+        Освобождение места под новый альбом: самые давние альбомы
+        сверх max_albums отбрасываются без обработки
+        """
+        while len(self.albums) >= self.max_albums:
+            media_group_id = next(iter(self.albums))
+            album = self.albums.pop(media_group_id)
+            album.timer.cancel()
+            if album.stream is not None:
+                # Обработчик уже работает: он получит только то, что пришло
+                album.stream._close()
+            else:
+                self._start(self._discard(media_group_id))
+            self.evicted += 1
+            logger.warning(
+                f"Альбом {media_group_id} отброшен: "
+                f"одновременно собирается больше {self.max_albums} альбомов"
+            )
+
+    def _expire(self, media_group_id: str):
+        """
+        Истек max_age: альбом обрабатывается без ожидания остальных сообщений
+        """
+        self.expired += 1
+        self._flush(media_group_id)
+
+    def _flush(self, media_group_id: str):
+        """
+        Альбом собран: запуск обработчика
+
+        Args:
+            media_group_id: ID медиа-группы
+        """
+        album = self.albums.pop(media_group_id, None)
+        if album is None:
+            return
+        if album.timer is not None:
+            album.timer.cancel()
+        self._remember_flushed(media_group_id, album.last_arrival)
+
+        if album.stream is not None:
+            # Обработчик уже работает: сообщаем ему, что альбом собран
+            album.stream._close()
+        else:
+            self._start(self._process_album(media_group_id, album))
+
+    def _remember_flushed(self, media_group_id: str, last_arrival: float):
+        """
+        Запоминание обработанного альбома на max_age секунд (не больше
+        max_albums альбомов), чтобы узнать его опоздавшие сообщения
+        """
+        self._flushed[media_group_id] = last_arrival
+        oldest = last_arrival - self.max_age
+        while self._flushed:
+            first = next(iter(self._flushed))
+            if len(self._flushed) <= self.max_albums and self._flushed[first] >= oldest:
+                break
+            del self._flushed[first]
+
+    def _start(self, coro: Coroutine[Any, Any, None]):
+        """
+        Запуск обработчика альбома отдельной задачей
+        """
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _discard(self, media_group_id: str):
+        """
+        Удаление частей отброшенного альбома из store
+        """
+        try:
+            await self.store.discard(media_group_id)
+        except Exception:
+            logger.exception(f"Не удалось удалить части альбома {media_group_id}")
+
+    async def _process_stream(
         self,
         media_group_id: str,
-        handler: Callable,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
         data: Dict[str, Any]
     ):
         """
-        Обработка альбома после сбора всех сообщений
+        Обработка альбома в потоковом режиме: обработчик вызывается
+        с первым сообщением и читает остальные из data["album_stream"]
 
         Args:
             media_group_id: ID медиа-группы
             handler: Обработчик
-            data: Дополнительные данные
+            event: Первое сообщение альбома
+            data: Данные первого сообщения
         """
+        logger.info(f"Потоковая обработка альбома {media_group_id}")
         try:
-            # Ждем, пока все сообщения альбома будут получены
-            await asyncio.sleep(self.latency)
+            await handler(event, data)
+            self.processed += 1
+        except Exception:
+            self.failed += 1
+            logger.exception(f"Ошибка обработки альбома {media_group_id}")
 
-            # Получаем все сообщения альбома
-            messages = self.album_data.pop(media_group_id, [])
+    async def _process_album(self, media_group_id: str, album: Album):
+        """
+        Обработка альбома после сбора всех сообщений
 
-            if not messages:
+        Args:
+            media_group_id: ID медиа-группы
+            album: Собранный альбом
+        """
+        try:
+            messages = await self.store.claim(media_group_id, album.version)
+            if messages is None:
+                # Последняя часть пришла другому worker'у - он и обработает альбом
+                self.handed_off += 1
                 return
 
+            # Сообщения из общего хранилища не привязаны к боту
+            bot = album.data.get("bot")
+            if bot is not None:
+                messages = [message.as_(bot) for message in messages]
+
             logger.info(
                 f"Обработка альбома {media_group_id} "
                 f"из {len(messages)} сообщений"
             )
 
             # Добавляем список сообщений в data
-            data['album'] = messages
+            album.data['album'] = messages
 
             # Вызываем обработчик только один раз
             # Передаем последнее сообщение как основное
-            await handler(messages[-1], data)
+            await album.handler(messages[-1], album.data)
+            self.processed += 1
+        except AlbumLost:
+            # Хранилище удалило части раньше, чем альбом был собран
+            self.lost += 1
+            logger.warning(f"Альбом {media_group_id} потерян: части удалены хранилищем")
+        except Exception:
+            self.failed += 1
+            logger.exception(f"Ошибка обработки альбома {media_group_id}")
 
-        except asyncio.CancelledError:
-            # Задача была отменена, игнорируем
-            pass
-        finally:
-            # Удаляем задачу из словаря
-            self.tasks.pop(media_group_id, None)
+    def stats(self) -> Dict[str, int]:
+        """
+        Количество собираемых альбомов и счетчики
+
+        Returns:
+            Словарь с ключами collecting, handling, processed, evicted,
+            expired, failed, handed_off, lost, late
+        """
+        return {
+            "collecting": len(self.albums),
+            "handling": len(self._tasks),
+            "processed": self.processed,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "failed": self.failed,
+            "handed_off": self.handed_off,
+            "lost": self.lost,
+            "late": self.late,
+        }
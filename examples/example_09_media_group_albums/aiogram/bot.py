@@ -8,13 +8,15 @@ import logging
 import os
 from io import BytesIO
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Set
 
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.filters import Command
-from aiogram.types import Message, FSInputFile, BufferedInputFile, InputMediaPhoto, PhotoSize
+from aiogram.types import Message, BufferedInputFile, InputMediaPhoto, PhotoSize
 from aiogram.utils.media_group import MediaGroupBuilder
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+
+from renderer import FONT_BOLD, Renderer, load_font, preload_fonts, workers_from_env
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -29,12 +31,120 @@ if not BOT_TOKEN:
 IMAGES_DIR = Path("generated_albums")
 IMAGES_DIR.mkdir(exist_ok=True)
 
+# Шрифты функций отрисовки (загружаются заранее)
+FONTS = [(FONT_BOLD, 60)]
+
+# Пул процессов отрисовки (см. renderer.py)
+renderer = Renderer(
+    workers=workers_from_env(),
+    initializer=preload_fonts,
+    initargs=(FONTS,)
+)
+
 # Роутер для обработчиков
 router = Router()
 
+# Ограничения буфера, чтобы поток альбомов не занял всю память
+MAX_ALBUMS = 1000       # Сколько альбомов собирается одновременно
+MAX_ALBUM_SIZE = 10     # Больше 10 фото Telegram в альбом не собирает
+ALBUM_LATENCY = 0.3     # Сколько ждать следующего фото альбома (сек)
+ALBUM_MAX_AGE = 5.0     # Альбом обрабатывается не позже чем через столько секунд
+
+
+class PendingAlbum:
+    """
+    Альбом, который еще собирается
+    """
+    __slots__ = ("photos", "message", "deadline", "timer")
+
+    def __init__(self, deadline: float):
+        self.photos: List[PhotoSize] = []
+        # Последнее сообщение альбома - на него бот ответит
+        self.message: Optional[Message] = None
+        self.deadline = deadline
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
 # Словарь для хранения альбомов от пользователей
-# Структура: {media_group_id: [PhotoSize, PhotoSize, ...]}
-user_albums: Dict[str, List[PhotoSize]] = {}
+# Структура: {media_group_id: PendingAlbum}
+# Альбомы лежат в порядке первого фото: самый давний - первый
+user_albums: Dict[str, PendingAlbum] = {}
+
+# Задачи ответов на собранные альбомы (ссылки, чтобы их не удалил сборщик мусора)
+album_tasks: Set[asyncio.Task] = set()
+
+# Счетчики: обработанные альбомы, удаленные недособранными, лишние фото
+album_stats = {"processed": 0, "evicted": 0, "dropped_photos": 0}
+
+
+def add_album_photo(message: Message) -> Optional[PendingAlbum]:
+    """
+    Добавление фото в буфер альбомов
+
+    Если альбомов больше MAX_ALBUMS, самые давние (они всегда в начале
+    словаря) удаляются без ответа.
+
+    Returns:
+        Альбом или None, если фото отброшено (в альбоме уже MAX_ALBUM_SIZE фото)
+    """
+    media_group_id = message.media_group_id
+    album = user_albums.get(media_group_id)
+    if album is None:
+        while len(user_albums) >= MAX_ALBUMS:
+            oldest = user_albums.pop(next(iter(user_albums)))
+            oldest.timer.cancel()
+            album_stats["evicted"] += 1
+        loop = asyncio.get_running_loop()
+        album = user_albums[media_group_id] = PendingAlbum(loop.time() + ALBUM_MAX_AGE)
+
+    if len(album.photos) >= MAX_ALBUM_SIZE:
+        album_stats["dropped_photos"] += 1
+        return None
+
+    # Сохраняем самое большое фото (последнее в списке)
+    album.photos.append(message.photo[-1])
+    album.message = message
+    return album
+
+
+def flush_album(media_group_id: str):
+    """
+    Альбом собран: одна задача для ответа на весь альбом
+    """
+    album = user_albums.pop(media_group_id, None)
+    if album is None:
+        return
+    if album.timer is not None:
+        album.timer.cancel()
+
+    task = asyncio.create_task(reply_album(media_group_id, album))
+    album_tasks.add(task)
+    task.add_done_callback(album_tasks.discard)
+
+
+async def reply_album(media_group_id: str, album: PendingAlbum):
+    """
+    Ответ на собранный альбом
+    """
+    photos = album.photos
+    try:
+        await album.message.answer(
+            f"📸 <b>Получен альбом!</b>\n\n"
+            f"Количество фотографий: {len(photos)}\n"
+            f"Media Group ID: <code>{media_group_id}</code>\n\n"
+            f"Размеры фотографий:\n" +
+            "\n".join([f"  • {p.width}x{p.height} px" for p in photos]),
+            parse_mode="HTML"
+        )
+    except Exception:
+        logger.exception(f"Не удалось ответить на альбом {media_group_id}")
+        return
+
+    album_stats["processed"] += 1
+    logger.info(
+        f"Обработан альбом {media_group_id} "
+        f"из {len(photos)} фотографий"
+    )
 
 
 def generate_colored_image(color: tuple, text: str, size=(800, 600)) -> BytesIO:
@@ -53,11 +163,7 @@ def generate_colored_image(color: tuple, text: str, size=(800, 600)) -> BytesIO:
     image = Image.new('RGB', size, color=color)
     draw = ImageDraw.Draw(image)
 
-    # Пытаемся загрузить шрифт
-    try:
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 60)
-    except:
-        font = ImageFont.load_default()
+    font = load_font(FONT_BOLD, 60)
 
     # Рисуем текст в центре
     bbox = draw.textbbox((0, 0), text, font=font)
@@ -104,8 +210,13 @@ async def cmd_generate(message: Message):
         ((0, 0, 255), "Синий")
     ]
 
-    for color, name in colors:
-        image_bio = generate_colored_image(color, name)
+    # Рисуем изображения параллельно в пуле процессов
+    images = await asyncio.gather(*(
+        renderer.render(generate_colored_image, color, name)
+        for color, name in colors
+    ))
+
+    for (color, name), image_bio in zip(colors, images):
         # Добавляем фото в альбом
         builder.add_photo(
             media=BufferedInputFile(image_bio.read(), filename=f"{name}.png")
@@ -122,8 +233,10 @@ async def cmd_compare(message: Message):
     await message.answer("🔄 Создаю сравнение 'До и После'...")
 
     # Создаем два изображения: "до" и "после"
-    before_bio = generate_colored_image((100, 100, 100), "ДО обработки")
-    after_bio = generate_colored_image((255, 215, 0), "ПОСЛЕ обработки")
+    before_bio, after_bio = await asyncio.gather(
+        renderer.render(generate_colored_image, (100, 100, 100), "ДО обработки"),
+        renderer.render(generate_colored_image, (255, 215, 0), "ПОСЛЕ обработки")
+    )
 
     # Создаем список InputMediaPhoto
     media = [
@@ -158,8 +271,13 @@ async def cmd_variants(message: Message):
         ((255, 255, 100), "Вариант 4"),
     ]
 
-    for color, name in variants:
-        image_bio = generate_colored_image(color, name, size=(512, 512))
+    # Рисуем изображения параллельно в пуле процессов
+    images = await asyncio.gather(*(
+        renderer.render(generate_colored_image, color, name, size=(512, 512))
+        for color, name in variants
+    ))
+
+    for (color, name), image_bio in zip(variants, images):
         builder.add_photo(
             media=BufferedInputFile(image_bio.read(), f"{name}.png")
         )
@@ -173,51 +291,35 @@ async def handle_album_photo(message: Message):
     """
     Обработчик альбомов от пользователя
     Группирует фото по media_group_id
-    """
-    media_group_id = message.media_group_id
-
-    # Добавляем фото в словарь альбомов
-    if media_group_id not in user_albums:
-        user_albums[media_group_id] = []
 
-    # Сохраняем самое большое фото (последнее в списке)
-    user_albums[media_group_id].append(message.photo[-1])
+    Обработчик не ждет остальные фото: он кладет фото в буфер и
+    переносит единственный таймер альбома. Когда за ALBUM_LATENCY
+    новых фото не пришло (или пришло 10 фото), flush_album()
+    отвечает на весь альбом один раз.
+    """
+    album = add_album_photo(message)
+    if album is None:
+        return
 
     logger.info(
-        f"Получено фото {len(user_albums[media_group_id])} "
-        f"для альбома {media_group_id}"
+        f"Получено фото {len(album.photos)} "
+        f"для альбома {message.media_group_id}"
     )
 
-    # Ждем 0.5 секунды, чтобы собрать все фото альбома
-    await asyncio.sleep(0.5)
-
-    # Проверяем, что это последнее фото в альбоме
-    # (если за 0.5 сек не пришло новых, считаем альбом завершенным)
-    current_count = len(user_albums[media_group_id])
-
-    # Ждем еще немного для уверенности
-    await asyncio.sleep(0.3)
-
-    # Если количество не изменилось, альбом завершен
-    if current_count == len(user_albums[media_group_id]):
-        photos = user_albums[media_group_id]
-
-        await message.answer(
-            f"📸 <b>Получен альбом!</b>\n\n"
-            f"Количество фотографий: {len(photos)}\n"
-            f"Media Group ID: <code>{media_group_id}</code>\n\n"
-            f"Размеры фотографий:\n" +
-            "\n".join([f"  • {p.width}x{p.height} px" for p in photos]),
-            parse_mode="HTML"
-        )
+    if album.timer is not None:
+        album.timer.cancel()
 
-        logger.info(
-            f"Обработан альбом {media_group_id} "
-            f"из {len(photos)} фотографий"
-        )
+    if len(album.photos) >= MAX_ALBUM_SIZE:
+        # Больше фото в этом альбоме не будет
+        flush_album(message.media_group_id)
+        return
 
-        # Удаляем обработанный альбом
-        del user_albums[media_group_id]
+    # Ждем следующее фото, но не дольше ALBUM_MAX_AGE от первого
+    loop = asyncio.get_running_loop()
+    album.timer = loop.call_at(
+        min(loop.time() + ALBUM_LATENCY, album.deadline),
+        flush_album, message.media_group_id
+    )
 
 
 @router.message(F.photo)
@@ -233,6 +335,10 @@ async def handle_single_photo(message: Message):
 
 async def main():
     """Главная функция запуска бота"""
+    # Пул отрисовки запускается до polling (см. Renderer.start)
+    renderer.start()
+    preload_fonts(FONTS)
+
     # Создаем бота и диспетчер
     bot = Bot(token=BOT_TOKEN)
     dp = Dispatcher()
@@ -247,6 +353,8 @@ async def main():
         await dp.start_polling(bot)
     finally:
         await bot.session.close()
+        renderer.close()
+        logger.info(f"Статистика альбомов: {album_stats}")
 
 
 if __name__ == "__main__":
@@ -3,8 +3,10 @@ Telegram Bot Example 9: Media Group Albums с Middleware (aiogram)
 Демонстрирует правильную обработку альбомов с использованием middleware
 """
 
+import asyncio
 import logging
 import os
+import time
 from io import BytesIO
 from pathlib import Path
 from typing import List
@@ -13,9 +15,11 @@ from aiogram import Bot, Dispatcher, Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, BufferedInputFile
 from aiogram.utils.media_group import MediaGroupBuilder
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 
-from album_middleware import AlbumMiddleware
+from album_middleware import AlbumMiddleware, AlbumStream
+from album_store import AlbumStore, MemoryAlbumStore
+from renderer import FONT_BOLD, Renderer, load_font, preload_fonts, workers_from_env
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -30,8 +34,29 @@ if not BOT_TOKEN:
 IMAGES_DIR = Path("generated_albums")
 IMAGES_DIR.mkdir(exist_ok=True)
 
+# Шрифты функций отрисовки (загружаются заранее)
+FONTS = [(FONT_BOLD, 60)]
+
+# Пул процессов отрисовки (см. renderer.py)
+renderer = Renderer(
+    workers=workers_from_env(),
+    initializer=preload_fonts,
+    initargs=(FONTS,)
+)
+
+# Режим альбомов: "list" - список после сбора, "stream" - по мере получения
+ALBUM_MODE = os.getenv("ALBUM_MODE", "list")
+
+# Ограничения сбора альбомов: общие для middleware и хранилища частей
+MAX_ALBUMS = 1000       # Сколько альбомов собирается одновременно
+ALBUM_MAX_AGE = 5.0     # Альбом обрабатывается не позже чем через столько секунд
+# Части хранятся с запасом: альбом выдается не позже ALBUM_MAX_AGE
+ALBUM_STORE_TTL = 2 * ALBUM_MAX_AGE
+
 # Роутер для обработчиков
 router = Router()
+# Роутер потоковой обработки альбомов (подключается при ALBUM_MODE=stream)
+stream_router = Router()
 
 
 def generate_colored_image(color: tuple, text: str, size=(800, 600)) -> BytesIO:
@@ -50,11 +75,7 @@ def generate_colored_image(color: tuple, text: str, size=(800, 600)) -> BytesIO:
     image = Image.new('RGB', size, color=color)
     draw = ImageDraw.Draw(image)
 
-    # Пытаемся загрузить шрифт
-    try:
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 60)
-    except:
-        font = ImageFont.load_default()
+    font = load_font(FONT_BOLD, 60)
 
     # Рисуем текст в центре
     bbox = draw.textbbox((0, 0), text, font=font)
@@ -103,8 +124,13 @@ async def cmd_generate(message: Message):
         ((100, 100, 255), "Синий"),
     ]
 
-    for color, name in colors:
-        image_bio = generate_colored_image(color, name)
+    # Рисуем изображения параллельно в пуле процессов
+    images = await asyncio.gather(*(
+        renderer.render(generate_colored_image, color, name)
+        for color, name in colors
+    ))
+
+    for (color, name), image_bio in zip(colors, images):
         builder.add_photo(
             media=BufferedInputFile(image_bio.read(), f"{name}.png")
         )
@@ -120,14 +146,14 @@ async def cmd_compare(message: Message):
 
     builder = MediaGroupBuilder(caption="📊 Сравнение: До и После")
 
-    # Изображение "До"
-    before_img = generate_colored_image((150, 150, 150), "ДО", size=(600, 400))
+    # Изображения "До" и "После" рисуются параллельно
+    before_img, after_img = await asyncio.gather(
+        renderer.render(generate_colored_image, (150, 150, 150), "ДО", size=(600, 400)),
+        renderer.render(generate_colored_image, (100, 200, 255), "ПОСЛЕ", size=(600, 400))
+    )
     builder.add_photo(
         media=BufferedInputFile(before_img.read(), "before.png")
     )
-
-    # Изображение "После"
-    after_img = generate_colored_image((100, 200, 255), "ПОСЛЕ", size=(600, 400))
     builder.add_photo(
         media=BufferedInputFile(after_img.read(), "after.png")
     )
@@ -153,8 +179,13 @@ async def cmd_variants(message: Message):
         ((255, 255, 100), "Вариант 4"),
     ]
 
-    for color, name in variants:
-        image_bio = generate_colored_image(color, name, size=(512, 512))
+    # Рисуем изображения параллельно в пуле процессов
+    images = await asyncio.gather(*(
+        renderer.render(generate_colored_image, color, name, size=(512, 512))
+        for color, name in variants
+    ))
+
+    for (color, name), image_bio in zip(variants, images):
         builder.add_photo(
             media=BufferedInputFile(image_bio.read(), f"{name}.png")
         )
@@ -200,6 +231,44 @@ async def handle_album(message: Message, album: List[Message] = None):
     )
 
 
+@stream_router.message(F.media_group_id, F.photo, flags={"album": "stream"})
+async def handle_album_stream(message: Message, bot: Bot, album_stream: AlbumStream):
+    """
+    Потоковый обработчик альбомов
+
+    Вызывается сразу после первого фото альбома и скачивает каждое фото,
+    как только оно пришло, не дожидаясь остальных.
+
+    Args:
+        message: Первое сообщение альбома
+        bot: Бот
+        album_stream: Сообщения альбома по мере получения (добавляется middleware)
+    """
+    started = time.perf_counter()
+    downloaded = 0
+    photos = 0
+
+    async for part in album_stream:
+        if part.photo:
+            file = await bot.download(part.photo[-1])
+            downloaded += len(file.getvalue())
+            photos += 1
+
+    elapsed = time.perf_counter() - started
+    await message.answer(
+        f"📸 <b>Получен альбом!</b>\n\n"
+        f"Количество фотографий: {photos}\n"
+        f"Скачано: {downloaded // 1024} КБ за {elapsed:.2f} сек\n\n"
+        f"✅ Фото скачивались по мере получения",
+        parse_mode="HTML"
+    )
+
+    logger.info(
+        f"Обработан альбом {message.media_group_id} "
+        f"из {photos} фотографий (потоком)"
+    )
+
+
 @router.message(F.photo)
 async def handle_single_photo(message: Message):
     """Обработчик одиночных фото (не в альбоме)"""
@@ -212,14 +281,47 @@ async def handle_single_photo(message: Message):
     )
 
 
+def create_album_store() -> AlbumStore:
+    """
+    Хранилище частей альбомов: Redis, если задан REDIS_URL (бот запущен
+    несколькими worker'ами), иначе память процесса
+    """
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        # redis нужен только для общего хранилища, поэтому импортируем здесь
+        from redis.asyncio import Redis
+        from album_store import RedisAlbumStore
+
+        return RedisAlbumStore(
+            Redis.from_url(redis_url, decode_responses=True),
+            encode=lambda message: message.model_dump_json(exclude_none=True),
+            decode=Message.model_validate_json,
+            ttl=int(ALBUM_STORE_TTL)
+        )
+    return MemoryAlbumStore(ttl=ALBUM_STORE_TTL, max_albums=MAX_ALBUMS)
+
+
 async def main():
     """Главная функция запуска бота"""
+    # Пул отрисовки запускается до polling (см. Renderer.start)
+    renderer.start()
+    preload_fonts(FONTS)
+
     # Создаем бота и диспетчер
     bot = Bot(token=BOT_TOKEN)
     dp = Dispatcher()
 
     # ⭐ РЕГИСТРИРУЕМ MIDDLEWARE ДЛЯ РОУТЕРА
-    router.message.middleware(AlbumMiddleware(latency=0.3))
+    album_store = create_album_store()
+    album_middleware = AlbumMiddleware(
+        max_albums=MAX_ALBUMS, max_age=ALBUM_MAX_AGE, store=album_store
+    )
+    router.message.middleware(album_middleware)
+
+    if ALBUM_MODE == "stream":
+        # Потоковый роутер проверяется первым
+        stream_router.message.middleware(album_middleware)
+        dp.include_router(stream_router)
 
     # Регистрируем роутер
     dp.include_router(router)
@@ -232,8 +334,10 @@ async def main():
         await dp.start_polling(bot)
     finally:
         await bot.session.close()
+        await album_store.close()
+        renderer.close()
+        logger.info(f"Статистика альбомов: {album_middleware.stats()}")
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
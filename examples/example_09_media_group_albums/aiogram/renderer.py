@@ -0,0 +1,208 @@
+"""
+Отрисовка изображений в пуле процессов
+
+Pillow рисует и кодирует PNG синхронно: пока функция отрисовки работает
+в обработчике, event loop стоит и бот не отвечает ни в одном чате.
+Renderer выполняет функции отрисовки в отдельных процессах (потоки не
+помогли бы - работа в основном держит GIL). Одновременно в пуле не
+больше max_pending задач, остальные вызовы render() ждут в event loop.
+
+    renderer = Renderer(workers=4, initializer=preload_fonts, initargs=(FONTS,))
+    renderer.start()  # до запуска polling
+    image = await renderer.render(generate_placeholder_image, 3000, 2000)
+    ...
+    renderer.close()
+
+Функция и ее аргументы передаются в процесс через pickle, поэтому
+функция должна быть объявлена на уровне модуля, а результат (Path,
+BytesIO, bytes) - сериализуемым.
+
+load_font() загружает каждый шрифт (файл + размер) один раз на процесс,
+а не читает TTF-файл на каждую отрисовку.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, TypeVar, Union
+
+from PIL import ImageFont
+
+T = TypeVar("T")
+
+FONT_BOLD = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+FONT_REGULAR = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+Font = Union[ImageFont.FreeTypeFont, ImageFont.ImageFont]
+
+
+@lru_cache(maxsize=None)
+def load_font(path: str, size: int) -> Font:
+    """
+    Шрифт из файла path размером size (загружается один раз на процесс)
+
+    Args:
+        path: Путь к TTF-файлу
+        size: Размер шрифта
+
+    Returns:
+        Шрифт или стандартный шрифт Pillow, если файла нет
+    """
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def preload_fonts(fonts: Iterable[Tuple[str, int]]):
+    """
+    Загрузка шрифтов в кеш заранее
+
+    Args:
+        fonts: Пары (путь, размер)
+    """
+    for path, size in fonts:
+        load_font(path, size)
+
+
+def workers_from_env(default: Optional[int] = None) -> Optional[int]:
+    """
+    Количество процессов отрисовки из переменной окружения RENDER_WORKERS
+
+    Returns:
+        Значение RENDER_WORKERS или default (None - по числу ядер)
+    """
+    value = os.getenv("RENDER_WORKERS")
+    return int(value) if value else default
+
+
+class Renderer:
+    """
+    Пул процессов для отрисовки изображений
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        initializer: Optional[Callable[..., None]] = None,
+        initargs: Tuple[Any, ...] = ()
+    ):
+        """
+        Args:
+            workers: Количество процессов (по умолчанию по числу ядер)
+            max_pending: Сколько задач одновременно передается в пул
+                (по умолчанию 2 на процесс)
+            initializer: Функция, которая выполняется при запуске каждого
+                процесса пула (например, загрузка шрифтов)
+            initargs: Ее аргументы
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(self.max_pending)
+        # Счетчики (для stats())
+        self.rendered = 0
+        self.failed = 0
+        self.waiting = 0
+
+    def start(self):
+        """
+        Запуск процессов пула
+
+        Вызывается в main() до запуска polling: на Linux процессы пула
+        создаются через fork, а fork процесса, в котором уже работают
+        потоки (HTTP-клиент, executor event loop), может унаследовать
+        захваченную блокировку и зависнуть.
+        """
+        if self._executor is not None:
+            return
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=self.initializer,
+            initargs=self.initargs
+        )
+        # Процессы создаются при первой задаче - запускаем их сейчас
+        self._executor.submit(int).result()
+
+    async def render(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Выполнение функции отрисовки в пуле процессов
+
+        Args:
+            func: Функция уровня модуля
+            *args, **kwargs: Ее аргументы
+
+        Returns:
+            Результат функции
+        """
+        if self._executor is None:
+            raise RuntimeError("Renderer не запущен: вызовите start() до запуска бота")
+
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            self.failed += 1
+            raise
+        # Слот освобождается, когда задача завершилась в пуле, а не когда
+        # перестали ждать ее результат: отмена обработчика не останавливает
+        # уже начатую отрисовку, и она продолжает занимать процесс
+        future.add_done_callback(lambda _: self._release_slot(loop))
+
+        try:
+            result = await asyncio.wrap_future(future)
+        except Exception:
+            self.failed += 1
+            raise
+
+        self.rendered += 1
+        return result
+
+    def _release_slot(self, loop: asyncio.AbstractEventLoop):
+        """
+        Освобождение слота после завершения задачи в пуле
+
+        Вызывается в потоке executor'а, поэтому семафор освобождается
+        через event loop.
+
+        Args:
+            loop: Event loop, в котором была запущена задача
+        """
+        try:
+            loop.call_soon_threadsafe(self._slots.release)
+        except RuntimeError:
+            # Event loop уже закрыт - слоты больше никто не ждет
+            pass
+
+    def close(self):
+        """
+        Остановка процессов пула (дожидается начатых задач)
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики отрисовки
+
+        Returns:
+            Словарь с ключами workers, rendered, failed, waiting
+        """
+        return {
+            "workers": self.workers,
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "waiting": self.waiting,
+        }
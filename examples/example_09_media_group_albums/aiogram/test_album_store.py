@@ -0,0 +1,143 @@
+"""
+Тесты хранилищ частей альбомов и их использования в AlbumMiddleware
+
+RedisAlbumStore проверяется на fakeredis (pip install fakeredis lupa),
+если он установлен. Запуск из этой папки:
+
+    python -m pytest
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Dict, List
+
+import pytest
+from aiogram.types import Chat, Message
+
+from album_middleware import AlbumMiddleware
+from album_store import AlbumLost, MemoryAlbumStore, RedisAlbumStore
+
+
+def make_store(kind: str, **kwargs):
+    if kind == "memory":
+        return MemoryAlbumStore(**kwargs)
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return RedisAlbumStore(
+        fakeredis.FakeAsyncRedis(decode_responses=True),
+        encode=str,
+        decode=int,
+        **kwargs
+    )
+
+
+@pytest.fixture(params=["memory", "redis"])
+def kind(request) -> str:
+    return request.param
+
+
+def test_claim_returns_parts_once(kind):
+    async def main():
+        store = make_store(kind)
+        versions = [await store.add_part("g", part) for part in (1, 2, 3)]
+        return versions, await store.claim("g", 3), await store.claim("g", 3)
+
+    versions, parts, again = asyncio.run(main())
+    assert versions == [1, 2, 3]
+    assert parts == [1, 2, 3]
+    # Альбом уже выдан - это не потеря
+    assert again is None
+
+
+def test_claim_with_old_version_is_handed_off(kind):
+    async def main():
+        store = make_store(kind)
+        for part in (1, 2, 3):
+            await store.add_part("g", part)
+        return await store.claim("g", 2), await store.claim("g", 3)
+
+    assert asyncio.run(main()) == (None, [1, 2, 3])
+
+
+def test_discarded_album_is_lost(kind):
+    async def main():
+        store = make_store(kind)
+        await store.add_part("g", 1)
+        await store.discard("g")
+        await store.claim("g", 1)
+
+    with pytest.raises(AlbumLost):
+        asyncio.run(main())
+
+
+def test_memory_store_evicts_oldest_album():
+    async def main():
+        store = MemoryAlbumStore(max_albums=2)
+        for media_group_id in ("a", "b", "c"):
+            await store.add_part(media_group_id, media_group_id)
+        with pytest.raises(AlbumLost):
+            await store.claim("a", 1)
+        return store, await store.claim("c", 1)
+
+    store, parts = asyncio.run(main())
+    assert parts == ["c"]
+    assert store.evicted == 1
+
+
+def make_message(message_id: int, media_group_id: str) -> Message:
+    return Message(
+        message_id=message_id,
+        date=datetime.now(),
+        chat=Chat(id=1, type="private"),
+        media_group_id=media_group_id,
+        text="photo"
+    )
+
+
+def test_middleware_discards_evicted_album():
+    calls: Dict[str, List[int]] = {}
+
+    async def handler(message: Message, data):
+        calls[message.media_group_id] = [part.message_id for part in data["album"]]
+
+    async def main():
+        store = MemoryAlbumStore()
+        middleware = AlbumMiddleware(max_albums=1, store=store)
+        await middleware(handler, make_message(1, "a"), {})
+        # Второй альбом вытесняет первый - его части удаляются из store
+        await middleware(handler, make_message(2, "b"), {})
+        await asyncio.sleep(0)
+        size = len(store)
+        await asyncio.sleep(middleware.latency + 0.1)
+        return size, middleware.stats()
+
+    size, stats = asyncio.run(main())
+    assert size == 1
+    assert calls == {"b": [2]}
+    assert stats["evicted"] == 1 and stats["processed"] == 1
+
+
+def test_middleware_counts_lost_and_failed_claims():
+    class BrokenStore(MemoryAlbumStore):
+        async def claim(self, media_group_id, version):
+            if media_group_id == "broken":
+                raise ConnectionError("store is down")
+            return await super().claim(media_group_id, version)
+
+    async def handler(message: Message, data):
+        pass
+
+    async def main():
+        store = BrokenStore()
+        middleware = AlbumMiddleware(store=store)
+        await middleware(handler, make_message(1, "broken"), {})
+        await middleware(handler, make_message(2, "lost"), {})
+        # Части удалены хранилищем до сбора альбома
+        await store.discard("lost")
+        await asyncio.sleep(middleware.latency + 0.1)
+        return middleware.stats()
+
+    stats = asyncio.run(main())
+    assert stats["failed"] == 1
+    assert stats["lost"] == 1
+    assert stats["handed_off"] == 0
@@ -0,0 +1,197 @@
+"""
+Тесты сборки альбомов (aiogram)
+
+В нагрузочных тестах 2000 альбомов из 2-10 фото приходят одновременно,
+каждый update обрабатывается отдельной задачей, как при polling. Бот
+должен ответить на каждый альбом ровно один раз и со всеми фото, а
+количество задач в работе не должно расти с количеством фото.
+Отдельно проверяется, что время ожидания подстраивается под чат.
+Запуск из этой папки:
+
+    python -m pytest
+"""
+
+import asyncio
+import importlib
+import random
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.types import Chat, Message, PhotoSize, Update
+
+from album_middleware import MAX_ALBUM_SIZE, AlbumMiddleware
+
+ALBUMS = 2000
+
+
+def make_update(update_id: int, chat_id: int, media_group_id: str) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=Chat(id=chat_id, type="private"),
+            media_group_id=media_group_id,
+            photo=[PhotoSize(
+                file_id=f"file{update_id}", file_unique_id=f"unique{update_id}",
+                width=800, height=600
+            )]
+        )
+    )
+
+
+class TaskSampler:
+    """
+    Пиковое количество задач event loop, кроме задач самого теста
+
+    Каждый update обрабатывается отдельной задачей (как при polling),
+    поэтому обработчик, который ждет остальные фото альбома через sleep,
+    держит по задаче на каждое фото. Обработчику с таймером альбома
+    задача нужна только на время обработки update и ответа на альбом.
+    """
+    __slots__ = ("peak", "_own", "_task")
+
+    def __init__(self):
+        self.peak = 0
+        self._own = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._own = {asyncio.current_task()}
+        self._task = asyncio.create_task(self._sample())
+        self._own.add(self._task)
+
+    async def _sample(self):
+        while True:
+            self.peak = max(self.peak, len(asyncio.all_tasks() - self._own))
+            await asyncio.sleep(0.005)
+
+    def stop(self):
+        self._task.cancel()
+
+
+async def send_albums(dp: Dispatcher, albums: Dict[str, int], sampler: TaskSampler):
+    """
+    Отправка альбомов {media_group_id: количество фото}: фото одного
+    альбома приходят подряд (как в одном ответе getUpdates), новый
+    альбом - каждую миллисекунду
+    """
+    bot = Bot(token="42:TEST")
+    tasks: List[asyncio.Task] = []
+    sampler.start()
+    try:
+        for index, (media_group_id, parts) in enumerate(albums.items()):
+            for part in range(parts):
+                update = make_update(index * 100 + part, index, media_group_id)
+                tasks.append(asyncio.create_task(dp.feed_update(bot, update)))
+            await asyncio.sleep(0.001)
+        await asyncio.gather(*tasks)
+    finally:
+        await bot.session.close()
+
+
+def random_albums(seed: int) -> Dict[str, int]:
+    rng = random.Random(seed)
+    return {f"album{index}": rng.randint(2, 10) for index in range(ALBUMS)}
+
+
+def assert_tasks_bounded(sampler: TaskSampler):
+    """
+    Ожидание альбома - это таймер, а не задача на каждое фото: в работе
+    только updates последнего альбома и ответы на собранные альбомы
+    (в этих тестах пик - 30-60 задач). Обработчик, который ждал
+    остальные фото через asyncio.sleep(), держал больше 1000 задач.
+    """
+    assert sampler.peak <= 10 * MAX_ALBUM_SIZE
+
+
+def test_middleware_calls_handler_once_per_album():
+    albums = random_albums(1)
+    calls: Dict[str, List[int]] = {}
+    middleware = AlbumMiddleware()
+    router = Router()
+    router.message.middleware(middleware)
+
+    @router.message(F.media_group_id, F.photo)
+    async def handle_album(message: Message, album: List[Message]):
+        calls.setdefault(message.media_group_id, []).append(len(album))
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    sampler = TaskSampler()
+
+    async def main():
+        await send_albums(dp, albums, sampler)
+        while middleware.albums or middleware._tasks:
+            await asyncio.sleep(0.01)
+        sampler.stop()
+
+    asyncio.run(main())
+    assert calls == {media_group_id: [parts] for media_group_id, parts in albums.items()}
+    assert middleware.stats()["processed"] == ALBUMS
+    assert_tasks_bounded(sampler)
+
+
+def test_bot_replies_once_per_album(monkeypatch, tmp_path):
+    monkeypatch.setenv("BOT_TOKEN", "42:TEST")
+    # bot.py создает папку для картинок в текущей папке
+    monkeypatch.chdir(tmp_path)
+    bot = importlib.import_module("bot")
+
+    replies: Dict[str, List[str]] = {}
+
+    async def answer(message: Message, text: str, **kwargs):
+        replies.setdefault(message.media_group_id, []).append(text)
+
+    monkeypatch.setattr(Message, "answer", answer)
+
+    albums = random_albums(2)
+    dp = Dispatcher()
+    dp.include_router(bot.router)
+    sampler = TaskSampler()
+
+    async def main():
+        await send_albums(dp, albums, sampler)
+        while bot.user_albums or bot.album_tasks:
+            await asyncio.sleep(0.01)
+        sampler.stop()
+
+    asyncio.run(main())
+    assert replies.keys() == albums.keys()
+    for media_group_id, parts in albums.items():
+        (text,) = replies[media_group_id]
+        assert f"Количество фотографий: {parts}\n" in text
+    assert bot.album_stats == {"processed": ALBUMS, "evicted": 0, "dropped_photos": 0}
+    assert_tasks_bounded(sampler)
+
+
+def test_fast_chat_waits_less():
+    middleware = AlbumMiddleware()
+    delays: List[float] = []
+
+    async def handler(message: Message, data):
+        delays.append(asyncio.get_running_loop().time() - last_part)
+
+    async def main():
+        nonlocal last_part
+        for index in range(6):
+            media_group_id = f"album{index}"
+            # Части альбома приходят подряд, с интервалом 5 мс
+            for part in range(4):
+                await middleware(handler, make_update(index * 100 + part, 1, media_group_id).message, {})
+                last_part = asyncio.get_running_loop().time()
+                await asyncio.sleep(0.005)
+            while middleware.albums or middleware._tasks:
+                await asyncio.sleep(0.001)
+        return middleware.wait_time(1), middleware.wait_time(2)
+
+    last_part = 0.0
+    fast_chat, new_chat = asyncio.run(main())
+    assert len(delays) == 6
+    # Чат без истории ждет initial_latency (0.3 сек, как прежнее
+    # фиксированное ожидание), но интервалы уже первого альбома
+    # сокращают ожидание
+    assert max(delays) < 0.3
+    assert fast_chat < 0.1
+    assert new_chat == middleware.initial_latency
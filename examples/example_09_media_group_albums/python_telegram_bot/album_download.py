@@ -0,0 +1,101 @@
+"""
+Параллельное скачивание фото альбома (python-telegram-bot)
+
+AlbumCollector отдает обработчику все updates альбома сразу. Если
+скачивать фото по одному, время обработки альбома - сумма времени всех
+скачиваний. download_album() скачивает фото параллельно, а время
+обработки альбома становится близко ко времени самого долгого
+скачивания.
+
+Одновременные скачивания ограничивает семафор limit, один на весь бот:
+он общий для всех альбомов, которые обрабатываются одновременно, поэтому
+бот не упирается в лимиты Bot API и пул соединений HTTP-клиента, сколько
+бы альбомов ни пришло.
+
+    downloads = asyncio.Semaphore(4)  # создается один раз
+    ...
+    album_updates = get_album_messages(update, context)
+    photos = await download_album(album_updates, downloads)                  # в память
+    photos = await download_album(album_updates, downloads, Path("albums"))  # на диск
+"""
+
+import asyncio
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence, Union
+
+from telegram import PhotoSize, Update
+
+
+class DownloadedPhoto(NamedTuple):
+    """
+    Скачанное фото альбома
+
+    content - BytesIO при скачивании в память или путь к файлу при
+    скачивании на диск. seconds - сколько длилось скачивание этого фото.
+    """
+    photo: PhotoSize
+    content: Union[BytesIO, Path]
+    seconds: float
+
+
+def album_photos(updates: Sequence[Update]) -> List[PhotoSize]:
+    """
+    Самые большие версии фото альбома по порядку
+
+    Args:
+        updates: Updates альбома
+
+    Returns:
+        Последний (самый большой) PhotoSize каждого сообщения с фото
+    """
+    return [
+        upd.effective_message.photo[-1]
+        for upd in updates
+        if upd.effective_message and upd.effective_message.photo
+    ]
+
+
+async def _download(
+    photo: PhotoSize,
+    directory: Optional[Path],
+    semaphore: asyncio.Semaphore
+) -> DownloadedPhoto:
+    async with semaphore:
+        started = time.perf_counter()
+        file = await photo.get_file()
+        if directory is None:
+            content: Union[BytesIO, Path] = BytesIO()
+            await file.download_to_memory(content)
+            content.seek(0)
+        else:
+            content = await file.download_to_drive(directory / f"{photo.file_unique_id}.jpg")
+        return DownloadedPhoto(photo, content, time.perf_counter() - started)
+
+
+async def download_album(
+    updates: Sequence[Update],
+    limit: asyncio.Semaphore,
+    directory: Optional[Path] = None
+) -> List[DownloadedPhoto]:
+    """
+    Параллельное скачивание самых больших версий фото альбома
+
+    Args:
+        updates: Updates альбома (get_album_messages)
+        limit: Общий для всего бота семафор одновременных скачиваний
+        directory: Куда сохранить файлы; None - скачать в память
+
+    Returns:
+        Скачанные фото в порядке альбома
+
+    Raises:
+        telegram.error.TelegramError: Не удалось скачать одно из фото
+    """
+    if directory is not None:
+        directory.mkdir(parents=True, exist_ok=True)
+
+    return await asyncio.gather(*(
+        _download(photo, directory, limit) for photo in album_photos(updates)
+    ))
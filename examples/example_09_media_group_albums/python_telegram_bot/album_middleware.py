@@ -8,11 +8,33 @@ import logging
 from typing import Dict, List, Optional
 
 from telegram import Update
-from telegram.ext import BaseHandler, ContextTypes
+from telegram.ext import ContextTypes
+
+from album_store import AlbumLost, AlbumStore, MemoryAlbumStore
 
 logger = logging.getLogger(__name__)
 
 
+# Telegram не собирает в один альбом больше 10 файлов
+MAX_ALBUM_SIZE = 10
+
+# Атрибут CallbackContext, в котором обработчик получает альбом
+ALBUM_ATTRIBUTE = "album_updates"
+
+
+class PendingAlbum:
+    """
+    Альбом, который еще собирается
+    """
+    __slots__ = ("version", "deadline", "task")
+
+    def __init__(self, deadline: float):
+        # Версия последней части, полученной этим процессом (см. AlbumStore)
+        self.version = 0
+        self.deadline = deadline
+        self.task: Optional[asyncio.Task] = None
+
+
 class AlbumCollector:
     """
     Класс для сбора и группировки альбомов
@@ -20,16 +42,53 @@ class AlbumCollector:
     Использование в python-telegram-bot:
     1. Создать экземпляр: collector = AlbumCollector()
     2. Обернуть обработчик: collector.wrap_handler(your_handler)
+
+    Память под недособранные альбомы ограничена: одновременно собирается
+    не больше max_albums альбомов (при переполнении самый давний
+    отбрасывается), в альбоме не больше 10 сообщений, и любой альбом
+    обрабатывается не позже чем через max_age секунд после первого
+    сообщения.
+
+    Части альбомов хранятся в store. По умолчанию это память процесса;
+    если бот запущен несколькими worker'ами, передайте общий
+    RedisAlbumStore - тогда части собираются со всех worker'ов, а
+    обработчик запускает только тот, к кому пришла последняя часть.
     """
 
-    def __init__(self, latency: float = 0.3):
+    def __init__(
+        self,
+        latency: float = 0.3,
+        max_albums: int = 1000,
+        max_age: float = 5.0,
+        store: Optional[AlbumStore] = None
+    ):
         """
         Args:
             latency: Время ожидания (сек) для сбора всех сообщений альбома
+            max_albums: Сколько альбомов может собираться одновременно
+            max_age: Максимальное время сбора одного альбома (сек)
+            store: Хранилище частей альбомов (по умолчанию в памяти
+                процесса с ограничениями max_albums и max_age)
         """
         self.latency = latency
-        self.album_data: Dict[str, List[Update]] = {}
-        self.tasks: Dict[str, asyncio.Task] = {}
+        self.max_albums = max_albums
+        self.max_age = max_age
+        if store is None:
+            # Части хранятся с запасом: альбом выдается не позже max_age
+            # после первой части
+            store = MemoryAlbumStore(ttl=2 * max_age, max_albums=max_albums)
+        self.store = store
+        # Альбомы в порядке первого сообщения: самый давний - первый
+        self.albums: Dict[str, PendingAlbum] = {}
+        # Счетчики (для stats())
+        self.processed = 0
+        self.evicted = 0
+        self.dropped_messages = 0
+        self.failed = 0
+        # Альбомы, которые обработал другой worker
+        self.handed_off = 0
+        # Альбомы, части которых удалило хранилище (ttl, max_albums)
+        self.lost = 0
 
     def wrap_handler(self, handler):
         """
@@ -50,32 +109,80 @@ class AlbumCollector:
 
             media_group_id = message.media_group_id
 
-            # Если это первое сообщение альбома
-            if media_group_id not in self.album_data:
-                self.album_data[media_group_id] = []
+            album = self.albums.get(media_group_id)
+            if album is not None and album.version >= MAX_ALBUM_SIZE:
+                # Столько сообщений в настоящем альбоме не бывает
+                self.dropped_messages += 1
+                return
 
             # Добавляем update в группу
-            self.album_data[media_group_id].append(update)
+            version = await self.store.add_part(media_group_id, update)
+
+            loop = asyncio.get_running_loop()
+
+            # Если это первое сообщение альбома
+            evicted: List[str] = []
+            album = self.albums.get(media_group_id)
+            if album is None:
+                evicted = self._evict()
+                album = self.albums[media_group_id] = PendingAlbum(loop.time() + self.max_age)
+            album.version = max(album.version, version)
 
             logger.debug(
-                f"Получено сообщение {len(self.album_data[media_group_id])} "
+                f"Получено сообщение {version} "
                 f"для альбома {media_group_id}"
             )
 
             # Отменяем предыдущую задачу ожидания (если была)
-            if media_group_id in self.tasks:
-                self.tasks[media_group_id].cancel()
+            if album.task is not None:
+                album.task.cancel()
 
-            # Создаем новую задачу ожидания
-            self.tasks[media_group_id] = asyncio.create_task(
-                self._process_album(media_group_id, handler, context)
+            # Создаем новую задачу ожидания, но не дольше max_age
+            delay = min(self.latency, album.deadline - loop.time())
+            album.task = asyncio.create_task(
+                self._process_album(media_group_id, album, delay, handler, context)
             )
 
+            for evicted_id in evicted:
+                await self._discard(evicted_id)
+
         return wrapped
 
+    def _evict(self) -> List[str]:
+        """
+        Освобождение места под новый альбом: самые давние альбомы
+        сверх max_albums отбрасываются без обработки
+
+        Returns:
+            ID отброшенных альбомов (их части нужно удалить из store)
+        """
+        evicted = []
+        while len(self.albums) >= self.max_albums:
+            media_group_id = next(iter(self.albums))
+            album = self.albums.pop(media_group_id)
+            album.task.cancel()
+            evicted.append(media_group_id)
+            self.evicted += 1
+            logger.warning(
+                f"Альбом {media_group_id} отброшен: "
+                f"одновременно собирается больше {self.max_albums} альбомов"
+            )
+        return evicted
+
+    async def _discard(self, media_group_id: str):
+        """
+        Удаление частей отброшенного альбома из store
+        """
+        try:
+            await self.store.discard(media_group_id)
+        except Exception:
+            logger.exception(f"Не удалось удалить части альбома {media_group_id}")
+
     async def _process_album(
         self,
         media_group_id: str,
+        album: PendingAlbum,
+        delay: float,
         handler,
         context: ContextTypes.DEFAULT_TYPE
     ):
@@ -84,17 +191,28 @@ class AlbumCollector:
 
         Args:
             media_group_id: ID медиа-группы
+            album: Собираемый альбом
+            delay: Время ожидания следующего сообщения (сек)
             handler: Обработчик
             context: Контекст
         """
         try:
             # Ждем, пока все сообщения альбома будут получены
-            await asyncio.sleep(self.latency)
+            await asyncio.sleep(max(delay, 0))
+        except asyncio.CancelledError:
+            # Пришло следующее сообщение или альбом вытеснен
+            return
 
-            # Получаем все updates альбома
-            updates = self.album_data.pop(media_group_id, [])
+        # Альбом собран: убираем его из буфера до вызова обработчика,
+        # чтобы ошибка обработчика не оставила его в памяти
+        if self.albums.get(media_group_id) is album:
+            del self.albums[media_group_id]
 
-            if not updates:
+        try:
+            updates = await self.store.claim(media_group_id, album.version)
+            if updates is None:
+                # Последняя часть пришла другому worker'у - он и обработает альбом
+                self.handed_off += 1
                 return
 
             logger.info(
@@ -102,22 +220,41 @@ class AlbumCollector:
                 f"из {len(updates)} сообщений"
             )
 
-            # Добавляем список всех updates в контекст
-            context.user_data['album_updates'] = updates
+            # Добавляем список всех updates в контекст этого вызова.
+            # Не в context.user_data: он общий для всех updates пользователя,
+            # и два альбома, обрабатываемые одновременно, затирали бы друг друга.
+            # CallbackContext же создается заново для каждого update.
+            setattr(context, ALBUM_ATTRIBUTE, updates)
 
             # Вызываем обработчик только один раз
             # Передаем последний update как основной
             await handler(updates[-1], context)
+            self.processed += 1
+        except AlbumLost:
+            # Хранилище удалило части раньше, чем альбом был собран
+            self.lost += 1
+            logger.warning(f"Альбом {media_group_id} потерян: части удалены хранилищем")
+        except Exception:
+            self.failed += 1
+            logger.exception(f"Ошибка обработки альбома {media_group_id}")
 
-            # Очищаем данные
-            context.user_data.pop('album_updates', None)
+    def stats(self) -> Dict[str, int]:
+        """
+        Количество собираемых альбомов и счетчики
 
-        except asyncio.CancelledError:
-            # Задача была отменена, игнорируем
-            pass
-        finally:
-            # Удаляем задачу из словаря
-            self.tasks.pop(media_group_id, None)
+        Returns:
+            Словарь с ключами collecting, processed, evicted,
+            dropped_messages, failed, handed_off, lost
+        """
+        return {
+            "collecting": len(self.albums),
+            "processed": self.processed,
+            "evicted": self.evicted,
+            "dropped_messages": self.dropped_messages,
+            "failed": self.failed,
+            "handed_off": self.handed_off,
+            "lost": self.lost,
+        }
 
 
 def get_album_messages(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[List[Update]]:
@@ -131,4 +268,4 @@ def get_album_messages(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Op
     Returns:
         Список всех Update объектов альбома или None для одиночных сообщений
     """
-    return context.user_data.get('album_updates', None)
+    return getattr(context, ALBUM_ATTRIBUTE, None)
@@ -0,0 +1,223 @@
+"""
+Хранилища частей альбомов для AlbumMiddleware / AlbumCollector
+
+Если бот запущен несколькими worker'ами (webhook за балансировщиком),
+части одного альбома приходят в разные процессы. Тогда части нужно
+складывать в общее хранилище, а обработчик должен запустить ровно один
+worker - тот, к которому пришла последняя часть.
+
+Хранилище выдает каждой части номер версии (сколько частей альбома уже
+сохранено). Worker запоминает версию своей последней части и, когда его
+таймер истек, вызывает claim(): альбом отдается, только если с тех пор
+частей не прибавилось, и только одному worker'у. Если части удалило
+само хранилище (истек ttl, превышен max_albums), claim() выбрасывает
+AlbumLost, чтобы такие альбомы не путались с обработанными другим
+worker'ом.
+
+- MemoryAlbumStore - в памяти процесса (один worker, тесты)
+- RedisAlbumStore - в Redis, общий для всех worker'ов
+"""
+
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+# Проверка версии и выдача альбома одной атомарной операцией:
+# после DEL никто другой этот альбом уже не получит. Выданный альбом
+# помечается ключом KEYS[2], чтобы отличать его от удаленного по ttl.
+# Возвращает части альбома, 0 (альбом у другого worker'а) или
+# -1 (части удалены)
+CLAIM_SCRIPT = """
+local length = redis.call('LLEN', KEYS[1])
+local version = tonumber(ARGV[1])
+if length > version then
+    return 0
+end
+if length == 0 and redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+if length < version then
+    return -1
+end
+local parts = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1])
+redis.call('SET', KEYS[2], 1, 'EX', ARGV[2])
+return parts
+"""
+
+
+class AlbumLost(Exception):
+    """
+    Части альбома удалены хранилищем до выдачи (ttl, max_albums или discard)
+    """
+
+
+class AlbumStore(ABC):
+    """
+    Хранилище частей альбомов, сгруппированных по media_group_id
+    """
+
+    @abstractmethod
+    async def add_part(self, media_group_id: str, part: Any) -> int:
+        """
+        Сохранение части альбома
+
+        Returns:
+            Версия альбома: сколько частей сохранено вместе с этой
+        """
+
+    @abstractmethod
+    async def claim(self, media_group_id: str, version: int) -> Optional[List[Any]]:
+        """
+        Выдача собранного альбома для обработки
+
+        Args:
+            media_group_id: ID медиа-группы
+            version: Версия последней части, полученной этим worker'ом
+
+        Returns:
+            Все части альбома по порядку или None, если после version
+            пришли новые части или альбом уже выдан другому worker'у
+
+        Raises:
+            AlbumLost: Части альбома удалены хранилищем
+        """
+
+    @abstractmethod
+    async def discard(self, media_group_id: str):
+        """
+        Удаление частей альбома, который не будет обработан
+        """
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryAlbumStore(AlbumStore):
+    """
+    Части альбомов в памяти процесса
+
+    Альбомы лежат в порядке первой части. Невыданные альбомы старше ttl
+    и самые давние сверх max_albums удаляются при добавлении частей.
+    Выданные альбомы помнятся ttl секунд (для claim() других коллекторов
+    с тем же хранилищем).
+    """
+
+    def __init__(self, ttl: float = 60.0, max_albums: int = 10_000):
+        """
+        Args:
+            ttl: Через сколько секунд невыданный альбом удаляется
+            max_albums: Сколько невыданных альбомов хранится
+        """
+        self.ttl = ttl
+        self.max_albums = max_albums
+        # media_group_id -> (момент первой части, части)
+        self._albums: "OrderedDict[str, tuple]" = OrderedDict()
+        # Выданные альбомы: media_group_id -> момент выдачи
+        self._claimed: "OrderedDict[str, float]" = OrderedDict()
+        # Счетчик альбомов, удаленных по ttl или max_albums
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._albums)
+
+    def _evict(self, now: float):
+        while self._albums:
+            started_at, _ = next(iter(self._albums.values()))
+            if now - started_at < self.ttl and len(self._albums) < self.max_albums:
+                break
+            self._albums.popitem(last=False)
+            self.evicted += 1
+        while self._claimed and now - next(iter(self._claimed.values())) >= self.ttl:
+            self._claimed.popitem(last=False)
+
+    async def add_part(self, media_group_id: str, part: Any) -> int:
+        album = self._albums.get(media_group_id)
+        if album is None:
+            now = time.monotonic()
+            self._evict(now)
+            album = self._albums[media_group_id] = (now, [])
+        album[1].append(part)
+        return len(album[1])
+
+    async def claim(self, media_group_id: str, version: int) -> Optional[List[Any]]:
+        album = self._albums.get(media_group_id)
+        if album is None:
+            if media_group_id in self._claimed:
+                return None
+            raise AlbumLost(media_group_id)
+        if len(album[1]) > version:
+            return None
+        if len(album[1]) < version:
+            raise AlbumLost(media_group_id)
+        del self._albums[media_group_id]
+        self._claimed[media_group_id] = time.monotonic()
+        return album[1]
+
+    async def discard(self, media_group_id: str):
+        self._albums.pop(media_group_id, None)
+
+
+class RedisAlbumStore(AlbumStore):
+    """
+    Части альбомов в Redis, общие для всех worker'ов
+
+    Части альбома хранятся списком album:<media_group_id>. RPUSH
+    возвращает длину списка - это и есть версия. claim() выполняется
+    Lua-скриптом, поэтому проверка версии и удаление альбома атомарны;
+    выданный альбом ttl секунд помечен ключом album:<media_group_id>:claimed.
+
+    Redis хранит строки, поэтому части сериализуются функциями encode
+    и decode (например, Message.model_dump_json / Message.model_validate_json).
+    Клиент должен быть создан с decode_responses=True.
+    """
+
+    def __init__(
+        self,
+        redis: Any,
+        encode: Callable[[Any], str],
+        decode: Callable[[str], Any],
+        ttl: int = 60,
+        prefix: str = "album"
+    ):
+        """
+        Args:
+            redis: Клиент redis.asyncio.Redis
+            encode: Часть альбома -> строка
+            decode: Строка -> часть альбома
+            ttl: Через сколько секунд невыданный альбом удаляется
+            prefix: Префикс ключей
+        """
+        self.redis = redis
+        self.encode = encode
+        self.decode = decode
+        self.ttl = ttl
+        self.prefix = prefix
+        self._claim = redis.register_script(CLAIM_SCRIPT)
+
+    def _key(self, media_group_id: str) -> str:
+        return f"{self.prefix}:{media_group_id}"
+
+    async def add_part(self, media_group_id: str, part: Any) -> int:
+        key = self._key(media_group_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, self.encode(part))
+            pipe.expire(key, self.ttl)
+            version, _ = await pipe.execute()
+        return version
+
+    async def claim(self, media_group_id: str, version: int) -> Optional[List[Any]]:
+        key = self._key(media_group_id)
+        result = await self._claim(keys=[key, f"{key}:claimed"], args=[version, self.ttl])
+        if result == -1:
+            raise AlbumLost(media_group_id)
+        if not result:
+            return None
+        return [self.decode(part) for part in result]
+
+    async def discard(self, media_group_id: str):
+        await self.redis.delete(self._key(media_group_id))
+
+    async def close(self) -> None:
+        await self.redis.aclose()
@@ -6,12 +6,12 @@ Telegram Bot Example 8: Media Group Albums (python-telegram-bot)
 import asyncio
 import logging
 import os
-from collections import defaultdict
+import time
 from io import BytesIO
 from pathlib import Path
 from typing import Dict, List
 
-from telegram import Update, InputMediaPhoto
+from telegram import Update, InputMediaPhoto, PhotoSize
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -19,7 +19,9 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+
+from renderer import FONT_BOLD, Renderer, load_font, preload_fonts, workers_from_env
 
 # Настройка логирования
 logging.basicConfig(
@@ -37,9 +39,69 @@ if not BOT_TOKEN:
 IMAGES_DIR = Path("generated_albums")
 IMAGES_DIR.mkdir(exist_ok=True)
 
+# Шрифты функций отрисовки (загружаются заранее)
+FONTS = [(FONT_BOLD, 60)]
+
+# Пул процессов отрисовки (см. renderer.py)
+renderer = Renderer(
+    workers=workers_from_env(),
+    initializer=preload_fonts,
+    initargs=(FONTS,)
+)
+
 # Словарь для хранения альбомов от пользователей
 # Структура: {media_group_id: [Photo, Photo, ...]}
-user_albums: Dict[str, List] = defaultdict(list)
+# Альбомы лежат в порядке первого фото: самый давний - первый
+user_albums: Dict[str, List] = {}
+# Когда пришло первое фото альбома (time.monotonic())
+album_started_at: Dict[str, float] = {}
+
+# Ограничения буфера, чтобы поток альбомов не занял всю память
+MAX_ALBUMS = 1000       # Сколько альбомов собирается одновременно
+MAX_ALBUM_SIZE = 10     # Больше 10 фото Telegram в альбом не собирает
+ALBUM_MAX_AGE = 60.0    # Через сколько секунд недособранный альбом удаляется
+
+# Сколько альбомов удалено недособранными и сколько лишних фото отброшено
+album_stats = {"evicted": 0, "dropped_photos": 0}
+
+
+def discard_album(media_group_id: str):
+    """
+    Удаление альбома из буфера
+    """
+    user_albums.pop(media_group_id, None)
+    album_started_at.pop(media_group_id, None)
+
+
+def add_album_photo(media_group_id: str, photo: PhotoSize) -> bool:
+    """
+    Добавление фото в буфер альбомов
+
+    Сначала удаляет альбомы старше ALBUM_MAX_AGE и самые давние сверх
+    MAX_ALBUMS (они всегда в начале словаря).
+
+    Returns:
+        False, если фото отброшено (в альбоме уже MAX_ALBUM_SIZE фото)
+    """
+    now = time.monotonic()
+    if media_group_id not in user_albums:
+        while user_albums:
+            oldest = next(iter(user_albums))
+            if (now - album_started_at[oldest] < ALBUM_MAX_AGE
+                    and len(user_albums) < MAX_ALBUMS):
+                break
+            discard_album(oldest)
+            album_stats["evicted"] += 1
+        user_albums[media_group_id] = []
+        album_started_at[media_group_id] = now
+
+    photos = user_albums[media_group_id]
+    if len(photos) >= MAX_ALBUM_SIZE:
+        album_stats["dropped_photos"] += 1
+        return False
+
+    photos.append(photo)
+    return True
 
 
 def generate_colored_image(color: tuple, text: str, size=(800, 600)) -> BytesIO:
@@ -58,11 +120,7 @@ def generate_colored_image(color: tuple, text: str, size=(800, 600)) -> BytesIO:
     image = Image.new('RGB', size, color=color)
     draw = ImageDraw.Draw(image)
 
-    # Пытаемся загрузить шрифт
-    try:
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 60)
-    except:
-        font = ImageFont.load_default()
+    font = load_font(FONT_BOLD, 60)
 
     # Рисуем текст в центре
     bbox = draw.textbbox((0, 0), text, font=font)
@@ -107,9 +165,13 @@ async def generate_album(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         ((0, 0, 255), "Синий")
     ]
 
-    for i, (color, name) in enumerate(colors):
-        image_bio = generate_colored_image(color, name)
+    # Рисуем изображения параллельно в пуле процессов
+    images = await asyncio.gather(*(
+        renderer.render(generate_colored_image, color, name)
+        for color, name in colors
+    ))
 
+    for i, ((color, name), image_bio) in enumerate(zip(colors, images)):
         # Первое изображение с caption
         if i == 0:
             media.append(
@@ -135,8 +197,10 @@ async def compare_images(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await update.message.reply_text("🔄 Создаю сравнение 'До и После'...")
 
     # Создаем два изображения: "до" и "после"
-    before_bio = generate_colored_image((100, 100, 100), "ДО обработки")
-    after_bio = generate_colored_image((255, 215, 0), "ПОСЛЕ обработки")
+    before_bio, after_bio = await asyncio.gather(
+        renderer.render(generate_colored_image, (100, 100, 100), "ДО обработки"),
+        renderer.render(generate_colored_image, (255, 215, 0), "ПОСЛЕ обработки")
+    )
 
     # Создаем список InputMediaPhoto
     media = [
@@ -170,9 +234,13 @@ async def generate_variants(update: Update, context: ContextTypes.DEFAULT_TYPE)
         ((255, 255, 100), "Вариант 4"),
     ]
 
-    for i, (color, name) in enumerate(variants):
-        image_bio = generate_colored_image(color, name, size=(512, 512))
+    # Рисуем изображения параллельно в пуле процессов
+    images = await asyncio.gather(*(
+        renderer.render(generate_colored_image, color, name, size=(512, 512))
+        for color, name in variants
+    ))
 
+    for i, ((color, name), image_bio) in enumerate(zip(variants, images)):
         if i == 0:
             media.append(
                 InputMediaPhoto(
@@ -204,8 +272,8 @@ async def handle_album(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
         # Добавляем фото в словарь альбомов
         # Сохраняем самое большое фото (последнее в списке)
-        photo = message.photo[-1]
-        user_albums[media_group_id].append(photo)
+        if not add_album_photo(media_group_id, message.photo[-1]):
+            return
 
         logger.info(
             f"Получено фото {len(user_albums[media_group_id])} "
@@ -216,31 +284,32 @@ async def handle_album(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         await asyncio.sleep(0.5)
 
         # Проверяем, что это последнее фото в альбоме
-        current_count = len(user_albums[media_group_id])
+        # Альбом мог быть удален из буфера, пока мы ждали
+        current_count = len(user_albums.get(media_group_id, ()))
 
         # Ждем еще немного для уверенности
         await asyncio.sleep(0.3)
 
         # Если количество не изменилось, альбом завершен
-        if current_count == len(user_albums[media_group_id]):
-            photos = user_albums[media_group_id]
-
-            await message.reply_text(
-                f"📸 <b>Получен альбом!</b>\n\n"
-                f"Количество фотографий: {len(photos)}\n"
-                f"Media Group ID: <code>{media_group_id}</code>\n\n"
-                f"Размеры фотографий:\n" +
-                "\n".join([f"  • {p.width}x{p.height} px" for p in photos]),
-                parse_mode="HTML"
-            )
-
-            logger.info(
-                f"Обработан альбом {media_group_id} "
-                f"из {len(photos)} фотографий"
-            )
+        photos = user_albums.get(media_group_id)
+        if photos and current_count == len(photos):
+            try:
+                await message.reply_text(
+                    f"📸 <b>Получен альбом!</b>\n\n"
+                    f"Количество фотографий: {len(photos)}\n"
+                    f"Media Group ID: <code>{media_group_id}</code>\n\n"
+                    f"Размеры фотографий:\n" +
+                    "\n".join([f"  • {p.width}x{p.height} px" for p in photos]),
+                    parse_mode="HTML"
+                )
 
-            # Удаляем обработанный альбом
-            del user_albums[media_group_id]
+                logger.info(
+                    f"Обработан альбом {media_group_id} "
+                    f"из {len(photos)} фотографий"
+                )
+            finally:
+                # Удаляем обработанный альбом, даже если ответ не отправился
+                discard_album(media_group_id)
 
     else:
         # Одиночное фото (не в альбоме)
@@ -254,6 +323,10 @@ async def handle_album(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 def main() -> None:
     """Главная функция запуска бота"""
+    # Пул отрисовки запускается до polling (см. Renderer.start)
+    renderer.start()
+    preload_fonts(FONTS)
+
     # Создаем приложение
     application = Application.builder().token(BOT_TOKEN).build()
 
@@ -271,7 +344,12 @@ def main() -> None:
     logger.info("Бот запущен и готов к работе!")
 
     # Запускаем бота
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    try:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        renderer.close()
+
+    logger.info(f"Статистика альбомов: {album_stats}")
 
 
 if __name__ == "__main__":
@@ -3,13 +3,15 @@ Telegram Bot Example 9: Media Group Albums с Middleware (python-telegram-bot)
 Демонстрирует правильную обработку альбомов с использованием middleware
 """
 
+import asyncio
+import json
 import logging
 import os
+import time
 from io import BytesIO
 from pathlib import Path
-from typing import List
 
-from telegram import Update, InputMediaPhoto
+from telegram import Bot, Update, InputMediaPhoto
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -17,9 +19,12 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 
+from album_download import download_album
 from album_middleware import AlbumCollector, get_album_messages
+from album_store import AlbumStore, MemoryAlbumStore
+from renderer import FONT_BOLD, Renderer, load_font, preload_fonts, workers_from_env
 
 # Настройка логирования
 logging.basicConfig(
@@ -37,8 +42,25 @@ if not BOT_TOKEN:
 IMAGES_DIR = Path("generated_albums")
 IMAGES_DIR.mkdir(exist_ok=True)
 
-# ⭐ Создаем экземпляр AlbumCollector
-album_collector = AlbumCollector(latency=0.3)
+# Шрифты функций отрисовки (загружаются заранее)
+FONTS = [(FONT_BOLD, 60)]
+
+# Пул процессов отрисовки (см. renderer.py)
+renderer = Renderer(
+    workers=workers_from_env(),
+    initializer=preload_fonts,
+    initargs=(FONTS,)
+)
+
+# Ограничения сбора альбомов: общие для middleware и хранилища частей
+MAX_ALBUMS = 1000       # Сколько альбомов собирается одновременно
+ALBUM_MAX_AGE = 5.0     # Альбом обрабатывается не позже чем через столько секунд
+# Части хранятся с запасом: альбом выдается не позже ALBUM_MAX_AGE
+ALBUM_STORE_TTL = 2 * ALBUM_MAX_AGE
+
+# Сколько фото скачивается одновременно - во всех альбомах вместе
+ALBUM_DOWNLOAD_CONCURRENCY = 4
+album_downloads = asyncio.Semaphore(ALBUM_DOWNLOAD_CONCURRENCY)
 
 
 def generate_colored_image(color: tuple, text: str, size=(800, 600)) -> BytesIO:
@@ -57,11 +79,7 @@ def generate_colored_image(color: tuple, text: str, size=(800, 600)) -> BytesIO:
     image = Image.new('RGB', size, color=color)
     draw = ImageDraw.Draw(image)
 
-    # Пытаемся загрузить шрифт
-    try:
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 60)
-    except:
-        font = ImageFont.load_default()
+    font = load_font(FONT_BOLD, 60)
 
     # Рисуем текст в центре
     bbox = draw.textbbox((0, 0), text, font=font)
@@ -106,8 +124,13 @@ async def cmd_generate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     ]
 
     media = []
-    for i, (color, name) in enumerate(colors):
-        image_bio = generate_colored_image(color, name)
+    # Рисуем изображения параллельно в пуле процессов
+    images = await asyncio.gather(*(
+        renderer.render(generate_colored_image, color, name)
+        for color, name in colors
+    ))
+
+    for i, ((color, name), image_bio) in enumerate(zip(colors, images)):
         media.append(
             InputMediaPhoto(
                 media=image_bio,
@@ -123,11 +146,11 @@ async def cmd_compare(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     """Генерирует сравнение 'До и После'"""
     await update.message.reply_text("🔄 Создаю сравнение 'До и После'...")
 
-    # Изображение "До"
-    before_img = generate_colored_image((150, 150, 150), "ДО", size=(600, 400))
-
-    # Изображение "После"
-    after_img = generate_colored_image((100, 200, 255), "ПОСЛЕ", size=(600, 400))
+    # Изображения "До" и "После" рисуются параллельно
+    before_img, after_img = await asyncio.gather(
+        renderer.render(generate_colored_image, (150, 150, 150), "ДО", size=(600, 400)),
+        renderer.render(generate_colored_image, (100, 200, 255), "ПОСЛЕ", size=(600, 400))
+    )
 
     media = [
         InputMediaPhoto(media=before_img, caption="📊 Сравнение: До и После"),
@@ -151,8 +174,13 @@ async def cmd_variants(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     ]
 
     media = []
-    for i, (color, name) in enumerate(variants):
-        image_bio = generate_colored_image(color, name, size=(512, 512))
+    # Рисуем изображения параллельно в пуле процессов
+    images = await asyncio.gather(*(
+        renderer.render(generate_colored_image, color, name, size=(512, 512))
+        for color, name in variants
+    ))
+
+    for i, ((color, name), image_bio) in enumerate(zip(variants, images)):
         media.append(
             InputMediaPhoto(
                 media=image_bio,
@@ -181,25 +209,31 @@ async def handle_album(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     message = update.effective_message
     media_group_id = message.media_group_id
 
-    # Извлекаем все фото из альбома
-    photos = []
-    for upd in album_updates:
-        if upd.effective_message.photo:
-            photos.append(upd.effective_message.photo[-1])
+    # Скачиваем все фото альбома параллельно
+    started = time.perf_counter()
+    downloaded = await download_album(album_updates, album_downloads)
+    elapsed = time.perf_counter() - started
+    # Быстрее самого долгого скачивания альбом не скачать
+    slowest = max((photo.seconds for photo in downloaded), default=0.0)
 
     await message.reply_text(
         f"📸 <b>Получен альбом!</b>\n\n"
-        f"Количество фотографий: {len(photos)}\n"
+        f"Количество фотографий: {len(downloaded)}\n"
         f"Media Group ID: <code>{media_group_id}</code>\n\n"
         f"Размеры фотографий:\n" +
-        "\n".join([f"  • {p.width}x{p.height} px" for p in photos]) +
+        "\n".join([
+            f"  • {d.photo.width}x{d.photo.height} px, {d.content.getbuffer().nbytes // 1024} КБ"
+            for d in downloaded
+        ]) +
+        f"\n\n⏱ Скачано за {elapsed:.2f} сек (самое долгое фото: {slowest:.2f} сек)"
         f"\n\n✅ Обработано middleware - без дублирования!",
         parse_mode="HTML"
     )
 
     logger.info(
         f"Обработан альбом {media_group_id} "
-        f"из {len(photos)} фотографий (один раз)"
+        f"из {len(downloaded)} фотографий (один раз) "
+        f"за {elapsed:.2f} сек, самое долгое фото {slowest:.2f} сек"
     )
 
 
@@ -214,10 +248,54 @@ async def handle_single_photo(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
 
 
+def create_album_store(bot: Bot) -> AlbumStore:
+    """
+    Хранилище частей альбомов: Redis, если задан REDIS_URL (бот запущен
+    несколькими worker'ами), иначе память процесса
+    """
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        # redis нужен только для общего хранилища, поэтому импортируем здесь
+        from redis.asyncio import Redis
+        from album_store import RedisAlbumStore
+
+        return RedisAlbumStore(
+            Redis.from_url(redis_url, decode_responses=True),
+            encode=lambda update: json.dumps(update.to_dict()),
+            decode=lambda raw: Update.de_json(json.loads(raw), bot),
+            ttl=int(ALBUM_STORE_TTL)
+        )
+    return MemoryAlbumStore(ttl=ALBUM_STORE_TTL, max_albums=MAX_ALBUMS)
+
+
+async def close_album_store(application: Application) -> None:
+    """Закрытие хранилища альбомов при остановке бота"""
+    album_collector = application.bot_data["album_collector"]
+    await album_collector.store.close()
+
+
 def main() -> None:
     """Главная функция запуска бота"""
+    # Пул отрисовки запускается до polling (см. Renderer.start)
+    renderer.start()
+    preload_fonts(FONTS)
+
     # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_shutdown(close_album_store)
+        .build()
+    )
+
+    # ⭐ Создаем экземпляр AlbumCollector
+    album_collector = AlbumCollector(
+        latency=0.3,
+        max_albums=MAX_ALBUMS,
+        max_age=ALBUM_MAX_AGE,
+        store=create_album_store(application.bot)
+    )
+    application.bot_data["album_collector"] = album_collector
 
     # Регистрируем обработчики команд
     application.add_handler(CommandHandler("start", start))
@@ -247,7 +325,12 @@ def main() -> None:
     logger.info("Альбомы будут обрабатываться без дублирования")
 
     # Запускаем бота
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    try:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        renderer.close()
+
+    logger.info(f"Статистика альбомов: {album_collector.stats()}")
 
 
 if __name__ == "__main__":
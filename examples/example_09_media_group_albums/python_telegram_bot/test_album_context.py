@@ -0,0 +1,80 @@
+"""
+Нагрузочный тест сборки альбомов (python-telegram-bot)
+
+Несколько пользователей одновременно отправляют по несколько альбомов,
+обработчики альбомов одного пользователя выполняются одновременно.
+Каждый вызов обработчика должен видеть в контексте только свой альбом.
+Запуск из этой папки:
+
+    python -m pytest
+"""
+
+import asyncio
+import random
+from datetime import datetime
+from typing import Dict, List
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import Application, CallbackContext
+
+from album_middleware import AlbumCollector, get_album_messages
+
+USERS = 5
+ALBUMS_PER_USER = 20
+
+
+def make_update(update_id: int, user_id: int, media_group_id: str) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name="Test"),
+            media_group_id=media_group_id
+        )
+    )
+
+
+def test_each_handler_sees_only_its_album():
+    rng = random.Random(1)
+    application = Application.builder().token("42:TEST").build()
+    collector = AlbumCollector()
+    expected: Dict[str, List[int]] = {}
+    calls: Dict[str, List[List[int]]] = {}
+
+    async def handle_album(update: Update, context: CallbackContext):
+        # Пока обработчик работает, собираются и обрабатываются другие
+        # альбомы того же пользователя
+        await asyncio.sleep(rng.uniform(0, 0.05))
+        media_group_id = update.effective_message.media_group_id
+        album = get_album_messages(update, context) or []
+        calls.setdefault(media_group_id, []).append([part.update_id for part in album])
+
+    wrapped = collector.wrap_handler(handle_album)
+
+    async def send(user_id: int, index: int):
+        media_group_id = f"{user_id}-{index}"
+        first = user_id * 10_000 + index * 100
+        expected[media_group_id] = list(range(first, first + rng.randint(2, 10)))
+        await asyncio.sleep(rng.uniform(0, 0.2))
+        for update_id in expected[media_group_id]:
+            update = make_update(update_id, user_id, media_group_id)
+            # Как Application.process_update: новый контекст на каждый update
+            await wrapped(update, CallbackContext.from_update(update, application))
+            await asyncio.sleep(0)
+
+    async def main():
+        await asyncio.gather(*(
+            send(user_id, index)
+            for user_id in range(1, USERS + 1)
+            for index in range(ALBUMS_PER_USER)
+        ))
+        while collector.albums:
+            await asyncio.sleep(0.01)
+        # Даем завершиться обработчикам последних альбомов
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert calls == {media_group_id: [ids] for media_group_id, ids in expected.items()}
+    assert collector.stats()["processed"] == USERS * ALBUMS_PER_USER
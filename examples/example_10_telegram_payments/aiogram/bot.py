@@ -21,7 +21,9 @@ from aiogram.types import (
     BufferedInputFile
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+
+from renderer import FONT_BOLD, Renderer, load_font, preload_fonts, workers_from_env
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -35,6 +37,16 @@ if not BOT_TOKEN:
 # Роутер для обработчиков
 router = Router()
 
+# Шрифты функций отрисовки (загружаются заранее)
+FONTS = [(FONT_BOLD, 40)]
+
+# Пул процессов отрисовки (см. renderer.py)
+renderer = Renderer(
+    workers=workers_from_env(),
+    initializer=preload_fonts,
+    initargs=(FONTS,)
+)
+
 # Хранилище платежей (в production используйте БД!)
 # Структура: {user_id: {"payment_id": str, "timestamp": datetime}}
 user_payments: Dict[int, dict] = {}
@@ -56,11 +68,7 @@ def generate_ai_image(text: str, color: tuple = (100, 150, 255)) -> BytesIO:
     image = Image.new('RGB', (512, 512), color=color)
     draw = ImageDraw.Draw(image)
 
-    # Пытаемся загрузить шрифт
-    try:
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 40)
-    except:
-        font = ImageFont.load_default()
+    font = load_font(FONT_BOLD, 40)
 
     # Рисуем текст
     bbox = draw.textbbox((0, 0), text, font=font)
@@ -212,7 +220,7 @@ async def process_successful_payment(message: Message, bot: Bot):
     # Предоставляем услугу в зависимости от типа покупки
     if payment.invoice_payload == "basic_generation":
         # Базовая генерация
-        image = generate_ai_image("Basic AI Art", color=(100, 100, 200))
+        image = await renderer.render(generate_ai_image, "Basic AI Art", color=(100, 100, 200))
         await message.answer_photo(
             BufferedInputFile(image.read(), "basic_art.png"),
             caption="🎨 Ваше базовое изображение готово!"
@@ -220,7 +228,7 @@ async def process_successful_payment(message: Message, bot: Bot):
 
     elif payment.invoice_payload == "premium_generation":
         # Премиум генерация
-        image = generate_ai_image("Premium AI Art", color=(200, 100, 200))
+        image = await renderer.render(generate_ai_image, "Premium AI Art", color=(200, 100, 200))
         await message.answer_photo(
             BufferedInputFile(image.read(), "premium_art.png"),
             caption="✨ Ваше премиум изображение готово!"
@@ -327,6 +335,10 @@ async def show_payments_info(message: Message):
 
 async def main():
     """Главная функция запуска бота"""
+    # Пул отрисовки запускается до polling (см. Renderer.start)
+    renderer.start()
+    preload_fonts(FONTS)
+
     # Создаем бота и диспетчер
     bot = Bot(token=BOT_TOKEN)
     dp = Dispatcher()
@@ -341,6 +353,7 @@ async def main():
         await dp.start_polling(bot)
     finally:
         await bot.session.close()
+        renderer.close()
 
 
 if __name__ == "__main__":
@@ -18,7 +18,9 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+
+from renderer import FONT_BOLD, Renderer, load_font, preload_fonts, workers_from_env
 
 # Настройка логирования
 logging.basicConfig(
@@ -36,6 +38,16 @@ if not BOT_TOKEN:
 # Структура: {user_id: {"payment_id": str, "timestamp": datetime}}
 user_payments: Dict[int, dict] = {}
 
+# Шрифты функций отрисовки (загружаются заранее)
+FONTS = [(FONT_BOLD, 40)]
+
+# Пул процессов отрисовки (см. renderer.py)
+renderer = Renderer(
+    workers=workers_from_env(),
+    initializer=preload_fonts,
+    initargs=(FONTS,)
+)
+
 
 def generate_ai_image(text: str, color: tuple = (100, 150, 255)) -> BytesIO:
     """
@@ -53,11 +65,7 @@ def generate_ai_image(text: str, color: tuple = (100, 150, 255)) -> BytesIO:
     image = Image.new('RGB', (512, 512), color=color)
     draw = ImageDraw.Draw(image)
 
-    # Пытаемся загрузить шрифт
-    try:
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 40)
-    except:
-        font = ImageFont.load_default()
+    font = load_font(FONT_BOLD, 40)
 
     # Рисуем текст
     bbox = draw.textbbox((0, 0), text, font=font)
@@ -201,7 +209,7 @@ async def successful_payment_callback(
     # Предоставляем услугу в зависимости от типа покупки
     if payment.invoice_payload == "basic_generation":
         # Базовая генерация
-        image = generate_ai_image("Basic AI Art", color=(100, 100, 200))
+        image = await renderer.render(generate_ai_image, "Basic AI Art", color=(100, 100, 200))
         await update.message.reply_photo(
             photo=image,
             caption="🎨 Ваше базовое изображение готово!"
@@ -209,7 +217,7 @@ async def successful_payment_callback(
 
     elif payment.invoice_payload == "premium_generation":
         # Премиум генерация
-        image = generate_ai_image("Premium AI Art", color=(200, 100, 200))
+        image = await renderer.render(generate_ai_image, "Premium AI Art", color=(200, 100, 200))
         await update.message.reply_photo(
             photo=image,
             caption="✨ Ваше премиум изображение готово!"
@@ -314,6 +322,10 @@ async def my_payments_command(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 def main() -> None:
     """Главная функция запуска бота"""
+    # Пул отрисовки запускается до polling (см. Renderer.start)
+    renderer.start()
+    preload_fonts(FONTS)
+
     # Создаем приложение
     application = Application.builder().token(BOT_TOKEN).build()
 
@@ -336,7 +348,10 @@ def main() -> None:
     logger.info("Бот запущен и готов принимать платежи!")
 
     # Запускаем бота
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    try:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        renderer.close()
 
 
 if __name__ == "__main__":